@@ -1,11 +1,27 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from api.endpoints import consulta_01  # Asegúrate de que esta ruta es correcta
+from src.db.registro_engines import calentar, cerrar_todos
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Engine "api" creado y con el pool abierto antes de la primera petición
+    try:
+        calentar(["api"])
+    except Exception as e:
+        print(f"⚠️ No se pudo calentar el engine de la API: {e}")
+    yield
+    cerrar_todos()
+
 
 app = FastAPI(
     title="API IXORIGUE",
     description="API para servir datos a dashboards y herramientas internas.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Middleware CORS para permitir llamadas desde Streamlit u otras apps externas
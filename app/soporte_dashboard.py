@@ -9,6 +9,7 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 from datetime import datetime
+from src.almacen.instantaneas import fecha_instantanea, leer_instantanea, ultima_instantanea
 from src.features.consulta_1 import aplicar_clasificaciones_temporales
 
 st.set_page_config(layout="wide", page_title="📱 Dashboard Soporte - Dispositivos")
@@ -82,26 +83,19 @@ CARPETA = "data/processed"
 PREFIJO = "consulta_01"
 
 def encontrar_csv_reciente(prefijo, carpeta):
-    archivos = [f for f in os.listdir(carpeta) if f.startswith(prefijo) and f.endswith(".csv")]
-    if not archivos:
-        return None
-    archivos.sort(reverse=True)
-    return os.path.join(carpeta, archivos[0])
+    return ultima_instantanea(prefijo, carpeta)  # Parquet (o CSV antiguo)
 
 ruta_csv = encontrar_csv_reciente(PREFIJO, CARPETA)
 
 if ruta_csv:
     nombre_archivo = os.path.basename(ruta_csv)
     try:
-        partes = nombre_archivo.replace(".csv", "").split("_")
-        fecha = partes[2]
-        hora = partes[3].replace("-", ":")
-        fecha_hora_formateada = f"{fecha} {hora}"
+        fecha_hora_formateada = fecha_instantanea(ruta_csv).strftime("%Y-%m-%d %H:%M")
     except Exception:
         fecha_hora_formateada = "Fecha desconocida"
 
     st.title(f"📱Dashboard Soporte consulta últimas 24h: {fecha_hora_formateada}")
-    df_original = pd.read_csv(ruta_csv)
+    df_original = leer_instantanea(ruta_csv, categorias=False)
 
     # Normalización de Country y región
     if "Country" in df_original.columns:
@@ -216,7 +210,7 @@ with tab1:
             st.plotly_chart(fig, use_container_width=True)
 
         if "ranch_name" in df.columns:
-            df_ranch = df.groupby("ranch_name")["device_id"].nunique().reset_index()
+            df_ranch = df.groupby("ranch_name", observed=True)["device_id"].nunique().reset_index()
             df_ranch.columns = ["Ganadería", "Nº Dispositivos"]
             fig = px.bar(df_ranch, x="Ganadería", y="Nº Dispositivos", title=f"Dispositivos por Ganadería – {filtro_titulo}", text_auto=True)
             st.plotly_chart(fig, use_container_width=True)
@@ -355,7 +349,7 @@ with tab2:
         if c not in df_work.columns:
             df_work[c] = None
 
-    grp = df_work.groupby("ranch_name", dropna=False)
+    grp = df_work.groupby("ranch_name", dropna=False, observed=True)
 
     def agg_bool_all(s):
         # true solo si TODOS los valores son True (ignorando NaN -> False)
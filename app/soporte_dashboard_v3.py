@@ -11,6 +11,7 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px  # seguimos usando Plotly en Tab 1
 import matplotlib.pyplot as plt  # Tab 2 pasa a Matplotlib
+from src.almacen.instantaneas import fecha_instantanea, leer_instantanea, ultima_instantanea
 
 # ==============================
 # Config básica
@@ -58,10 +59,7 @@ def infer_region_from_iso2(c_iso2: str | None) -> str:
 @st.cache_data(show_spinner=True)
 def encontrar_csv_reciente(prefijo: str, carpeta: str) -> str | None:
     try:
-        archivos = [f for f in os.listdir(carpeta) if f.startswith(prefijo) and f.endswith(".csv")]
-        if not archivos: return None
-        archivos.sort(reverse=True)
-        return os.path.join(carpeta, archivos[0])
+        return ultima_instantanea(prefijo, carpeta)  # Parquet (o CSV antiguo)
     except Exception:
         return None
 
@@ -71,14 +69,11 @@ def cargar_desde_csv() -> tuple[pd.DataFrame, str, str]:
     PREFIJO = "consulta_01"
     ruta_csv = encontrar_csv_reciente(PREFIJO, CARPETA)
     if not ruta_csv:
-        raise RuntimeError("No se encontró ningún archivo CSV procesado en data/processed.")
-    df = pd.read_csv(ruta_csv)
+        raise RuntimeError("No se encontró ninguna instantánea procesada en data/processed.")
+    df = leer_instantanea(ruta_csv, categorias=False)
     nombre_archivo = os.path.basename(ruta_csv)
     try:
-        partes = nombre_archivo.replace(".csv", "").split("_")
-        fecha = partes[2]
-        hora = partes[3].replace("-", ":")
-        fecha_hora_formateada = f"{fecha} {hora}"
+        fecha_hora_formateada = fecha_instantanea(ruta_csv).strftime("%Y-%m-%d %H:%M")
     except Exception:
         fecha_hora_formateada = "Fecha desconocida"
     return df, nombre_archivo, fecha_hora_formateada
@@ -234,7 +229,7 @@ with tab1:
             fig = px.pie(df, names="clasificacion_conexion", title=f"Distribución por Estado – {filtro_titulo}")
             st.plotly_chart(fig, use_container_width=True)
         if "ranch_name" in df.columns:
-            df_ranch = df.groupby("ranch_name")["device_id"].nunique().reset_index()
+            df_ranch = df.groupby("ranch_name", observed=True)["device_id"].nunique().reset_index()
             df_ranch.columns = ["Ganadería", "Nº Dispositivos"]
             fig = px.bar(df_ranch, x="Ganadería", y="Nº Dispositivos",
                          title=f"Dispositivos por Ganadería – {filtro_titulo}", text_auto=True)
@@ -385,7 +380,7 @@ with tab2:
     for c in ["ranch_name", "customer_name", "Country", "Region"]:
         if c not in df_work.columns: df_work[c] = None
 
-    grp = df_work.groupby("ranch_name", dropna=False)
+    grp = df_work.groupby("ranch_name", dropna=False, observed=True)
 
     def first_non_null(s):
         s2 = s.dropna()
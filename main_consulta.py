@@ -2,10 +2,18 @@ import sys
 import os
 import pandas as pd
 import importlib
-import inspect
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
-from src.db.connection import conectar_db
-import src.features.consulta_1 as features_modulo
+from src.almacen.historial import COLUMNAS_KPI, registrar_en_historial
+from src.almacen.instantaneas import guardar_instantanea
+from src.cache.ultimo_estado import parametros_gps_stats_full
+from src.db.ejecutor_chunks import consulta_en_curso, fijar_cancelacion
+from src.db.registro_engines import calentar
+from src.db.replicas import engine_para, replica_de
+import src.features.consulta_1  # registra las features del pipeline consulta_01
+from src.features.pipeline import ejecutar_pipeline
 
 sys.path.append(os.path.abspath("."))
 
@@ -18,76 +26,161 @@ CONSULTAS = [
    # "consulta_05"
 ]
 
-def generar_nombre_versionado(nombre_base, carpeta="data/processed", extension=".csv"):
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M")
-    base = f"{nombre_base}_{timestamp}"
-    version = 1
+# Consulta -> pipeline de features que se aplica a su resultado (src.features.pipeline)
+CONSULTAS_CON_FEATURES = {"consulta_01": "consulta_01"}
 
-    while True:
-        nombre_completo = f"{base}_v{version:02d}{extension}"
-        ruta_completa = os.path.join(carpeta, nombre_completo)
-        if not os.path.exists(ruta_completa):
-            return ruta_completa
-        version += 1
+# Tiempo máximo por consulta (segundos, desde que empieza a ejecutarse)
+TIMEOUT_CONSULTA_DEFECTO = int(os.getenv("CONSULTA_TIMEOUT_S", "3600"))
+TIMEOUTS_CONSULTA = {
+    "consulta_04": 3 * 3600,  # detalle por mensaje de 60 días
+    "consulta_05": 3 * 3600,
+}
 
 def probar_conexion():
     print("🔗 Probando conexión a la base de datos...")
     try:
-        engine = conectar_db()
+        engine = calentar(["batch"])["batch"]  # pool abierto antes de lanzar las consultas
         print("✅ Conexión exitosa.")
         return engine  # 🔁 devolvemos el engine directamente
     except Exception as e:
         print("❌ Error al conectar:", e)
         return None
 
-def aplicar_features_dinamicamente(df):
-    print("✨ Aplicando funciones de features...")
-    funciones = inspect.getmembers(features_modulo, inspect.isfunction)
-    aplicadas = []
-
-    for nombre_funcion, funcion in funciones:
-        if nombre_funcion.startswith("aplicar_"):
-            try:
-                print(f"  ➤ Aplicando `{nombre_funcion}`")
-                df = funcion(df)
-                aplicadas.append(nombre_funcion)
-            except Exception as e:
-                print(f"    ⚠️ Error en `{nombre_funcion}`: {e}")
-
-    print(f"✅ Se aplicaron {len(aplicadas)} funciones de features.")
+def aplicar_features(df, nombre_consulta):
+    """Pipeline de features de la consulta (en paralelo por niveles, con caché por feature)."""
+    pipeline = CONSULTAS_CON_FEATURES[nombre_consulta]
+    print(f"✨ Aplicando features del pipeline {pipeline}...")
+    df, _ = ejecutar_pipeline(df, pipeline)
     return df
 
-def ejecutar_consulta(nombre_consulta, engine):
+def ejecutar_consulta(nombre_consulta, engine, cancelada=None):
+    """
+    Ejecuta la consulta, aplica features si corresponde, guarda la instantánea (Parquet)
+    y, si la consulta tiene KPIs historizados, añade el delta al histórico.
+    `cancelada` (threading.Event): si se activa mientras corre (timeout del
+    orquestador), las consultas troceadas dejan de lanzar chunks (ejecutor_chunks
+    la comprueba entre chunks), el resultado se descarta y no se escribe nada.
+    """
     print(f"\n🚀 Ejecutando consulta: {nombre_consulta}")
+    inicio, t0 = datetime.now(), time.monotonic()
+    fijar_cancelacion(cancelada)
     try:
         modulo = importlib.import_module(f"scripts.consultas.{nombre_consulta}")
         df = modulo.ejecutar(engine)
 
-        if nombre_consulta == "consulta_01":
-            df = aplicar_features_dinamicamente(df)
+        if cancelada is not None and cancelada.is_set():
+            print(f"⏱️ {nombre_consulta} terminó fuera de tiempo; resultado descartado.")
+            return False
+
+        if nombre_consulta in CONSULTAS_CON_FEATURES:
+            df = aplicar_features(df, nombre_consulta)
 
-        os.makedirs("data/processed", exist_ok=True)
-        ruta_salida = generar_nombre_versionado(nombre_consulta)
-        df.to_csv(ruta_salida, index=False)
+        ruta_salida = guardar_instantanea(
+            df, nombre_consulta,
+            replica=replica_de(engine), duracion_s=time.monotonic() - t0, fecha=inicio,
+        )
         print(f"📁 Consulta guardada en: {ruta_salida}")
+
+        if nombre_consulta in COLUMNAS_KPI:
+            try:
+                registrar_en_historial(df, nombre_consulta, fecha=inicio)
+            except Exception as e:
+                print(f"⚠️ No se pudo actualizar el histórico de {nombre_consulta}: {e}")
         return True
 
     except Exception as e:
         print(f"❌ Error al ejecutar la consulta {nombre_consulta}: {e}")
         return False
+    finally:
+        fijar_cancelacion(None)
+
+def ejecutar_concurrente(engine, consultas, max_workers=None, timeouts=None):
+    """
+    Ejecuta las consultas en paralelo sobre el mismo engine.
+    - Hilos = min(nº de consultas, pool_size del engine).
+    - Los chunks de las consultas troceadas comparten entre todas el resto de la
+      capacidad del pool (ejecutor_chunks.conexiones_chunks: pool_size + max_overflow
+      menos los hilos de consulta en curso): entre los dos niveles nunca se piden más
+      de pool_size + max_overflow conexiones.
+    - Cada consulta va a la réplica con menos retraso/carga en ese momento (src/db/replicas).
+    - El último estado (src/cache/ultimo_estado) se actualiza UNA vez antes de lanzar
+      los hilos; las consultas reutilizan esos parámetros en vez de repetir el delta.
+    - Cada hilo ejecuta, aplica features y escribe su instantánea en cuanto tiene el resultado.
+    - Timeout por consulta (TIMEOUTS_CONSULTA / TIMEOUT_CONSULTA_DEFECTO), contado
+      desde que empieza: se da por fallida, se activa su cancelación y su resultado
+      se descarta. Las consultas troceadas no lanzan más chunks (ni reintentos);
+      la sentencia que ya está en curso no se corta desde aquí y termina como mucho
+      al vencer su statement_timeout. Hasta entonces el hilo sigue vivo (el
+      intérprete lo espera al salir).
+    Devuelve (exitosas, fallidas).
+    """
+    limites = {**TIMEOUTS_CONSULTA, **(timeouts or {})}
+    n = max_workers or len(consultas)
+    try:
+        n = min(n, engine.pool.size())
+    except Exception:
+        pass
+    n = max(1, min(n, len(consultas)))
+
+    try:
+        parametros_gps_stats_full(engine)
+    except Exception as e:
+        print(f"⚠️ No se pudo actualizar el último estado antes de lanzar las consultas: {e}")
+
+    arranque = {}
+    canceladas = {c: threading.Event() for c in consultas}
+
+    def _tarea(nombre):
+        arranque[nombre] = time.monotonic()
+        eng = engine_para(engine)
+        with consulta_en_curso(eng):
+            return ejecutar_consulta(nombre, eng, canceladas[nombre])
+
+    exitosas, fallidas = [], []
+    t0 = time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=n, thread_name_prefix="consulta")
+    futuros = {pool.submit(_tarea, c): c for c in consultas}
+    pendientes = set(futuros)
+
+    while pendientes:
+        ahora = time.monotonic()
+        vencen = [
+            arranque[futuros[f]] + limites.get(futuros[f], TIMEOUT_CONSULTA_DEFECTO)
+            for f in pendientes
+            if futuros[f] in arranque
+        ]
+        # Despierta al primer vencimiento (o cada 5s, para las que aún no han arrancado)
+        espera = min([5.0] + [max(0.0, v - ahora) for v in vencen])
+        hechos, pendientes = wait(pendientes, timeout=espera, return_when=FIRST_COMPLETED)
+
+        for futuro in hechos:
+            nombre = futuros[futuro]
+            try:
+                ok = futuro.result()
+            except Exception as e:
+                print(f"❌ Error al ejecutar la consulta {nombre}: {e}")
+                ok = False
+            (exitosas if ok else fallidas).append(nombre)
+
+        ahora = time.monotonic()
+        for futuro in list(pendientes):
+            nombre = futuros[futuro]
+            limite = limites.get(nombre, TIMEOUT_CONSULTA_DEFECTO)
+            if nombre in arranque and ahora - arranque[nombre] > limite:
+                canceladas[nombre].set()
+                pendientes.discard(futuro)
+                fallidas.append(nombre)
+                print(f"⏱️ {nombre} superó su límite de {limite}s; se da por fallida.")
+
+    pool.shutdown(wait=False, cancel_futures=True)
+    print(f"⏱️ {len(consultas)} consultas en {time.monotonic() - t0:.1f}s con {n} hilos")
+    return exitosas, fallidas
+
 
 def main():
     engine = probar_conexion()
     if engine:
-        exitosas = []
-        fallidas = []
-
-        for consulta in CONSULTAS:
-            resultado = ejecutar_consulta(consulta, engine)
-            if resultado:
-                exitosas.append(consulta)
-            else:
-                fallidas.append(consulta)
+        exitosas, fallidas = ejecutar_concurrente(engine, CONSULTAS)
 
         print("\n📊 RESUMEN FINAL:")
         print(f"✅ Consultas exitosas: {len(exitosas)}/{len(CONSULTAS)}")
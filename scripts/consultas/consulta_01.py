@@ -12,10 +12,19 @@ import pandas as pd
 from sqlalchemy import text
 from sqlalchemy.exc import OperationalError
 
+from src.cache.ultimo_estado import SQL_GPS_STATS_FULL, con_coordenadas_en_servidor, parametros_gps_stats_full
+from src.db.lectura_tipada import ESQUEMA_DT01, leer_tipado
+from src.db.planes import capturar_si_activo
+from src.db.registro_engines import fijar_zona_horaria
+from src.db.variantes import gw_latest_distinct_on, inner_join_base, registrar_variantes, sql_activa
+
+# dtypes declarados al leer (porcentajes float32, contadores Int32, textos category)
+ESQUEMA = ESQUEMA_DT01
+
 # =========================
 #  SQL PRINCIPAL (24h, UTC)
 # =========================
-query = """
+query = f"""
 WITH active_devices AS (
   SELECT *
   FROM "Devices"
@@ -76,28 +85,8 @@ gps_stats_24h_all AS (
   GROUP BY d."Id"
 ),
 
--- Nota: calculado para todos los DeviceLocations, luego se cruza con base_filtered
-gps_stats_full AS (
-  SELECT
-    dl."DeviceId",
-    MAX(dl."Time") AS ultimo_mensaje_recibido,
-    (
-      SELECT MAX(sub."Time")
-      FROM "DeviceLocations" sub
-      WHERE sub."DeviceId" = dl."DeviceId"
-        AND sub."HasLocation" = TRUE
-    ) AS ultima_posicion_gps_valida,
-    (
-      SELECT sub."Location"
-      FROM "DeviceLocations" sub
-      WHERE sub."DeviceId" = dl."DeviceId"
-        AND sub."HasLocation" = TRUE
-      ORDER BY sub."Time" DESC
-      LIMIT 1
-    ) AS ultima_posicion_geom
-  FROM "DeviceLocations" dl
-  GROUP BY dl."DeviceId"
-),
+-- Nota: último estado por dispositivo desde la caché local (src/cache/ultimo_estado.py)
+{SQL_GPS_STATS_FULL},
 
 gps_stats_periodo AS (
   SELECT
@@ -361,14 +350,30 @@ LEFT JOIN ranch_status_final rsf ON rsf.ranch_id = r."Id"
 ORDER BY rsf.pct_ok_ajustada ASC NULLS LAST, r."Name", d."SerialNumber";
 """
 
+# Variante con lon/lat de la última posición calculados en el servidor (sin WKB)
+query_coordenadas = con_coordenadas_en_servidor(query)
+
+# Formulaciones alternativas del mismo resultado (ver src/db/variantes.py)
+VARIANTES = registrar_variantes(
+    "consulta_01",
+    {
+        "original": query,
+        "inner_join": inner_join_base(query),
+        "inner_join_distinct_on": gw_latest_distinct_on(inner_join_base(query)),
+    },
+    parametros=parametros_gps_stats_full,
+)
+
+
 # =========================
 #  FUNCIÓN CON RETRY
 # =========================
-def ejecutar(engine, set_timezone: str = "UTC", max_reintentos: int = 3):
+def ejecutar(engine, set_timezone: str = "UTC", max_reintentos: int = 3, coords_en_servidor: bool = False):
     """
     Ejecuta la consulta con retry automático para conflictos con recovery.
     - Implementa backoff exponencial
     - Detecta específicamente errores de réplica
+    - coords_en_servidor=True: ultima_posicion_lon/lat (decodificados en la caché) en lugar del WKB.
     """
     try:
         frame_file = inspect.getfile(inspect.currentframe())
@@ -376,16 +381,25 @@ def ejecutar(engine, set_timezone: str = "UTC", max_reintentos: int = 3):
     except Exception:
         nombre_script = "consulta_01"
 
+    # Variante promovida por comparar_variantes (la original si no hay ninguna)
+    sql = sql_activa("consulta_01")
+    if coords_en_servidor:
+        sql = con_coordenadas_en_servidor(sql)
+
+    params = None
     for intento in range(max_reintentos):
         try:
+            # Último estado por dispositivo (caché local incremental)
+            if params is None:
+                params = parametros_gps_stats_full(engine)
+
             with engine.connect() as con:
-                # Configurar sesión para réplica de lectura
-                if set_timezone:
-                    con.exec_driver_sql(f"SET TIME ZONE '{set_timezone}';")
-                con.exec_driver_sql("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY;")
-                
+                # Solo lectura ya viene del engine (default_transaction_read_only al conectar)
+                fijar_zona_horaria(con, set_timezone)
+
                 # Ejecutar query
-                df = pd.read_sql_query(text(query), con)
+                with capturar_si_activo(con, "consulta_01"):
+                    df = leer_tipado(con, text(sql), params, ESQUEMA)
 
             # Rellenar NaN solo en columnas numéricas
             num_cols = df.select_dtypes(include=["number"]).columns
@@ -22,10 +22,19 @@ import traceback
 import pandas as pd
 from sqlalchemy import text
 
+from src.cache.ultimo_estado import SQL_GPS_STATS_FULL, con_coordenadas_en_servidor, parametros_gps_stats_full
+from src.db.lectura_tipada import ESQUEMA_DT01, leer_tipado
+from src.db.planes import capturar_si_activo
+from src.db.registro_engines import fijar_zona_horaria
+from src.db.variantes import inner_join_base, registrar_variantes, sql_activa
+
+# dtypes declarados al leer (porcentajes float32, contadores Int32, textos category)
+ESQUEMA = ESQUEMA_DT01
+
 # =========================
 #  SQL PRINCIPAL (24h)
 # =========================
-query = """
+query = f"""
 WITH active_devices AS (
   SELECT *
   FROM "Devices"
@@ -72,27 +81,7 @@ gps_stats_24h_all AS (
   GROUP BY d."Id"
 ),
 
-gps_stats_full AS (
-  SELECT
-    dl."DeviceId",
-    MAX(dl."Time") AS ultimo_mensaje_recibido,
-    (
-      SELECT MAX(sub."Time")
-      FROM "DeviceLocations" sub
-      WHERE sub."DeviceId" = dl."DeviceId"
-        AND sub."HasLocation" = TRUE
-    ) AS ultima_posicion_gps_valida,
-    (
-      SELECT sub."Location"
-      FROM "DeviceLocations" sub
-      WHERE sub."DeviceId" = dl."DeviceId"
-        AND sub."HasLocation" = TRUE
-      ORDER BY sub."Time" DESC
-      LIMIT 1
-    ) AS ultima_posicion_geom
-  FROM "DeviceLocations" dl
-  GROUP BY dl."DeviceId"
-),
+{SQL_GPS_STATS_FULL},
 
 gps_stats_periodo AS (
   SELECT
@@ -260,15 +249,27 @@ WHERE (c."Status" = 'active' OR r."Name" IS NOT NULL)
 ORDER BY pct_recibidos_vs_esperados ASC NULLS LAST;
 """
 
+# Variante con lon/lat de la última posición calculados en el servidor (sin WKB)
+query_coordenadas = con_coordenadas_en_servidor(query)
+
+# Formulaciones alternativas del mismo resultado (ver src/db/variantes.py)
+VARIANTES = registrar_variantes(
+    "consulta_02",
+    {"original": query, "inner_join": inner_join_base(query)},
+    parametros=parametros_gps_stats_full,
+)
+
+
 # =========================
 #  EJECUCIÓN DESDE PYTHON
 # =========================
-def ejecutar(engine, set_timezone: str = "Europe/Madrid"):
+def ejecutar(engine, set_timezone: str = "Europe/Madrid", coords_en_servidor: bool = False):
     """
     Ejecuta la consulta usando SQLAlchemy 2.x y pandas.
     - Fija la zona horaria de sesión (por defecto Europe/Madrid).
     - Envuélvela con sqlalchemy.text() para evitar problemas con CTEs/ventanas.
     - Rellena NaN solo en columnas numéricas.
+    - coords_en_servidor=True: ultima_posicion_lon/lat (decodificados en la caché) en lugar del WKB.
     """
     try:
         frame_file = inspect.getfile(inspect.currentframe())
@@ -277,11 +278,17 @@ def ejecutar(engine, set_timezone: str = "Europe/Madrid"):
         nombre_script = "consulta_dt01"
 
     try:
+        # Variante promovida por comparar_variantes (la original si no hay ninguna)
+        sql = sql_activa("consulta_02")
+        if coords_en_servidor:
+            sql = con_coordenadas_en_servidor(sql)
+        params = parametros_gps_stats_full(engine)
+
         with engine.connect() as con:
-            if set_timezone:
-                con.exec_driver_sql(f"SET TIME ZONE '{set_timezone}';")
+            fijar_zona_horaria(con, set_timezone)
 
-            df = pd.read_sql_query(text(query), con)
+            with capturar_si_activo(con, "consulta_02"):
+                df = leer_tipado(con, text(sql), params, ESQUEMA)
 
         num_cols = df.select_dtypes(include=["number"]).columns
         if len(num_cols) > 0:
@@ -5,6 +5,8 @@ Salida alineada con CONSULTA 2 (mismos nombres de columnas).
 
 - Rango fijo definido en este archivo (edita FECHA_INICIO / FECHA_FIN_INCLUSIVA).
 - Estrategia CHUNKED por días -> evita 'conflict with recovery' en réplicas.
+- Contadores diarios cacheados en local (src/cache/agregados_diarios.py): solo se
+  consultan a la réplica los días que faltan (normalmente hoy y ayer).
 - Calcula promedios diarios y los expone con los mismos encabezados de CONSULTA 2.
 
 Columnas devueltas (idénticas a la consulta 2 detallada):
@@ -31,60 +33,20 @@ import pandas as pd
 from datetime import datetime, timedelta
 from sqlalchemy import text
 
+from src.cache.ultimo_estado import SQL_GPS_STATS_FULL, parametros_gps_stats_full
+from src.cache.agregados_diarios import CONTADORES, obtener_agregados
+from src.db.registro_engines import fijar_zona_horaria
+
 # =========================
 #  RANGO FIJO (edita aquí)
 # =========================
 FECHA_INICIO = "2025-07-22"       # incluida, 00:00
 FECHA_FIN_INCLUSIVA = "2025-08-21" # incluida, 23:59:59
 
-# =========================
-#  SQL: métricas de 1 día
-# =========================
-SQL_DIA = text("""
-WITH active_devices AS (
-  SELECT *
-  FROM "Devices"
-  WHERE "UplinksPerDay" IS NOT NULL
-    AND "Disabled" = FALSE
-    AND "StatusType" = 'shipped'
-),
-current_animals AS (
-  SELECT "DeviceId", MAX("Name") AS animal_name
-  FROM "Animals"
-  WHERE "IsDeregistered" = FALSE
-  GROUP BY "DeviceId"
-),
-base AS (
-  SELECT d.*, ca.animal_name
-  FROM active_devices d
-  RIGHT JOIN current_animals ca ON ca."DeviceId" = d."Id"
-  WHERE d."Id" IS NOT NULL
-)
-SELECT
-  b."Id" AS device_id,
-  b."UplinksPerDay" AS uplinks_per_day,
-
-  COUNT(dl."Time")                                                     AS recibidos_n,
-  COUNT(dl."Time") FILTER (WHERE NOT dl."HasLocation")                 AS sin_gps_n,
-  COUNT(dl."Time") FILTER (WHERE dl."HasLocation")                     AS con_gps_n,
-  COUNT(dl."Time") FILTER (WHERE dl."HasLocation" AND dl."IsValid")    AS validas_n,
-  COUNT(dl."Time") FILTER (WHERE dl."HasLocation" AND dl."IsValid" AND dl."IsLowAccuracy") AS baja_precision_n,
-  COUNT(dl."Time") FILTER (WHERE dl."HasLocation" AND NOT dl."IsValid") AS no_validas_n,
-  COUNT(dl."Time") FILTER (WHERE dl."HasLocation" AND NOT dl."IsValid" AND dl."InvalidReason" = 'parameters') AS no_valida_calidad_gps_n,
-  COUNT(dl."Time") FILTER (WHERE dl."HasLocation" AND NOT dl."IsValid" AND dl."InvalidReason" = 'distance')   AS no_valida_filtro_velocidad_n
-
-FROM base b
-LEFT JOIN "DeviceLocations" dl
-  ON dl."DeviceId" = b."Id"
- AND dl."Time" >= :inicio
- AND dl."Time" <  :fin
-GROUP BY b."Id", b."UplinksPerDay";
-""")
-
 # =========================
 #  SQL: metadatos + últimos mensajes (como consulta 2)
 # =========================
-SQL_META = text("""
+SQL_META = text(f"""
 WITH active_devices AS (
   SELECT *
   FROM "Devices"
@@ -104,27 +66,7 @@ base AS (
   RIGHT JOIN current_animals ca ON ca."DeviceId" = d."Id"
   WHERE d."Id" IS NOT NULL
 ),
-gps_stats_full AS (
-  SELECT
-    dl."DeviceId",
-    MAX(dl."Time") AS ultimo_mensaje_recibido,
-    (
-      SELECT MAX(sub."Time")
-      FROM "DeviceLocations" sub
-      WHERE sub."DeviceId" = dl."DeviceId"
-        AND sub."HasLocation" = TRUE
-    ) AS ultima_posicion_gps_valida,
-    (
-      SELECT sub."Location"
-      FROM "DeviceLocations" sub
-      WHERE sub."DeviceId" = dl."DeviceId"
-        AND sub."HasLocation" = TRUE
-      ORDER BY sub."Time" DESC
-      LIMIT 1
-    ) AS ultima_posicion_geom
-  FROM "DeviceLocations" dl
-  GROUP BY dl."DeviceId"
-)
+{SQL_GPS_STATS_FULL}
 SELECT
   b."Id"            AS device_id,
   b."SerialNumber"  AS "SerialNumber",
@@ -163,31 +105,31 @@ def ejecutar(engine, set_timezone: str = "Europe/Madrid") -> pd.DataFrame:
     dias = (end - start).days + 1
 
     try:
+        params_ue = parametros_gps_stats_full(engine)
+
         # --- 1) Extraer metadatos/últimos mensajes (1 única vez)
         with engine.connect() as con:
-            if set_timezone:
-                con.exec_driver_sql(f"SET TIME ZONE '{set_timezone}';")
+            fijar_zona_horaria(con, set_timezone)
             con.exec_driver_sql("SET LOCAL lock_timeout = '5s';")
             con.exec_driver_sql("SET LOCAL statement_timeout = '5min';")
 
-            df_meta = pd.read_sql_query(SQL_META, con)
-
-            # --- 2) Iterar por día para métricas (evita consultas largas en réplica)
-            frames = []
-            for i in range(dias):
-                ini = (start + timedelta(days=i)).replace(hour=0, minute=0, second=0, microsecond=0)
-                fin = ini + timedelta(days=1)
-                df_day = pd.read_sql_query(SQL_DIA, con, params={
-                    "inicio": ini.isoformat(sep=" "),
-                    "fin":    fin.isoformat(sep=" "),
-                })
-                df_day["fecha"] = ini.date()
-                frames.append(df_day)
-
-        if not frames:
+            df_meta = pd.read_sql_query(SQL_META, con, params=params_ue)
+
+        # --- 2) Contadores por día (caché local + réplica en paralelo solo para días que faltan)
+        fechas = [(start + timedelta(days=i)).date() for i in range(dias)]
+        df_dias = obtener_agregados(engine, fechas, set_timezone=set_timezone, statement_timeout="5min")
+
+        if df_meta.empty:
             return pd.DataFrame()
 
-        df = pd.concat(frames, ignore_index=True)
+        # Base actual × días del rango (equivale al LEFT JOIN por día del SQL original)
+        base_dias = (
+            df_meta[["device_id", "UplinksPerDay"]]
+            .rename(columns={"UplinksPerDay": "uplinks_per_day"})
+            .merge(pd.DataFrame({"fecha": fechas}), how="cross")
+        )
+        df = base_dias.merge(df_dias, on=["device_id", "fecha"], how="left")
+        df[CONTADORES] = df[CONTADORES].fillna(0)
 
         # --- 3) Promedios diarios por dispositivo (valores base)
         #     (estos serán mapeados a los nombres de CONSULTA 2)
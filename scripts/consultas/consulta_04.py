@@ -18,27 +18,57 @@ Parámetros por defecto:
 Notas:
 - SQLAlchemy 2.x + pandas (usar sqlalchemy.text)
 - TZ de sesión para días naturales (Europe/Madrid)
+- exportar_streaming(): cursor de servidor y escritura por lotes para exportaciones grandes
+- ejecutar_normalizado(): métricas dispositivo-día + uplinks finos (unir_detalle() para la tabla ancha);
+  los uplinks se leen con troceo adaptativo (ver ejecutor_chunks.leer_adaptativo)
+- ejecutar() se lee igual (métricas + uplinks troceados, unidos con unir_detalle): un
+  día con recovery conflicts se parte en horas en vez de perderse. Si aun así queda
+  alguna hora sin leer la ejecución falla, o con permitir_incompleto=True devuelve el
+  resto con df.attrs["ventanas_omitidas"]
+- Base de dispositivos y gateways: se calcula una vez por ejecución (src/db/base_sesion)
 """
 
 import os
 import inspect
 import traceback
-import time
-import random
 from datetime import datetime, timedelta, date
-from typing import List
+from typing import Iterator, List, Optional, Tuple
 
 import pandas as pd
 from sqlalchemy import text
-from sqlalchemy.exc import OperationalError, InternalError
+
+from src.cache.ultimo_estado import (
+    SQL_GPS_STATS_FULL,
+    con_coordenadas_en_servidor,
+    parametros_gps_stats_full,
+    restringir_a_dispositivos,
+)
+from src.db.base_sesion import SQL_BASE_SESION, SQL_BASE_Y_GATEWAYS_SESION, parametros_base_sesion
+from src.db.ejecutor_chunks import (
+    TAMANO_LOTE,
+    ejecutar_chunks,
+    exigir_completo,
+    iterar_ventanas_en_lotes,
+    leer_adaptativo,
+    leer_con_reintentos,
+    ventanas_diarias,
+)
+from src.db.lectura_tipada import ESQUEMA_DT01, ESQUEMA_UPLINK, aplicar_esquema, concatenar
 
 DEFAULT_DAYS = 60
 
+# dtypes declarados al leer: métricas DT01 + registro crudo; en la tabla fina de
+# uplinks el device_id también va como category (se repite en cada mensaje)
+ESQUEMA = {**ESQUEMA_DT01, **ESQUEMA_UPLINK}
+ESQUEMA_UPLINKS = {**ESQUEMA_UPLINK, "device_id": "category"}
+
 
 # ============================================================
 #  CTEs base + gateways (todas las ganaderías, clientes activos)
+#  Se evalúan UNA vez por ejecución (src/db/base_sesion); los chunks
+#  diarios usan SQL_BASE_Y_GATEWAYS_SESION con el resultado en arrays
 # ============================================================
-SQL_BASE_Y_GATEWAYS = """
+SQL_BASE = """
 WITH active_devices AS (
   SELECT *
   FROM "Devices"
@@ -63,7 +93,11 @@ base_all AS (
 base AS (
   SELECT b.*
   FROM base_all b
-),
+)
+"""
+
+SQL_BASE_Y_GATEWAYS = f"""
+{SQL_BASE},
 
 -- Gateways agregado por rancho (para los ranchos presentes en base)
 gw_agg AS (
@@ -114,37 +148,18 @@ gw_latest AS (
   WHERE rlg."RanchId" IN (SELECT DISTINCT b."RanchId" FROM base b)
 ),
 
--- Últimos mensajes / última posición válida (histórico total, no solo el día)
-gps_stats_full AS (
-  SELECT
-    dl."DeviceId",
-    MAX(dl."Time") AS ultimo_mensaje_recibido,
-    (
-      SELECT MAX(sub."Time")
-      FROM "DeviceLocations" sub
-      WHERE sub."DeviceId" = dl."DeviceId"
-        AND sub."HasLocation" = TRUE
-    ) AS ultima_posicion_gps_valida,
-    (
-      SELECT sub."Location"
-      FROM "DeviceLocations" sub
-      WHERE sub."DeviceId" = dl."DeviceId"
-        AND sub."HasLocation" = TRUE
-      ORDER BY sub."Time" DESC
-      LIMIT 1
-    ) AS ultima_posicion_geom
-  FROM "DeviceLocations" dl
-  JOIN base b ON b."Id" = dl."DeviceId"
-  GROUP BY dl."DeviceId"
-)
+-- Últimos mensajes / última posición válida (histórico total, desde la caché local)
+{SQL_GPS_STATS_FULL}
 """
 
 # ============================================================
 #  SQL POR DÍA NATURAL: métricas diarias + registros (uplinks)
 #  Reglas DT01 (≥50% válidas vs esperadas)
+#  Se compone por bloques para poder lanzar, además del detalle ancho,
+#  la salida normalizada (métricas dispositivo-día + uplinks finos).
 # ============================================================
-SQL_DIA_DETALLE = text(f"""
-{SQL_BASE_Y_GATEWAYS}
+SQL_CTES_DIA = f"""
+{SQL_BASE_Y_GATEWAYS_SESION}
 ,
 
 -- Registros del día (para contar y también para listar al final)
@@ -247,8 +262,10 @@ ok_ranch_flag AS (
     CASE WHEN pct_ok_ranch >= 70 THEN TRUE ELSE FALSE END AS ranch_ok_ge70
   FROM ok_ranch
 )
+"""
 
-SELECT
+# Columnas por dispositivo y día: se repiten en cada uplink del detalle ancho
+SQL_COLUMNAS_DISPOSITIVO = """
   -- Identificación y metadatos de dispositivo
   b."Id"               AS device_id,
   b."SerialNumber",
@@ -329,8 +346,10 @@ SELECT
   CASE
     WHEN gl.gateway_last_seen IS NULL THEN NULL
     ELSE ROUND(EXTRACT(EPOCH FROM (NOW() - gl.gateway_last_seen)) / 3600.0, 2)
-  END                                         AS horas_desde_ultimo_visto,
+  END                                         AS horas_desde_ultimo_visto
+"""
 
+SQL_COLUMNAS_UPLINK = """
   -- =============================
   -- REGISTRO CRUDO (uplink DEL DÍA)
   -- =============================
@@ -342,7 +361,9 @@ SELECT
   dl."Location"      AS "Location",
   CASE WHEN dl."Location" IS NOT NULL THEN ST_Y(dl."Location"::geometry) END AS "lat",
   CASE WHEN dl."Location" IS NOT NULL THEN ST_X(dl."Location"::geometry) END AS "lon"
+"""
 
+SQL_FROM_DIA = """
 FROM base b
 JOIN "Ranches" r  ON b."RanchId" = r."Id"
 JOIN "Customers" c ON r."CustomerId" = c."Id" AND c."Status" = 'active'
@@ -356,12 +377,66 @@ LEFT JOIN ok_ranch_flag okf    ON okf.ranch_name = r."Name"
 LEFT JOIN gw_derived ga ON ga.ranch_id = r."Id"
 LEFT JOIN gw_latest  gl ON gl.rn = 1 AND gl.ranch_id = r."Id"
 LEFT JOIN gps_stats_full gf ON gf."DeviceId" = b."Id"
+"""
 
+# Detalle ancho: un registro por uplink con todas las métricas del dispositivo
+SQL_DIA_DETALLE = text(f"""
+{SQL_CTES_DIA}
+SELECT
+{SQL_COLUMNAS_DISPOSITIVO},
+{SQL_COLUMNAS_UPLINK}
+{SQL_FROM_DIA}
 LEFT JOIN dl_dia dl ON dl."DeviceId" = b."Id"  -- Mensajes del día (uno por fila)
 
 ORDER BY dl."Time" ASC, b."Id" ASC;
 """)
 
+# Salida normalizada (1/2): métricas, un registro por dispositivo y día
+SQL_DIA_METRICAS = text(f"""
+{SQL_CTES_DIA}
+SELECT
+{SQL_COLUMNAS_DISPOSITIVO}
+{SQL_FROM_DIA}
+ORDER BY b."Id" ASC;
+""")
+
+# Variantes con lon/lat de la última posición calculados en el servidor (sin WKB)
+SQL_DIA_DETALLE_XY = con_coordenadas_en_servidor(SQL_DIA_DETALLE)
+SQL_DIA_METRICAS_XY = con_coordenadas_en_servidor(SQL_DIA_METRICAS)
+
+# Salida normalizada (2/2): uplinks finos, sin gateways ni caché de último estado
+_SQL_UPLINKS_COLUMNAS = """
+  dl."DeviceId"      AS device_id,
+  dl."Time"          AS "Time",
+  dl."HasLocation"   AS "HasLocation",
+  dl."IsValid"       AS "IsValid",
+  dl."IsLowAccuracy" AS "IsLowAccuracy",
+  dl."InvalidReason" AS "InvalidReason","""
+
+_SQL_UPLINKS_XY_Y_FROM = """
+  CASE WHEN dl."Location" IS NOT NULL THEN ST_Y(dl."Location"::geometry) END AS "lat",
+  CASE WHEN dl."Location" IS NOT NULL THEN ST_X(dl."Location"::geometry) END AS "lon"
+FROM "DeviceLocations" dl
+JOIN base b ON b."Id" = dl."DeviceId"
+JOIN "Ranches" r  ON b."RanchId" = r."Id"
+JOIN "Customers" c ON r."CustomerId" = c."Id" AND c."Status" = 'active'
+WHERE dl."Time" >= :inicio
+  AND dl."Time" <  :fin
+ORDER BY dl."Time" ASC, dl."DeviceId" ASC;
+"""
+
+SQL_DIA_UPLINKS = text(f"""
+{SQL_BASE_SESION}
+SELECT{_SQL_UPLINKS_COLUMNAS}{_SQL_UPLINKS_XY_Y_FROM}""")
+
+# Para el detalle ancho (ejecutar): además la geometría cruda, como en SQL_DIA_DETALLE
+SQL_DIA_UPLINKS_GEOM = text(f"""
+{SQL_BASE_SESION}
+SELECT{_SQL_UPLINKS_COLUMNAS}
+  dl."Location"      AS "Location",{_SQL_UPLINKS_XY_Y_FROM}""")
+
+COLUMNAS_UPLINK = ["device_id", "Time", "HasLocation", "IsValid", "IsLowAccuracy", "InvalidReason", "lat", "lon"]
+
 
 # ============================================================
 #  Utilidad fechas naturales (N días)
@@ -378,62 +453,81 @@ def _start_end_dates(days: int):
 
 
 # ============================================================
-#  Helper de lectura con reintentos y control de transacción
+#  Parámetros fijos de la ejecución (se calculan una sola vez)
+# ============================================================
+def _parametros_fijos(engine, set_timezone: str = "Europe/Madrid") -> dict:
+    """Último estado (caché local) + base de dispositivos y gateways como arrays."""
+    params_ue = parametros_gps_stats_full(engine)
+    # La lectura de la base no usa gps_stats_full: arrays ue_* vacíos
+    params_base = parametros_base_sesion(engine, SQL_BASE_Y_GATEWAYS, restringir_a_dispositivos(params_ue, []), set_timezone)
+    # Cada chunk recibe solo el último estado de los dispositivos de la base
+    return {**restringir_a_dispositivos(params_ue, params_base["base_device_id"]), **params_base}
+
+
 # ============================================================
-def _read_day_with_retries(con, inicio: datetime, fin: datetime, max_retries: int = 4) -> pd.DataFrame:
+#  Lectura por día: métricas (no divisibles) + uplinks (troceo adaptativo)
+# ============================================================
+def _leer_dias(
+    engine,
+    start: datetime,
+    ndays: int,
+    params_fijos: dict,
+    set_timezone: str,
+    max_workers: Optional[int],
+    backend: Optional[str],
+    coords_en_servidor: bool,
+    con_geometria: bool = False,
+) -> Tuple[pd.DataFrame, pd.DataFrame, list]:
     """
-    Lanza SQL_DIA_DETALLE para [inicio, fin). Reintenta ante conflictos de recuperación.
-    - Sin 'with con.begin()' para no anidar transacciones.
-    - Tras éxito: commit corto para soltar snapshot.
-    - Tras fallo: rollback para limpiar 'current transaction is aborted'.
+    (metricas, uplinks, ventanas omitidas) de los `ndays` días desde `start`.
+    - Métricas del día: un recovery conflict que persiste tras los reintentos se
+      propaga (no se parten: son agregados del día entero) y la ejecución falla.
+    - Uplinks: leer_adaptativo parte el día hasta trozos de una hora; lo que ni
+      así se lee vuelve en `omitidas` (ver exigir_completo).
+    - con_geometria: uplinks con la columna "Location" (detalle ancho).
     """
-    delay = 1.0
-    for attempt in range(1, max_retries + 1):
-        try:
-            df = pd.read_sql_query(
-                SQL_DIA_DETALLE,
-                con,
-                params={"inicio": inicio.isoformat(sep=" "), "fin": fin.isoformat(sep=" ")}
-            )
-            # éxito → cerrar transacción (evita readers largos)
-            try:
-                con.commit()
-            except Exception:
-                pass
-            return df
-
-        except (OperationalError, InternalError) as e:
-            msg = str(e).lower()
-
-            # limpia la transacción abortada antes de reintentar
-            try:
-                con.rollback()
-            except Exception:
-                try:
-                    con.exec_driver_sql("ROLLBACK")
-                except Exception:
-                    pass
-
-            is_recovery_conflict = (
-                "conflict with recovery" in msg
-                or "serializationfailure" in msg
-                or "canceling statement due to conflict with recovery" in msg
-                or "current transaction is aborted" in msg
-            )
-
-            if is_recovery_conflict and attempt < max_retries:
-                jitter = random.uniform(0, 0.5)
-                print(f"🔁 Recovery conflict en {inicio.date()} (intento {attempt}/{max_retries}). Reintentando en {delay + jitter:.1f}s...")
-                time.sleep(delay + jitter)
-                delay *= 2
-                continue
-
-            if is_recovery_conflict:
-                print(f"⚠️ Día {inicio.date()} omitido tras {max_retries} intentos por recovery conflict.")
-                return pd.DataFrame()
-
-            # Otro error: propaga
-            raise
+    sql_metricas = SQL_DIA_METRICAS_XY if coords_en_servidor else SQL_DIA_METRICAS
+    sql_uplinks = SQL_DIA_UPLINKS_GEOM if con_geometria else SQL_DIA_UPLINKS
+
+    def _leer_dia(con, ini, fin):
+        params = {**params_fijos, "inicio": ini.isoformat(sep=" "), "fin": fin.isoformat(sep=" ")}
+        metricas = leer_con_reintentos(
+            con, sql_metricas, params, str(ini.date()), backend=backend, esquema=ESQUEMA, omitir=False, consulta="consulta_04_metricas"
+        )
+        uplinks, omitidas = leer_adaptativo(
+            con,
+            sql_uplinks,
+            lambda a, b: {**params_fijos, "inicio": a.isoformat(sep=" "), "fin": b.isoformat(sep=" ")},
+            ini,
+            fin,
+            consulta="consulta_04_uplinks",
+            backend=backend,
+            esquema=ESQUEMA_UPLINKS,
+        )
+        return metricas, uplinks, omitidas
+
+    ventanas = ventanas_diarias(start, ndays)
+    dias = ejecutar_chunks(engine, ventanas, _leer_dia, set_timezone=set_timezone, max_workers=max_workers)
+
+    frames_m: List[pd.DataFrame] = []
+    frames_u: List[pd.DataFrame] = []
+    omitidas: list = []
+    for (ini, _fin), (df_m, df_u, omitidas_dia) in zip(ventanas, dias):
+        omitidas.extend(omitidas_dia)
+        if not df_m.empty:
+            df_m["fecha_natural"] = ini.date()
+            frames_m.append(df_m)
+        if not df_u.empty:
+            df_u["fecha_natural"] = ini.date()
+            frames_u.append(df_u)
+
+    metricas = concatenar(frames_m, ESQUEMA) if frames_m else pd.DataFrame()
+    if not metricas.empty:
+        num_cols = metricas.select_dtypes(include=["number"]).columns
+        if len(num_cols) > 0:
+            metricas[num_cols] = metricas[num_cols].fillna(0)
+    uplinks = concatenar(frames_u, ESQUEMA_UPLINKS) if frames_u else pd.DataFrame(columns=COLUMNAS_UPLINK + ["fecha_natural"])
+    return metricas, uplinks, omitidas
 
 
 # ============================================================
@@ -445,11 +539,22 @@ def ejecutar(
     set_timezone: str = "Europe/Madrid",
     save_csv: bool = False,
     outdir: str = "data/processed",
-    filename_prefix: str = "consulta_05_detalle_por_mensaje"
+    filename_prefix: str = "consulta_05_detalle_por_mensaje",
+    max_workers: int = None,
+    backend: str = None,
+    coords_en_servidor: bool = False,
+    permitir_incompleto: bool = False,
 ) -> pd.DataFrame:
     """
     Devuelve UN REGISTRO POR MENSAJE de los últimos N días naturales (por defecto 60),
     con REGLAS DT01 (≥50%) + metadatos y gateways, para todos los ranchos de clientes activos.
+    Se lee como la salida normalizada (métricas por día + uplinks con troceo adaptativo)
+    y se une con unir_detalle(): un día con recovery conflicts se parte en vez de perderse.
+    backend: "pandas" (read_sql_query), "copy" (COPY TO STDOUT) o "preparado" (PREPARE por
+             conexión + EXECUTE por día); None → PG_BACKEND_EXTRACCION.
+    coords_en_servidor: ultima_posicion_lon/lat (decodificados en la caché) en lugar del WKB.
+    permitir_incompleto: si alguna hora no se puede leer, devolver el resto con
+             df.attrs["ventanas_omitidas"] en lugar de fallar.
     """
     try:
         try:
@@ -459,50 +564,21 @@ def ejecutar(
             nombre_script = "consulta_05_detalle_por_mensaje"
 
         start, end, ndays = _start_end_dates(days)
+        params_fijos = _parametros_fijos(engine, set_timezone)
 
-        frames: List[pd.DataFrame] = []
-        with engine.connect() as con:
-            # SET de sesión (no SET LOCAL) y commit corto para no mantener tx abierta
-            if set_timezone:
-                con.exec_driver_sql(f"SET TIME ZONE '{set_timezone}';")
-            con.exec_driver_sql("SET lock_timeout = '5s';")
-            con.exec_driver_sql("SET statement_timeout = '10min';")
-            try:
-                con.commit()
-            except Exception:
-                pass
-
-            for i in range(ndays):
-                ini = (start + timedelta(days=i)).replace(hour=0, minute=0, second=0, microsecond=0)
-                fin = ini + timedelta(days=1)
-
-                df_day = _read_day_with_retries(con, ini, fin, max_retries=4)
-                if df_day is None or df_day.empty:
-                    # por si acaso, asegura estado limpio
-                    try:
-                        con.rollback()
-                    except Exception:
-                        pass
-                    continue
-
-                df_day["fecha_natural"] = ini.date()
-                frames.append(df_day)
-
-        if not frames:
+        # Días repartidos entre N conexiones del pool (resultado en orden de fecha)
+        metricas, uplinks, omitidas = _leer_dias(
+            engine, start, ndays, params_fijos, set_timezone, max_workers, backend, coords_en_servidor, con_geometria=True
+        )
+        exigir_completo(nombre_script, omitidas, permitir_incompleto)
+
+        if metricas.empty:
             print(f"⚠️ {nombre_script}: Sin mensajes en los últimos {ndays} días.")
             return pd.DataFrame()
 
-        df = pd.concat(frames, ignore_index=True)
-
-        # Rellenar solo numéricas (sin tocar fechas/bools/strings)
-        num_cols = df.select_dtypes(include=["number"]).columns
-        if len(num_cols) > 0:
-            df[num_cols] = df[num_cols].fillna(0)
-
-        # Orden estable (por Time y device)
-        sort_cols = [c for c in ["Time", "device_id"] if c in df.columns]
-        if sort_cols:
-            df = df.sort_values(sort_cols, ascending=[True]*len(sort_cols), na_position="last")
+        # Numéricas a 0 y orden estable por Time/device (dentro de unir_detalle)
+        df = unir_detalle(metricas, uplinks)
+        df.attrs["ventanas_omitidas"] = omitidas
 
         # Guardado opcional
         if save_csv:
@@ -524,6 +600,157 @@ def ejecutar(
         return pd.DataFrame()
 
 
+# ============================================================
+#  SALIDA NORMALIZADA (métricas dispositivo-día + uplinks finos)
+# ============================================================
+def ejecutar_normalizado(
+    engine,
+    days: int = DEFAULT_DAYS,
+    set_timezone: str = "Europe/Madrid",
+    save_csv: bool = False,
+    outdir: str = "data/processed",
+    filename_prefix: str = "consulta_05_detalle_por_mensaje",
+    max_workers: int = None,
+    backend: str = None,
+    coords_en_servidor: bool = False,
+    permitir_incompleto: bool = False,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Mismo contenido que ejecutar() pero en DOS tablas enlazadas por (device_id, fecha_natural):
+    - metricas: un registro por dispositivo y día (métricas DT01, metadatos, gateways).
+    - uplinks:  un registro por mensaje con COLUMNAS_UPLINK (sin la geometría cruda).
+    Las métricas no se repiten por uplink; unir_detalle() reconstruye la tabla ancha si hace falta.
+    coords_en_servidor: ultima_posicion_lon/lat (decodificados en la caché) en lugar del WKB.
+    permitir_incompleto: como en ejecutar() (attrs["ventanas_omitidas"] en las dos tablas).
+    """
+    try:
+        start, end, ndays = _start_end_dates(days)
+        params_fijos = _parametros_fijos(engine, set_timezone)
+
+        metricas, uplinks, omitidas = _leer_dias(
+            engine, start, ndays, params_fijos, set_timezone, max_workers, backend, coords_en_servidor
+        )
+        exigir_completo("consulta_05_detalle_por_mensaje (normalizada)", omitidas, permitir_incompleto)
+
+        if metricas.empty:
+            print(f"⚠️ consulta_05_detalle_por_mensaje: Sin datos en los últimos {ndays} días.")
+            return pd.DataFrame(), pd.DataFrame(columns=COLUMNAS_UPLINK + ["fecha_natural"])
+        metricas.attrs["ventanas_omitidas"] = uplinks.attrs["ventanas_omitidas"] = omitidas
+
+        if save_csv:
+            os.makedirs(outdir, exist_ok=True)
+            ts = datetime.now().strftime("%Y-%m-%d_%H-%M")
+            for nombre, df in (("metricas", metricas), ("uplinks", uplinks)):
+                path = os.path.join(outdir, f"{filename_prefix}_{ts}_ndias_{ndays}_{nombre}.csv")
+                df.to_csv(path, index=False, encoding="utf-8-sig")
+                print(f"📁 CSV guardado: {path}")
+
+        print(
+            f"✅ consulta_05_detalle_por_mensaje (normalizada) OK | Últimos {ndays} días | "
+            f"Métricas: {len(metricas)} filas x {len(metricas.columns)} col. | Uplinks: {len(uplinks)} filas"
+        )
+        return metricas, uplinks
+
+    except Exception as e:
+        print(f"❌ Error en consulta_05_detalle_por_mensaje (normalizada): {e}")
+        traceback.print_exc()
+        return pd.DataFrame(), pd.DataFrame()
+
+
+def unir_detalle(metricas: pd.DataFrame, uplinks: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tabla ancha de ejecutar(): columnas del dispositivo, del uplink y fecha_natural al
+    final, como SQL_DIA_DETALLE ("Location" solo si los uplinks la traen).
+    LEFT JOIN desde métricas: los dispositivos sin mensajes en el día salen una vez con el uplink vacío.
+    """
+    if metricas.empty:
+        return pd.DataFrame()
+    claves = ["device_id", "fecha_natural"]
+    up = uplinks.copy()
+    up["device_id"] = up["device_id"].astype(str)
+    df = metricas.assign(device_id=metricas["device_id"].astype(str)).merge(up, on=claves, how="left")
+    df = df[[c for c in df.columns if c != "fecha_natural"] + ["fecha_natural"]]
+
+    # Numéricas a 0 (sin tocar fechas/bools/strings) y orden estable por Time/device
+    num_cols = df.select_dtypes(include=["number"]).columns
+    if len(num_cols) > 0:
+        df[num_cols] = df[num_cols].fillna(0)
+    return df.sort_values(["Time", "device_id"], na_position="last", ignore_index=True)
+
+
+# ============================================================
+#  MODO STREAMING (cursor de servidor + escritura incremental)
+# ============================================================
+def iterar_lotes(
+    engine,
+    days: int = DEFAULT_DAYS,
+    set_timezone: str = "Europe/Madrid",
+    tamano_lote: int = TAMANO_LOTE,
+    coords_en_servidor: bool = False,
+) -> Iterator[pd.DataFrame]:
+    """
+    Generador de lotes de como mucho `tamano_lote` filas (mismas columnas que ejecutar()).
+    Los días se recorren en orden y el SQL ya ordena por Time/device, así que la
+    concatenación de lotes sale ordenada por día y Time sin reordenar en memoria.
+    """
+    start, end, ndays = _start_end_dates(days)
+    params_fijos = _parametros_fijos(engine, set_timezone)
+
+    lotes = iterar_ventanas_en_lotes(
+        engine,
+        ventanas_diarias(start, ndays),
+        SQL_DIA_DETALLE_XY if coords_en_servidor else SQL_DIA_DETALLE,
+        lambda ini, fin: {**params_fijos, "inicio": ini.isoformat(sep=" "), "fin": fin.isoformat(sep=" ")},
+        set_timezone=set_timezone,
+        tamano_lote=tamano_lote,
+    )
+    for (ini, _fin), lote in lotes:
+        if lote.empty:
+            continue
+        lote["fecha_natural"] = ini.date()
+        # Los lotes del cursor no pasan por coerce_float → Decimal hasta aplicar el esquema
+        aplicar_esquema(lote, ESQUEMA)
+
+        # Rellenar solo numéricas (sin tocar fechas/bools/strings)
+        num_cols = lote.select_dtypes(include=["number"]).columns
+        if len(num_cols) > 0:
+            lote[num_cols] = lote[num_cols].fillna(0)
+        yield lote
+
+
+def exportar_streaming(
+    engine,
+    days: int = DEFAULT_DAYS,
+    set_timezone: str = "Europe/Madrid",
+    outdir: str = "data/processed",
+    filename_prefix: str = "consulta_05_detalle_por_mensaje",
+    tamano_lote: int = TAMANO_LOTE,
+    coords_en_servidor: bool = False,
+) -> Optional[str]:
+    """
+    Escribe el detalle por mensaje a CSV lote a lote (memoria acotada por `tamano_lote`).
+    Devuelve la ruta del CSV o None si falla.
+    """
+    try:
+        os.makedirs(outdir, exist_ok=True)
+        ts = datetime.now().strftime("%Y-%m-%d_%H-%M")
+        path = os.path.join(outdir, f"{filename_prefix}_{ts}_ndias_{days}_stream.csv")
+
+        filas = 0
+        with open(path, "w", encoding="utf-8-sig", newline="") as fh:
+            for i, lote in enumerate(iterar_lotes(engine, days, set_timezone, tamano_lote, coords_en_servidor)):
+                lote.to_csv(fh, index=False, header=(i == 0))
+                filas += len(lote)
+
+        print(f"📁 CSV (streaming) guardado: {path} | Filas: {filas}")
+        return path
+
+    except Exception as e:
+        print(f"❌ Error en exportación streaming de consulta_05_detalle_por_mensaje: {e}")
+        traceback.print_exc()
+        return None
+
+
 # =========================
 #  USO DE EJEMPLO (opcional)
 # =========================
@@ -534,5 +761,18 @@ if __name__ == "__main__":
 
     # Detalle por mensaje, 60 días, guardando CSV
     # df = ejecutar(engine, days=60, save_csv=True)
+
+    # Mismo detalle extrayendo con COPY TO STDOUT (comparar tiempos con backend="pandas")
+    # df = ejecutar(engine, days=60, backend="copy")
+
+    # Sentencia preparada por conexión (informa de la planificación ahorrada)
+    # df = ejecutar(engine, days=60, backend="preparado")
+
+    # Mismo detalle en streaming (memoria acotada por lote)
+    # ruta = exportar_streaming(engine, days=60, tamano_lote=50_000)
+
+    # Salida normalizada y unión bajo demanda
+    # metricas, uplinks = ejecutar_normalizado(engine, days=60)
+    # df = unir_detalle(metricas, uplinks)
     """
     pass
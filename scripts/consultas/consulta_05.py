@@ -2,7 +2,7 @@
 """
 consulta_05_detalle_por_mensaje – Últimos N días (por defecto 60) DETALLE POR MENSAJE,
 replicando las MISMAS columnas calculadas del query 24h (DT01), pero evaluadas por DÍA NATURAL
-del propio mensaje. Filtro por ganadería.
+del propio mensaje. Filtro por ganadería (una o varias).
 
 - Un registro por uplink de DeviceLocations.
 - Para cada uplink, se adjuntan las métricas/porcentajes del DISPOSITIVO en su día natural:
@@ -14,29 +14,56 @@ del propio mensaje. Filtro por ganadería.
 
 Parámetros por defecto:
   days = 60
-  ranch_name = "Daniel Arias González"
+  ranch_name = "Daniel Arias González"  (o lista de ganaderías: modo lote)
 
 Notas:
 - SQLAlchemy 2.x + pandas (usar sqlalchemy.text)
 - TZ de sesión para días naturales (Europe/Madrid)
+- ejecutar_normalizado(): métricas dispositivo-día + uplinks finos (unir_detalle() para la tabla ancha);
+  los uplinks se leen con troceo adaptativo (ver ejecutor_chunks.leer_adaptativo)
+- ejecutar() se lee igual (métricas + uplinks troceados, unidos con unir_detalle): un
+  día con recovery conflicts se parte en horas en vez de perderse. Si aun así queda
+  alguna hora sin leer la ejecución falla, o con permitir_incompleto=True devuelve el
+  resto con df.attrs["ventanas_omitidas"]
+- Base de dispositivos y gateways: se calcula una vez por ejecución (src/db/base_sesion)
+- Modo lote: con una lista en ranch_name las ganaderías van en UN parámetro array y cada
+  día se recorre una sola vez para todas; con save_csv se escribe un CSV por ganadería
+  (partir_por_rancho() separa el resultado en memoria)
 """
 
 import os
 import inspect
 import traceback
 from datetime import datetime, timedelta, date
-from typing import List
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import pandas as pd
 from sqlalchemy import text
 
+from src.cache.ultimo_estado import (
+    SQL_GPS_STATS_FULL,
+    con_coordenadas_en_servidor,
+    parametros_gps_stats_full,
+    restringir_a_dispositivos,
+)
+from src.db.base_sesion import SQL_BASE_SESION, SQL_BASE_Y_GATEWAYS_SESION, parametros_base_sesion
+from src.db.ejecutor_chunks import ejecutar_chunks, exigir_completo, leer_adaptativo, leer_con_reintentos, ventanas_diarias
+from src.db.lectura_tipada import ESQUEMA_DT01, ESQUEMA_UPLINK, concatenar
+
 DEFAULT_DAYS = 60
 DEFAULT_RANCH_NAME = "Daniel Arias González"
 
+# dtypes declarados al leer: métricas DT01 + registro crudo; en la tabla fina de
+# uplinks el device_id también va como category (se repite en cada mensaje)
+ESQUEMA = {**ESQUEMA_DT01, **ESQUEMA_UPLINK}
+ESQUEMA_UPLINKS = {**ESQUEMA_UPLINK, "device_id": "category"}
+
 # ============================================================
 #  CTEs base + gateways (filtro por ganadería, clientes activos)
+#  Se evalúan UNA vez por ejecución (src/db/base_sesion); los chunks
+#  diarios usan SQL_BASE_Y_GATEWAYS_SESION con el resultado en arrays
 # ============================================================
-SQL_BASE_Y_GATEWAYS = """
+SQL_BASE = """
 WITH active_devices AS (
   SELECT *
   FROM "Devices"
@@ -57,16 +84,22 @@ base_all AS (
   WHERE d."Id" IS NOT NULL
 ),
 ranches_filtrados AS (
-  SELECT r."Id" AS ranch_id
+  SELECT r."Id" AS ranch_id, r."Name" AS ranch_name
   FROM "Ranches" r
   JOIN "Customers" c ON c."Id" = r."CustomerId" AND c."Status" = 'active'
-  WHERE UPPER(TRIM(r."Name")) = UPPER(TRIM(:ranch_name))
+  WHERE UPPER(TRIM(r."Name")) IN (
+    SELECT UPPER(TRIM(n)) FROM UNNEST(CAST(:ranch_names AS text[])) AS n
+  )
 ),
 base AS (
   SELECT b.*
   FROM base_all b
   JOIN ranches_filtrados rf ON rf.ranch_id = b."RanchId"
-),
+)
+"""
+
+SQL_BASE_Y_GATEWAYS = f"""
+{SQL_BASE},
 
 -- Gateways agregado por rancho (como en DT01)
 gw_agg AS (
@@ -117,37 +150,18 @@ gw_latest AS (
   WHERE rlg."RanchId" IN (SELECT ranch_id FROM ranches_filtrados)
 ),
 
--- Últimos mensajes / última posición válida (histórico total, no solo el día)
-gps_stats_full AS (
-  SELECT
-    dl."DeviceId",
-    MAX(dl."Time") AS ultimo_mensaje_recibido,
-    (
-      SELECT MAX(sub."Time")
-      FROM "DeviceLocations" sub
-      WHERE sub."DeviceId" = dl."DeviceId"
-        AND sub."HasLocation" = TRUE
-    ) AS ultima_posicion_gps_valida,
-    (
-      SELECT sub."Location"
-      FROM "DeviceLocations" sub
-      WHERE sub."DeviceId" = dl."DeviceId"
-        AND sub."HasLocation" = TRUE
-      ORDER BY sub."Time" DESC
-      LIMIT 1
-    ) AS ultima_posicion_geom
-  FROM "DeviceLocations" dl
-  JOIN base b ON b."Id" = dl."DeviceId"
-  GROUP BY dl."DeviceId"
-)
+-- Últimos mensajes / última posición válida (histórico total, desde la caché local)
+{SQL_GPS_STATS_FULL}
 """
 
 # ============================================================
 #  SQL POR DÍA NATURAL: métricas diarias + registros (uplinks)
 #  Reglas DT01 (≥50% válidas vs esperadas)
+#  Se compone por bloques para poder lanzar, además del detalle ancho,
+#  la salida normalizada (métricas dispositivo-día + uplinks finos).
 # ============================================================
-SQL_DIA_DETALLE = text(f"""
-{SQL_BASE_Y_GATEWAYS},
+SQL_CTES_DIA = f"""
+{SQL_BASE_Y_GATEWAYS_SESION},
 
 -- Registros del día (para contar y también para listar al final)
 dl_dia AS (
@@ -249,8 +263,10 @@ ok_ranch_flag AS (
     CASE WHEN pct_ok_ranch >= 70 THEN TRUE ELSE FALSE END AS ranch_ok_ge70
   FROM ok_ranch
 )
+"""
 
-SELECT
+# Columnas por dispositivo y día: se repiten en cada uplink del detalle ancho
+SQL_COLUMNAS_DISPOSITIVO = """
   -- Identificación y metadatos de dispositivo
   b."Id"               AS device_id,
   b."SerialNumber",
@@ -331,8 +347,10 @@ SELECT
   CASE
     WHEN gl.gateway_last_seen IS NULL THEN NULL
     ELSE ROUND(EXTRACT(EPOCH FROM (NOW() - gl.gateway_last_seen)) / 3600.0, 2)
-  END                                         AS horas_desde_ultimo_visto,
+  END                                         AS horas_desde_ultimo_visto
+"""
 
+SQL_COLUMNAS_UPLINK = """
   -- =============================
   -- REGISTRO CRUDO (uplink DEL DÍA)
   -- =============================
@@ -344,7 +362,9 @@ SELECT
   dl."Location"      AS "Location",
   CASE WHEN dl."Location" IS NOT NULL THEN ST_Y(dl."Location"::geometry) END AS "lat",
   CASE WHEN dl."Location" IS NOT NULL THEN ST_X(dl."Location"::geometry) END AS "lon"
+"""
 
+SQL_FROM_DIA = """
 FROM base b
 JOIN "Ranches" r  ON b."RanchId" = r."Id"
 JOIN "Customers" c ON r."CustomerId" = c."Id" AND c."Status" = 'active'
@@ -358,12 +378,65 @@ LEFT JOIN ok_ranch_flag okf    ON okf.ranch_name = r."Name"
 LEFT JOIN gw_derived ga ON ga.ranch_id = r."Id"
 LEFT JOIN gw_latest  gl ON gl.rn = 1 AND gl.ranch_id = r."Id"
 LEFT JOIN gps_stats_full gf ON gf."DeviceId" = b."Id"
+"""
 
+# Detalle ancho: un registro por uplink con todas las métricas del dispositivo
+SQL_DIA_DETALLE = text(f"""
+{SQL_CTES_DIA}
+SELECT
+{SQL_COLUMNAS_DISPOSITIVO},
+{SQL_COLUMNAS_UPLINK}
+{SQL_FROM_DIA}
 LEFT JOIN dl_dia dl ON dl."DeviceId" = b."Id"  -- Mensajes del día (uno por fila)
 
 ORDER BY dl."Time" ASC, b."Id" ASC;
 """)
 
+# Salida normalizada (1/2): métricas, un registro por dispositivo y día
+SQL_DIA_METRICAS = text(f"""
+{SQL_CTES_DIA}
+SELECT
+{SQL_COLUMNAS_DISPOSITIVO}
+{SQL_FROM_DIA}
+ORDER BY b."Id" ASC;
+""")
+
+# Variantes con lon/lat de la última posición calculados en el servidor (sin WKB)
+SQL_DIA_DETALLE_XY = con_coordenadas_en_servidor(SQL_DIA_DETALLE)
+SQL_DIA_METRICAS_XY = con_coordenadas_en_servidor(SQL_DIA_METRICAS)
+
+# Salida normalizada (2/2): uplinks finos, sin gateways ni caché de último estado
+# (la base de sesión ya viene restringida a la ganadería y a clientes activos)
+_SQL_UPLINKS_COLUMNAS = """
+  dl."DeviceId"      AS device_id,
+  dl."Time"          AS "Time",
+  dl."HasLocation"   AS "HasLocation",
+  dl."IsValid"       AS "IsValid",
+  dl."IsLowAccuracy" AS "IsLowAccuracy",
+  dl."InvalidReason" AS "InvalidReason","""
+
+_SQL_UPLINKS_XY_Y_FROM = """
+  CASE WHEN dl."Location" IS NOT NULL THEN ST_Y(dl."Location"::geometry) END AS "lat",
+  CASE WHEN dl."Location" IS NOT NULL THEN ST_X(dl."Location"::geometry) END AS "lon"
+FROM "DeviceLocations" dl
+JOIN base b ON b."Id" = dl."DeviceId"
+WHERE dl."Time" >= :inicio
+  AND dl."Time" <  :fin
+ORDER BY dl."Time" ASC, dl."DeviceId" ASC;
+"""
+
+SQL_DIA_UPLINKS = text(f"""
+{SQL_BASE_SESION}
+SELECT{_SQL_UPLINKS_COLUMNAS}{_SQL_UPLINKS_XY_Y_FROM}""")
+
+# Para el detalle ancho (ejecutar): además la geometría cruda, como en SQL_DIA_DETALLE
+SQL_DIA_UPLINKS_GEOM = text(f"""
+{SQL_BASE_SESION}
+SELECT{_SQL_UPLINKS_COLUMNAS}
+  dl."Location"      AS "Location",{_SQL_UPLINKS_XY_Y_FROM}""")
+
+COLUMNAS_UPLINK = ["device_id", "Time", "HasLocation", "IsValid", "IsLowAccuracy", "InvalidReason", "lat", "lon"]
+
 # ============================================================
 #  Utilidad fechas naturales (N días)
 # ============================================================
@@ -377,21 +450,172 @@ def _start_end_dates(days: int):
     end   = datetime.combine(hoy + timedelta(days=1), datetime.min.time())  # exclusivo
     return start, end, days
 
+# ============================================================
+#  Parámetros fijos de la ejecución (se calculan una sola vez)
+# ============================================================
+def _lista_ranchos(ranch_name: Union[str, Sequence[str]]) -> List[str]:
+    """Una ganadería (str) o varias (lista) → lista sin duplicados, en el orden dado."""
+    nombres = [ranch_name] if isinstance(ranch_name, str) else list(ranch_name)
+    nombres = list(dict.fromkeys(n.strip() for n in nombres if n and n.strip()))
+    if not nombres:
+        raise ValueError("Se necesita al menos una ganadería")
+    return nombres
+
+
+def _describir_ranchos(ranchos: List[str]) -> str:
+    return f"'{ranchos[0]}'" if len(ranchos) == 1 else f"{len(ranchos)} ganaderías"
+
+
+def _normalizar_nombre(nombre: str) -> str:
+    return str(nombre).strip().upper()  # igual que UPPER(TRIM(..)) del filtro SQL
+
+
+def _avisar_ranchos_no_encontrados(engine, ranchos: List[str]) -> List[str]:
+    """
+    Ganaderías pedidas que el filtro por nombre (UPPER(TRIM(..)), clientes activos)
+    no encuentra; sin aviso el modo lote las perdería en silencio.
+    """
+    with engine.connect() as con:
+        encontrados = pd.read_sql_query(
+            text(SQL_BASE + "SELECT ranch_name FROM ranches_filtrados;"),
+            con,
+            params={"ranch_names": ranchos},
+        )
+    nombres = {_normalizar_nombre(n) for n in encontrados["ranch_name"].dropna()}
+    faltan = [r for r in ranchos if _normalizar_nombre(r) not in nombres]
+    if faltan:
+        print(
+            f"⚠️ {len(faltan)} de {len(ranchos)} ganaderías sin coincidencia "
+            f"(nombre inexistente o cliente inactivo): {', '.join(faltan)}"
+        )
+    return faltan
+
+
+def _parametros_fijos(engine, ranchos: List[str], set_timezone: str = "Europe/Madrid") -> dict:
+    """Último estado (caché local) + base de las ganaderías y gateways como arrays."""
+    params_ue = parametros_gps_stats_full(engine)
+    # La lectura de la base no usa gps_stats_full: arrays ue_* vacíos
+    params_base = parametros_base_sesion(
+        engine, SQL_BASE_Y_GATEWAYS, {**restringir_a_dispositivos(params_ue, []), "ranch_names": ranchos}, set_timezone
+    )
+    _avisar_ranchos_no_encontrados(engine, ranchos)
+    # Cada chunk recibe solo el último estado de los dispositivos de las ganaderías
+    return {**restringir_a_dispositivos(params_ue, params_base["base_device_id"]), **params_base}
+
+
+def partir_por_rancho(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Separa un resultado (detalle o métricas) en un DataFrame por ranch_name."""
+    if df.empty or "ranch_name" not in df.columns:
+        return {}
+    return {
+        str(nombre): parte.reset_index(drop=True)
+        for nombre, parte in df.groupby("ranch_name", observed=True, sort=True)
+    }
+
+
+def _guardar_por_rancho(df: pd.DataFrame, ranchos: List[str], outdir: str, base: str, sufijo: str = "") -> None:
+    """Un CSV por ganadería (ranch_name en el nombre del fichero, como en el modo de una sola)."""
+    partes = partir_por_rancho(df) if len(ranchos) > 1 else {ranchos[0]: df}
+    for nombre, parte in partes.items():
+        safe_ranch = nombre.replace(" ", "_")
+        path = os.path.join(outdir, f"{base.format(rancho=safe_ranch)}{sufijo}.csv")
+        parte.to_csv(path, index=False, encoding="utf-8-sig")
+        print(f"📁 CSV guardado: {path}")
+
+
+# ============================================================
+#  Lectura por día: métricas (no divisibles) + uplinks (troceo adaptativo)
+# ============================================================
+def _leer_dias(
+    engine,
+    start: datetime,
+    ndays: int,
+    params_fijos: dict,
+    set_timezone: str,
+    max_workers: Optional[int],
+    backend: Optional[str],
+    coords_en_servidor: bool,
+    con_geometria: bool = False,
+) -> Tuple[pd.DataFrame, pd.DataFrame, list]:
+    """
+    (metricas, uplinks, ventanas omitidas) de los `ndays` días desde `start`.
+    - Métricas del día: un recovery conflict que persiste tras los reintentos se
+      propaga (no se parten: son agregados del día entero) y la ejecución falla.
+    - Uplinks: leer_adaptativo parte el día hasta trozos de una hora; lo que ni
+      así se lee vuelve en `omitidas` (ver exigir_completo).
+    - con_geometria: uplinks con la columna "Location" (detalle ancho).
+    """
+    sql_metricas = SQL_DIA_METRICAS_XY if coords_en_servidor else SQL_DIA_METRICAS
+    sql_uplinks = SQL_DIA_UPLINKS_GEOM if con_geometria else SQL_DIA_UPLINKS
+
+    def _leer_dia(con, ini, fin):
+        params = {**params_fijos, "inicio": ini.isoformat(sep=" "), "fin": fin.isoformat(sep=" ")}
+        metricas = leer_con_reintentos(
+            con, sql_metricas, params, str(ini.date()), backend=backend, esquema=ESQUEMA, omitir=False, consulta="consulta_05_metricas"
+        )
+        uplinks, omitidas = leer_adaptativo(
+            con,
+            sql_uplinks,
+            lambda a, b: {**params_fijos, "inicio": a.isoformat(sep=" "), "fin": b.isoformat(sep=" ")},
+            ini,
+            fin,
+            consulta="consulta_05_uplinks",
+            backend=backend,
+            esquema=ESQUEMA_UPLINKS,
+        )
+        return metricas, uplinks, omitidas
+
+    ventanas = ventanas_diarias(start, ndays)
+    dias = ejecutar_chunks(engine, ventanas, _leer_dia, set_timezone=set_timezone, max_workers=max_workers)
+
+    frames_m: List[pd.DataFrame] = []
+    frames_u: List[pd.DataFrame] = []
+    omitidas: list = []
+    for (ini, _fin), (df_m, df_u, omitidas_dia) in zip(ventanas, dias):
+        omitidas.extend(omitidas_dia)
+        if not df_m.empty:
+            df_m["fecha_natural"] = ini.date()
+            frames_m.append(df_m)
+        if not df_u.empty:
+            df_u["fecha_natural"] = ini.date()
+            frames_u.append(df_u)
+
+    metricas = concatenar(frames_m, ESQUEMA) if frames_m else pd.DataFrame()
+    if not metricas.empty:
+        num_cols = metricas.select_dtypes(include=["number"]).columns
+        if len(num_cols) > 0:
+            metricas[num_cols] = metricas[num_cols].fillna(0)
+    uplinks = concatenar(frames_u, ESQUEMA_UPLINKS) if frames_u else pd.DataFrame(columns=COLUMNAS_UPLINK + ["fecha_natural"])
+    return metricas, uplinks, omitidas
+
+
 # ============================================================
 #  EJECUCIÓN
 # ============================================================
 def ejecutar(
     engine,
     days: int = DEFAULT_DAYS,
-    ranch_name: str = DEFAULT_RANCH_NAME,
+    ranch_name: Union[str, Sequence[str]] = DEFAULT_RANCH_NAME,
     set_timezone: str = "Europe/Madrid",
     save_csv: bool = False,
     outdir: str = "data/processed",
-    filename_prefix: str = "consulta_05_detalle_por_mensaje"
+    filename_prefix: str = "consulta_05_detalle_por_mensaje",
+    max_workers: int = None,
+    backend: str = None,
+    coords_en_servidor: bool = False,
+    permitir_incompleto: bool = False,
 ) -> pd.DataFrame:
     """
     Devuelve UN REGISTRO POR MENSAJE de los últimos N días naturales (por defecto 60),
     para la ganadería dada, con REGLAS DT01 (≥50%) + metadatos y gateways.
+    Se lee como la salida normalizada (métricas por día + uplinks con troceo adaptativo)
+    y se une con unir_detalle(): un día con recovery conflicts se parte en vez de perderse.
+    ranch_name: nombre o lista de nombres (modo lote: un solo recorrido por día para todas).
+    backend: "pandas" (read_sql_query), "copy" (COPY TO STDOUT) o "preparado" (PREPARE por
+             conexión + EXECUTE por día); None → PG_BACKEND_EXTRACCION.
+    coords_en_servidor: ultima_posicion_lon/lat (decodificados en la caché) en lugar del WKB.
+    permitir_incompleto: si alguna hora no se puede leer, devolver el resto con
+             df.attrs["ventanas_omitidas"] en lugar de fallar.
     """
     try:
         try:
@@ -401,59 +625,31 @@ def ejecutar(
             nombre_script = "consulta_05_detalle_por_mensaje"
 
         start, end, ndays = _start_end_dates(days)
+        ranchos = _lista_ranchos(ranch_name)
+        params_fijos = _parametros_fijos(engine, ranchos, set_timezone)
 
-        frames: List[pd.DataFrame] = []
-        with engine.connect() as con:
-            if set_timezone:
-                con.exec_driver_sql(f"SET TIME ZONE '{set_timezone}';")
-            con.exec_driver_sql("SET LOCAL lock_timeout = '5s';")
-            con.exec_driver_sql("SET LOCAL statement_timeout = '10min';")
-
-            for i in range(ndays):
-                ini = (start + timedelta(days=i)).replace(hour=0, minute=0, second=0, microsecond=0)
-                fin = ini + timedelta(days=1)
-
-                df_day = pd.read_sql_query(
-                    SQL_DIA_DETALLE,
-                    con,
-                    params={
-                        "ranch_name": ranch_name,
-                        "inicio": ini.isoformat(sep=" "),
-                        "fin":    fin.isoformat(sep=" "),
-                    }
-                )
-                if not df_day.empty:
-                    df_day["fecha_natural"] = ini.date()
-                    frames.append(df_day)
-
-        if not frames:
-            print(f"⚠️ {nombre_script}: Sin mensajes para '{ranch_name}' en los últimos {ndays} días.")
-            return pd.DataFrame()
-
-        df = pd.concat(frames, ignore_index=True)
+        # Días repartidos entre N conexiones del pool (resultado en orden de fecha)
+        metricas, uplinks, omitidas = _leer_dias(
+            engine, start, ndays, params_fijos, set_timezone, max_workers, backend, coords_en_servidor, con_geometria=True
+        )
+        exigir_completo(nombre_script, omitidas, permitir_incompleto)
 
-        # Rellenar solo numéricas (sin tocar fechas/bools/strings)
-        num_cols = df.select_dtypes(include=["number"]).columns
-        if len(num_cols) > 0:
-            df[num_cols] = df[num_cols].fillna(0)
+        if metricas.empty:
+            print(f"⚠️ {nombre_script}: Sin mensajes para {_describir_ranchos(ranchos)} en los últimos {ndays} días.")
+            return pd.DataFrame()
 
-        # Orden estable (por Time y device)
-        sort_cols = [c for c in ["Time", "device_id"] if c in df.columns]
-        if sort_cols:
-            df = df.sort_values(sort_cols, ascending=[True]*len(sort_cols), na_position="last")
+        # Numéricas a 0 y orden estable por Time/device (dentro de unir_detalle)
+        df = unir_detalle(metricas, uplinks)
+        df.attrs["ventanas_omitidas"] = omitidas
 
         # Guardado opcional
         if save_csv:
             os.makedirs(outdir, exist_ok=True)
             ts = datetime.now().strftime("%Y-%m-%d_%H-%M")
-            safe_ranch = ranch_name.replace(" ", "_")
-            fname = f"{filename_prefix}_{ts}_rancho_{safe_ranch}_ndias_{ndays}.csv"
-            path = os.path.join(outdir, fname)
-            df.to_csv(path, index=False, encoding="utf-8-sig")
-            print(f"📁 CSV guardado: {path}")
+            _guardar_por_rancho(df, ranchos, outdir, f"{filename_prefix}_{ts}_rancho_{{rancho}}_ndias_{ndays}")
 
         print(
-            f"✅ {nombre_script} OK | Ran: '{ranch_name}' | Últimos {ndays} días | "
+            f"✅ {nombre_script} OK | Ran: {_describir_ranchos(ranchos)} | Últimos {ndays} días | "
             f"Filas: {len(df)} | Columnas: {len(df.columns)}"
         )
         return df
@@ -464,6 +660,92 @@ def ejecutar(
         return pd.DataFrame()
 
 
+# ============================================================
+#  SALIDA NORMALIZADA (métricas dispositivo-día + uplinks finos)
+# ============================================================
+def ejecutar_normalizado(
+    engine,
+    days: int = DEFAULT_DAYS,
+    ranch_name: Union[str, Sequence[str]] = DEFAULT_RANCH_NAME,
+    set_timezone: str = "Europe/Madrid",
+    save_csv: bool = False,
+    outdir: str = "data/processed",
+    filename_prefix: str = "consulta_05_detalle_por_mensaje",
+    max_workers: int = None,
+    backend: str = None,
+    coords_en_servidor: bool = False,
+    permitir_incompleto: bool = False,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Mismo contenido que ejecutar() pero en DOS tablas enlazadas por (device_id, fecha_natural):
+    - metricas: un registro por dispositivo y día (métricas DT01, metadatos, gateways).
+    - uplinks:  un registro por mensaje con COLUMNAS_UPLINK (sin la geometría cruda).
+    Las métricas no se repiten por uplink; unir_detalle() reconstruye la tabla ancha si hace falta.
+    coords_en_servidor: ultima_posicion_lon/lat (decodificados en la caché) en lugar del WKB.
+    permitir_incompleto: como en ejecutar() (attrs["ventanas_omitidas"] en las dos tablas).
+    """
+    try:
+        start, end, ndays = _start_end_dates(days)
+        ranchos = _lista_ranchos(ranch_name)
+        params_fijos = _parametros_fijos(engine, ranchos, set_timezone)
+
+        metricas, uplinks, omitidas = _leer_dias(
+            engine, start, ndays, params_fijos, set_timezone, max_workers, backend, coords_en_servidor
+        )
+        exigir_completo("consulta_05_detalle_por_mensaje (normalizada)", omitidas, permitir_incompleto)
+
+        if metricas.empty:
+            print(f"⚠️ consulta_05_detalle_por_mensaje: Sin datos para {_describir_ranchos(ranchos)} en los últimos {ndays} días.")
+            return pd.DataFrame(), pd.DataFrame(columns=COLUMNAS_UPLINK + ["fecha_natural"])
+        metricas.attrs["ventanas_omitidas"] = uplinks.attrs["ventanas_omitidas"] = omitidas
+
+        if save_csv:
+            os.makedirs(outdir, exist_ok=True)
+            ts = datetime.now().strftime("%Y-%m-%d_%H-%M")
+            base = f"{filename_prefix}_{ts}_rancho_{{rancho}}_ndias_{ndays}"
+            _guardar_por_rancho(metricas, ranchos, outdir, base, "_metricas")
+            # Los uplinks no llevan ranch_name: se reparten por los device_id de cada ganadería
+            por_rancho = partir_por_rancho(metricas) if len(ranchos) > 1 else {ranchos[0]: metricas}
+            for nombre, parte in por_rancho.items():
+                ids = set(parte["device_id"].astype(str))
+                up = uplinks[uplinks["device_id"].astype(str).isin(ids)]
+                path = os.path.join(outdir, f"{base.format(rancho=nombre.replace(' ', '_'))}_uplinks.csv")
+                up.to_csv(path, index=False, encoding="utf-8-sig")
+                print(f"📁 CSV guardado: {path}")
+
+        print(
+            f"✅ consulta_05_detalle_por_mensaje (normalizada) OK | Ran: {_describir_ranchos(ranchos)} | Últimos {ndays} días | "
+            f"Métricas: {len(metricas)} filas x {len(metricas.columns)} col. | Uplinks: {len(uplinks)} filas"
+        )
+        return metricas, uplinks
+
+    except Exception as e:
+        print(f"❌ Error en consulta_05_detalle_por_mensaje (normalizada): {e}")
+        traceback.print_exc()
+        return pd.DataFrame(), pd.DataFrame()
+
+
+def unir_detalle(metricas: pd.DataFrame, uplinks: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tabla ancha de ejecutar(): columnas del dispositivo, del uplink y fecha_natural al
+    final, como SQL_DIA_DETALLE ("Location" solo si los uplinks la traen).
+    LEFT JOIN desde métricas: los dispositivos sin mensajes en el día salen una vez con el uplink vacío.
+    """
+    if metricas.empty:
+        return pd.DataFrame()
+    claves = ["device_id", "fecha_natural"]
+    up = uplinks.copy()
+    up["device_id"] = up["device_id"].astype(str)
+    df = metricas.assign(device_id=metricas["device_id"].astype(str)).merge(up, on=claves, how="left")
+    df = df[[c for c in df.columns if c != "fecha_natural"] + ["fecha_natural"]]
+
+    # Numéricas a 0 (sin tocar fechas/bools/strings) y orden estable por Time/device
+    num_cols = df.select_dtypes(include=["number"]).columns
+    if len(num_cols) > 0:
+        df[num_cols] = df[num_cols].fillna(0)
+    return df.sort_values(["Time", "device_id"], na_position="last", ignore_index=True)
+
+
 # =========================
 #  USO DE EJEMPLO (opcional)
 # =========================
@@ -474,5 +756,19 @@ if __name__ == "__main__":
 
     # Detalle por mensaje, 60 días, Daniel Arias González, guardando CSV
     # df = ejecutar(engine, days=60, ranch_name="Daniel Arias González", save_csv=True)
+
+    # Mismo detalle extrayendo con COPY TO STDOUT (comparar tiempos con backend="pandas")
+    # df = ejecutar(engine, days=60, ranch_name="Daniel Arias González", backend="copy")
+
+    # Sentencia preparada por conexión (informa de la planificación ahorrada)
+    # df = ejecutar(engine, days=60, ranch_name="Daniel Arias González", backend="preparado")
+
+    # Salida normalizada y unión bajo demanda
+    # metricas, uplinks = ejecutar_normalizado(engine, days=60, ranch_name="Daniel Arias González")
+    # df = unir_detalle(metricas, uplinks)
+
+    # Modo lote: varias ganaderías en una sola pasada, un CSV por ganadería
+    # df = ejecutar(engine, days=60, ranch_name=["Daniel Arias González", "Otra Ganadería"], save_csv=True)
+    # por_rancho = partir_por_rancho(df)
     """
     pass
@@ -23,10 +23,22 @@ import traceback
 import pandas as pd
 from sqlalchemy import text
 
+from src.cache.ultimo_estado import SQL_GPS_STATS_FULL, con_coordenadas_en_servidor, parametros_gps_stats_full
+from src.db.lectura_tipada import ESQUEMA_DT01, leer_tipado
+from src.db.planes import capturar_si_activo
+from src.db.registro_engines import fijar_zona_horaria
+from src.db.variantes import gw_latest_distinct_on, inner_join_base, registrar_variantes, sql_activa
+from src.features.clasificacion import como_categoria, sql_case
+
+# dtypes declarados al leer (porcentajes float32, contadores Int32, textos category)
+ESQUEMA = {**ESQUEMA_DT01, "clasificacion_conexion": "category"}
+
+SQL_CLASIFICACION_CONEXION = sql_case("clasificacion_conexion", "gf.ultimo_mensaje_recibido")
+
 # =========================
 #  SQL PRINCIPAL (24h) con ventana dinámica :dias_ventana
 # =========================
-query = """
+query = f"""
 WITH active_devices AS (
   SELECT *
   FROM "Devices"
@@ -62,27 +74,7 @@ gps_stats_24h_all AS (
    AND dl."Time" >= NOW() - INTERVAL '24 HOURS'
   GROUP BY d."Id"
 ),
-gps_stats_full AS (
-  SELECT
-    dl."DeviceId",
-    MAX(dl."Time") AS ultimo_mensaje_recibido,
-    (
-      SELECT MAX(sub."Time")
-      FROM "DeviceLocations" sub
-      WHERE sub."DeviceId" = dl."DeviceId"
-        AND sub."HasLocation" = TRUE
-    ) AS ultima_posicion_gps_valida,
-    (
-      SELECT sub."Location"
-      FROM "DeviceLocations" sub
-      WHERE sub."DeviceId" = dl."DeviceId"
-        AND sub."HasLocation" = TRUE
-      ORDER BY sub."Time" DESC
-      LIMIT 1
-    ) AS ultima_posicion_geom
-  FROM "DeviceLocations" dl
-  GROUP BY dl."DeviceId"
-),
+{SQL_GPS_STATS_FULL},
 gps_stats_periodo AS (
   SELECT
     d."Id" AS device_id,
@@ -255,16 +247,8 @@ SELECT
   -- =============================
   -- Clasificación de estado de conexión (desde último mensaje)
   -- =============================
-  CASE
-    WHEN gf.ultimo_mensaje_recibido >= NOW() - INTERVAL '1 day'    THEN 'Conectado hoy'
-    WHEN gf.ultimo_mensaje_recibido >= NOW() - INTERVAL '2 days'   THEN 'Conexión 24-48h'
-    WHEN gf.ultimo_mensaje_recibido >= NOW() - INTERVAL '3 days'   THEN 'Conexión 48-72h'
-    WHEN gf.ultimo_mensaje_recibido >= NOW() - INTERVAL '7 days'   THEN 'Conexión 3-7 días'
-    WHEN gf.ultimo_mensaje_recibido >= NOW() - INTERVAL '15 days'  THEN 'Conexión 7-15 días'
-    WHEN gf.ultimo_mensaje_recibido >= NOW() - INTERVAL '1 month'  THEN 'Conexión 15 días - 1 mes'
-    WHEN gf.ultimo_mensaje_recibido >= NOW() - INTERVAL '3 months' THEN 'Conexión 1-3 meses'
-    ELSE 'Conexión >3 meses'
-  END AS clasificacion_conexion,
+  -- (tramos en src.features.clasificacion: los mismos que el enriquecimiento en pandas)
+  {SQL_CLASIFICACION_CONEXION} AS clasificacion_conexion,
 
   -- =============================
   -- MÉTRICAS DETALLADAS (24h)
@@ -335,7 +319,7 @@ SELECT
   rsf.ranch_ok_ajustada                                          AS "Ganadería OK (ajustada)",
 
   -- (Opcional) expón la ventana aplicada por SQL
-  :dias_ventana::int                                             AS ventana_dias_sql,
+  CAST(:dias_ventana AS int)                                     AS ventana_dias_sql,
 
   -- =============================
   -- INFO GATEWAYS (informativo)
@@ -368,16 +352,32 @@ LEFT JOIN ranch_status_final rsf ON rsf.ranch_id = r."Id"
 ORDER BY rsf.pct_ok_ajustada ASC NULLS LAST, r."Name", d."SerialNumber";
 """
 
+# Variante con lon/lat de la última posición calculados en el servidor (sin WKB)
+query_coordenadas = con_coordenadas_en_servidor(query)
+
+# Formulaciones alternativas del mismo resultado (ver src/db/variantes.py)
+VARIANTES = registrar_variantes(
+    "consulta_06",
+    {
+        "original": query,
+        "inner_join": inner_join_base(query),
+        "inner_join_distinct_on": gw_latest_distinct_on(inner_join_base(query)),
+    },
+    parametros=lambda engine: {**parametros_gps_stats_full(engine), "dias_ventana": 3},
+)
+
+
 # =========================
 #  EJECUCIÓN DESDE PYTHON
 # =========================
-def ejecutar(engine, set_timezone: str = "Europe/Madrid", dias_ventana: int = 3):
+def ejecutar(engine, set_timezone: str = "Europe/Madrid", dias_ventana: int = 3, coords_en_servidor: bool = False):
     """
     Ejecuta la consulta usando SQLAlchemy 2.x y pandas.
     - Fija la zona horaria de sesión (por defecto Europe/Madrid).
     - Parámetro dias_ventana controla la ventana de ajuste por comunicación reciente.
     - Envuélvela con sqlalchemy.text() para evitar problemas con CTEs/ventanas.
     - Rellena NaN solo en columnas numéricas.
+    - coords_en_servidor=True: ultima_posicion_lon/lat (decodificados en la caché) en lugar del WKB.
     """
     try:
         frame_file = inspect.getfile(inspect.currentframe())
@@ -386,19 +386,24 @@ def ejecutar(engine, set_timezone: str = "Europe/Madrid", dias_ventana: int = 3)
         nombre_script = "consulta_dt01"
 
     try:
+        # Variante promovida por comparar_variantes (la original si no hay ninguna)
+        sql = sql_activa("consulta_06")
+        if coords_en_servidor:
+            sql = con_coordenadas_en_servidor(sql)
+        params = parametros_gps_stats_full(engine)
+        params["dias_ventana"] = int(dias_ventana)
+
         with engine.connect() as con:
-            if set_timezone:
-                con.exec_driver_sql(f"SET TIME ZONE '{set_timezone}';")
+            fijar_zona_horaria(con, set_timezone)
 
-            df = pd.read_sql_query(
-                text(query),
-                con,
-                params={"dias_ventana": int(dias_ventana)}
-            )
+            with capturar_si_activo(con, "consulta_06"):
+                df = leer_tipado(con, text(sql), params, ESQUEMA)
 
         num_cols = df.select_dtypes(include=["number"]).columns
         if len(num_cols) > 0:
             df[num_cols] = df[num_cols].fillna(0)
+        if "clasificacion_conexion" in df.columns:
+            df["clasificacion_conexion"] = como_categoria(df["clasificacion_conexion"], "clasificacion_conexion")
 
         print(
             f"✅ Consulta {nombre_script} ejecutada. "
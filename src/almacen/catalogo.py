@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Catálogo de instantáneas: manifiesto append-only junto a los ficheros
+
+- <carpeta>/manifiesto.jsonl, una línea por instantánea escrita (en el momento
+  de escribirla):
+      {"consulta", "fecha" (ISO, inicio de la ejecución), "filas",
+       "hash_esquema", "fichero" (relativo a la carpeta), "replica", "duracion_s"}
+- Nunca se reescribe: solo se añaden líneas (bajo lock entre hilos).
+- El manifiesto de data/processed se versiona con las instantáneas
+  (.gitattributes: merge=union, las líneas de dos ramas se suman).
+- Índice en memoria por consulta (ordenado por fecha) y por fichero; se
+  actualiza leyendo solo lo añadido desde la última vez (offset), así que
+  "la última de X" y "las de X entre dos fechas" no recorren el directorio.
+"""
+
+import bisect
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+FICHERO_MANIFIESTO = "manifiesto.jsonl"
+
+_lock = threading.Lock()
+# ruta del manifiesto -> {"offset", "por_consulta": {consulta: [(fecha, fichero, entrada)]}, "por_fichero"}
+_indices: Dict[str, dict] = {}
+
+
+def ruta_manifiesto(carpeta: str) -> str:
+    return os.path.join(carpeta, FICHERO_MANIFIESTO)
+
+
+def existe(carpeta: str) -> bool:
+    return os.path.exists(ruta_manifiesto(carpeta))
+
+
+def _indexar(indice: dict, entrada: dict) -> None:
+    if entrada["fichero"] in indice["por_fichero"]:
+        return
+    bisect.insort(indice["por_consulta"].setdefault(entrada["consulta"], []), (entrada["fecha"], entrada["fichero"], entrada))
+    indice["por_fichero"][entrada["fichero"]] = entrada
+
+
+def _actualizar(carpeta: str) -> dict:
+    """Índice de `carpeta` al día (lee solo las líneas nuevas del manifiesto). Llamar con _lock."""
+    ruta = ruta_manifiesto(carpeta)
+    indice = _indices.setdefault(ruta, {"offset": 0, "por_consulta": {}, "por_fichero": {}})
+    if not os.path.exists(ruta):
+        return indice
+    if os.path.getsize(ruta) < indice["offset"]:  # sustituido por otro: se reindexa
+        indice.update(offset=0, por_consulta={}, por_fichero={})
+    with open(ruta, "rb") as f:
+        f.seek(indice["offset"])
+        for linea in f:
+            if not linea.endswith(b"\n"):
+                break  # línea a medio escribir: se leerá la próxima vez
+            indice["offset"] += len(linea)
+            try:
+                _indexar(indice, json.loads(linea))
+            except (ValueError, KeyError):
+                print(f"⚠️ Línea inválida en {ruta}; se ignora")
+    return indice
+
+
+def registrar(carpeta: str, entrada: dict) -> None:
+    """Añade `entrada` al manifiesto de `carpeta` (fichero relativo a la carpeta)."""
+    os.makedirs(carpeta, exist_ok=True)
+    linea = json.dumps(entrada, ensure_ascii=False, default=str) + "\n"
+    with _lock:
+        with open(ruta_manifiesto(carpeta), "a", encoding="utf-8") as f:
+            f.write(linea)
+        _actualizar(carpeta)
+
+
+def entradas(
+    carpeta: str,
+    consulta: str,
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+) -> List[dict]:
+    """Entradas de `consulta` con desde <= fecha < hasta, de la más reciente a la más antigua."""
+    with _lock:
+        lista = _actualizar(carpeta)["por_consulta"].get(consulta, [])
+        i = bisect.bisect_left(lista, (desde.isoformat(),)) if desde else 0
+        j = bisect.bisect_left(lista, (hasta.isoformat(),)) if hasta else len(lista)
+        return [e for _, _, e in reversed(lista[i:j])]
+
+
+def entrada(carpeta: str, fichero: str) -> Optional[dict]:
+    """Entrada del fichero `fichero` (nombre dentro de la carpeta), si está en el manifiesto."""
+    with _lock:
+        return _actualizar(carpeta)["por_fichero"].get(fichero)
+
+
+def ficheros(carpeta: str) -> set:
+    """Nombres de fichero anotados en el manifiesto de `carpeta`."""
+    with _lock:
+        return set(_actualizar(carpeta)["por_fichero"])
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Escritura atómica de ficheros de caché y de almacén
+
+- Se escribe en un temporal ÚNICO de la misma carpeta (tempfile.mkstemp) y se
+  sustituye con os.replace: quien lee ve el fichero anterior o el nuevo, nunca
+  uno a medias.
+- Con un temporal de nombre fijo (<ruta>.tmp) dos hilos o procesos que guardaban
+  el mismo fichero a la vez escribían en el mismo temporal; así cada uno tiene
+  el suyo y gana el último replace.
+- Si la escritura falla, el temporal se borra.
+"""
+
+import json
+import os
+import tempfile
+from typing import Callable
+
+
+def escribir_atomico(ruta: str, escribir: Callable[[str], None]) -> None:
+    """Llama a `escribir(tmp)` sobre un temporal único y lo mueve a `ruta`."""
+    carpeta = os.path.dirname(ruta) or "."
+    os.makedirs(carpeta, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=carpeta, prefix=f"{os.path.basename(ruta)}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        escribir(tmp)
+        os.chmod(tmp, 0o644)  # mkstemp crea el temporal con 0600
+        os.replace(tmp, ruta)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def escribir_json_atomico(ruta: str, datos, **opciones) -> None:
+    """json.dump(datos) con escribir_atomico (`opciones`: indent, sort_keys, ...)."""
+    def _escribir(tmp: str) -> None:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(datos, f, **opciones)
+
+    escribir_atomico(ruta, _escribir)
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Histórico de KPIs por dispositivo codificado en deltas
+
+- Por consulta (COLUMNAS_KPI) se guarda una BASE completa (device_id + KPIs) y,
+  en cada ejecución, solo un DELTA con los dispositivos que cambian:
+      data/processed/historial/<consulta>/base_<AAAAmmdd_HHMMSS>.parquet
+      data/processed/historial/<consulta>/delta_<AAAAmmdd_HHMMSS>.parquet
+  Cada fila del delta es el estado nuevo completo del dispositivo (alta o
+  cambio) o una baja (_baja=True). Una ejecución sin cambios no escribe fichero.
+- Los porcentajes se guardan a su paso (PASOS_KPI) y solo cambian cuando se
+  alejan un paso entero del valor guardado: el histórico registra cambios de
+  estado, no el ruido de la ventana móvil de 24h.
+- El índice es el catálogo de src.almacen.catalogo (manifiesto.jsonl de la
+  carpeta del histórico): fecha, tipo (base/delta), filas, altas, cambios, bajas.
+- Nueva base solo cuando las filas de delta acumuladas desde la última superan
+  FACTOR_REBASE × filas de la base (o cambian las columnas): el espacio crece
+  con la rotación de los KPIs, no con el número de ejecuciones, y reconstruir
+  un instante lee como mucho una base y deltas del mismo orden de tamaño.
+- estado_actual.parquet guarda el último estado para calcular el delta sin
+  reconstruir.
+- reconstruir(): estado de la flota en cualquier instante.
+- evolucion(): valores de un dispositivo en cada ejecución, leyendo de cada
+  fichero solo su fila (filtro por device_id sobre Parquet ordenado).
+- importar_instantaneas(): rellena el histórico desde las instantáneas ya
+  guardadas (solo lee las columnas KPI).
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from src.almacen import catalogo
+from src.almacen.escritura import escribir_atomico
+from src.almacen.instantaneas import RUTA_PROCESADOS, fecha_instantanea, leer_instantanea, listar_instantaneas
+
+RUTA_HISTORIAL = os.path.join("data", "processed", "historial")
+
+CLAVE = "device_id"
+COLUMNA_BAJA = "_baja"
+FICHERO_ESTADO = "estado_actual.parquet"
+
+# KPIs por dispositivo que se historizan, por consulta. Solo lo que cambia por
+# el estado del dispositivo: fuera los contadores de la ventana móvil de 24h
+# (cambian en cada ejecución) y las clasificaciones que dependen de now()
+# (se recalculan desde las fechas de la instantánea, ver features.clasificacion)
+COLUMNAS_KPI: Dict[str, List[str]] = {
+    "consulta_01": [
+        "mensajes_esperados",
+        "pct_recibidos_vs_esperados",
+        "pct_sin_gps_vs_esperados",
+        "pct_sin_gps_recibidos",
+        "Posición válida vs esperadas (%)",
+        "Dispositivo OK (≥50% válidas vs esperadas)",
+        "porcentaje_bateria",
+        "numero_reinicios",
+    ],
+}
+
+# Resolución con la que se guardan los porcentajes (múltiplos del paso). Un valor
+# guardado se mantiene mientras el nuevo no se aleje un paso entero de él: un
+# mensaje más o menos en la ventana de 24h, o ir y venir en el borde de un
+# tramo, no es un cambio
+PASOS_KPI: Dict[str, Dict[str, float]] = {
+    "consulta_01": {
+        "pct_recibidos_vs_esperados": 10,
+        "pct_sin_gps_vs_esperados": 10,
+        "pct_sin_gps_recibidos": 0.1,  # fracción 0-1
+        "Posición válida vs esperadas (%)": 10,
+        "porcentaje_bateria": 5,
+    },
+}
+
+# Decimales al comparar floats (ruido de redondeo ≠ cambio)
+DECIMALES = 6
+FACTOR_REBASE = 1.0
+
+
+# ============================================================
+#  Estado y deltas
+# ============================================================
+def _normalizar(df: pd.DataFrame, consulta: str, previo: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """
+    device_id como índice ordenado, solo los KPIs presentes, un registro por
+    dispositivo; porcentajes a su paso (PASOS_KPI), conservando el de `previo`
+    si el valor nuevo está a menos de un paso de él.
+    """
+    columnas = [c for c in COLUMNAS_KPI[consulta] if c in df.columns]
+    estado = df[[CLAVE] + columnas].dropna(subset=[CLAVE])
+    estado = estado.drop_duplicates(subset=[CLAVE], keep="last").set_index(CLAVE).sort_index()
+    estado.index = estado.index.astype(str)
+    pasos = PASOS_KPI.get(consulta, {})
+    for col in estado.columns:
+        if col in pasos:
+            valor = pd.to_numeric(estado[col], errors="coerce")
+            nuevo = (valor / pasos[col]).round() * pasos[col]
+            if previo is not None and col in previo.columns:
+                anterior = pd.to_numeric(previo[col], errors="coerce").reindex(estado.index)
+                nuevo = nuevo.mask((valor - anterior).abs() < pasos[col], anterior)
+            estado[col] = nuevo
+        if pd.api.types.is_float_dtype(estado[col]):
+            estado[col] = estado[col].round(DECIMALES)
+    return estado
+
+
+def _delta(previo: pd.DataFrame, actual: pd.DataFrame) -> pd.DataFrame:
+    """Filas de `actual` nuevas o distintas de `previo` + bajas (_baja=True), ordenadas por device_id."""
+    comunes = actual.index.intersection(previo.index)
+    # object + None: NaN/NA/NaT se comparan igual entre sí y las categorías como texto
+    a = actual.loc[comunes].astype(object)
+    a = a.where(a.notna(), None)
+    p = previo.loc[comunes, actual.columns].astype(object)
+    p = p.where(p.notna(), None)
+    iguales = ((a == p) | (a.isna() & p.isna())).all(axis=1)
+
+    cambios = actual.loc[actual.index.difference(previo.index).union(iguales.index[~iguales])]
+    bajas = previo.index.difference(actual.index)
+    delta = pd.concat([
+        cambios.assign(**{COLUMNA_BAJA: False}),
+        pd.DataFrame({COLUMNA_BAJA: True}, index=bajas).rename_axis(CLAVE),
+    ])
+    return delta.sort_index()
+
+
+def _escribir(df: pd.DataFrame, ruta: str) -> None:
+    escribir_atomico(ruta, lambda tmp: df.reset_index().to_parquet(tmp, index=False, compression="zstd"))
+
+
+def registrar_en_historial(
+    df: pd.DataFrame,
+    consulta: str,
+    fecha: Optional[datetime] = None,
+    raiz: str = RUTA_HISTORIAL,
+) -> dict:
+    """Añade la ejecución `df` de `consulta` al histórico (base o delta). Devuelve la entrada del catálogo."""
+    fecha = (fecha or datetime.now()).replace(microsecond=0)
+    carpeta = os.path.join(raiz, consulta)
+    os.makedirs(carpeta, exist_ok=True)
+    ruta_estado = os.path.join(carpeta, FICHERO_ESTADO)
+    previo = pd.read_parquet(ruta_estado).set_index(CLAVE) if os.path.exists(ruta_estado) else None
+    actual = _normalizar(df, consulta, previo)
+
+    # Filas de delta acumuladas desde la última base
+    acumuladas, filas_base = 0, None
+    for e in catalogo.entradas(raiz, consulta):
+        if e["tipo"] == "base":
+            filas_base = e["filas"]
+            break
+        acumuladas += e["filas"]
+
+    sello = fecha.strftime("%Y%m%d_%H%M%S")
+    es_base = (
+        previo is None
+        or filas_base is None
+        or list(previo.columns) != list(actual.columns)
+        or acumuladas > FACTOR_REBASE * max(filas_base, 1)
+    )
+    if es_base:
+        datos = actual.assign(**{COLUMNA_BAJA: False})
+        fichero = f"{consulta}/base_{sello}.parquet"
+        altas, cambios, bajas = len(actual), 0, 0
+    else:
+        datos = _delta(previo, actual)
+        fichero = f"{consulta}/delta_{sello}.parquet"
+        bajas = int(datos[COLUMNA_BAJA].sum())
+        altas = int((~datos[COLUMNA_BAJA] & ~datos.index.isin(previo.index)).sum())
+        cambios = len(datos) - bajas - altas
+
+    if len(datos):
+        _escribir(datos, os.path.join(raiz, fichero))
+    _escribir(actual, ruta_estado)
+
+    entrada = {
+        "consulta": consulta,
+        "fecha": fecha.isoformat(timespec="seconds"),
+        "tipo": "base" if es_base else "delta",
+        "filas": len(datos),
+        "altas": altas,
+        "cambios": cambios,
+        "bajas": bajas,
+        "fichero": fichero,
+    }
+    catalogo.registrar(raiz, entrada)
+    print(
+        f"🗂️ Histórico {consulta} ({entrada['tipo']}): {len(datos)} filas | "
+        f"altas {altas}, cambios {cambios}, bajas {bajas}"
+    )
+    return entrada
+
+
+# ============================================================
+#  Lectura
+# ============================================================
+def _hasta_incluido(fecha: Optional[datetime]) -> Optional[datetime]:
+    return fecha + timedelta(seconds=1) if fecha is not None else None
+
+
+def _desde_ultima_base(entradas: List[dict]) -> List[dict]:
+    """De entradas en orden cronológico, las posteriores a la última base (incluida)."""
+    bases = [i for i, e in enumerate(entradas) if e["tipo"] == "base"]
+    return entradas[bases[-1]:] if bases else []
+
+
+def _leer(raiz: str, entrada: dict, columnas: Optional[List[str]] = None, device_id: Optional[str] = None) -> pd.DataFrame:
+    ruta = os.path.join(raiz, entrada["fichero"])
+    filtros = [(CLAVE, "==", device_id)] if device_id is not None else None
+    leer = None
+    if columnas is not None:
+        disponibles = set(pq.read_schema(ruta).names)
+        leer = [CLAVE, COLUMNA_BAJA] + [c for c in columnas if c in disponibles and c not in (CLAVE, COLUMNA_BAJA)]
+    return pq.read_table(ruta, columns=leer, filters=filtros).to_pandas().set_index(CLAVE)
+
+
+def reconstruir(
+    consulta: str,
+    fecha: Optional[datetime] = None,
+    columnas: Optional[List[str]] = None,
+    raiz: str = RUTA_HISTORIAL,
+) -> pd.DataFrame:
+    """Estado por dispositivo en la última ejecución <= `fecha` (por defecto, la última)."""
+    entradas = list(reversed(catalogo.entradas(raiz, consulta, hasta=_hasta_incluido(fecha))))
+    entradas = [e for e in _desde_ultima_base(entradas) if e["filas"]]
+    if not entradas:
+        return pd.DataFrame()
+
+    base = _leer(raiz, entradas[0], columnas)
+    estado = base
+    if len(entradas) > 1:
+        deltas = pd.concat([_leer(raiz, e, columnas) for e in entradas[1:]])
+        ultimos = deltas[~deltas.index.duplicated(keep="last")]
+        estado = pd.concat([
+            estado.drop(ultimos.index, errors="ignore"),
+            ultimos[~ultimos[COLUMNA_BAJA]],
+        ]).sort_index()
+        # Las filas de baja (sin KPIs) dejan columnas en object: se recupera el tipo de la base
+        for col, tipo in base.dtypes.items():
+            if estado[col].dtype != tipo:
+                try:
+                    estado[col] = estado[col].astype(tipo)
+                except (TypeError, ValueError):
+                    pass
+    return estado.drop(columns=COLUMNA_BAJA)
+
+
+def evolucion(
+    consulta: str,
+    device_id: str,
+    columna: str,
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    raiz: str = RUTA_HISTORIAL,
+) -> pd.Series:
+    """Valor de `columna` para `device_id` en cada ejecución del rango (NaN si no estaba en la flota)."""
+    todas = list(reversed(catalogo.entradas(raiz, consulta, hasta=_hasta_incluido(hasta))))
+    # Se parte de la última base anterior a `desde` para conocer el valor inicial
+    # (sin `desde`, de la primera: toda la historia)
+    if desde is None:
+        inicio = [e for e in todas if e["tipo"] == "base"][:1]
+    else:
+        inicio = _desde_ultima_base([e for e in todas if datetime.fromisoformat(e["fecha"]) <= desde])[:1]
+    entradas = [e for e in todas if inicio and e["fecha"] >= inicio[0]["fecha"]]
+
+    valores, valor = {}, np.nan
+    for e in entradas:
+        if e["filas"]:
+            fila = _leer(raiz, e, [columna], device_id=str(device_id))
+            if e["tipo"] == "base":
+                valor = np.nan
+            if len(fila):
+                valor = np.nan if fila[COLUMNA_BAJA].iloc[-1] or columna not in fila.columns else fila[columna].iloc[-1]
+        valores[datetime.fromisoformat(e["fecha"])] = valor
+
+    serie = pd.Series(valores, name=columna, dtype=object).infer_objects().rename_axis("fecha")
+    return serie[serie.index >= desde] if desde is not None else serie
+
+
+def importar_instantaneas(
+    consulta: str,
+    carpeta: str = RUTA_PROCESADOS,
+    raiz: str = RUTA_HISTORIAL,
+) -> int:
+    """Añade al histórico las instantáneas de `consulta` posteriores a su última entrada (de la más antigua a la más reciente)."""
+    ultima = catalogo.entradas(raiz, consulta)[:1]
+    desde = datetime.fromisoformat(ultima[0]["fecha"]) + timedelta(seconds=1) if ultima else None
+    rutas = list(reversed(listar_instantaneas(consulta, carpeta, desde=desde)))
+    for ruta in rutas:
+        df = leer_instantanea(ruta, columnas=[CLAVE] + COLUMNAS_KPI[consulta])
+        registrar_en_historial(df, consulta, fecha_instantanea(ruta), raiz)
+    print(f"✅ Histórico {consulta}: {len(rutas)} instantáneas importadas")
+    return len(rutas)
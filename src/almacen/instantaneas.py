@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Almacén de instantáneas de las consultas en Parquet (data/processed)
+
+- guardar_instantanea(): cada ejecución se escribe como
+      data/processed/<consulta>_<AAAA-mm-dd>_<HH-MM>_vNN.parquet
+  con el esquema tipado del DataFrame (fechas tz-aware, enteros nullable,
+  float32, category...), textos repetitivos como diccionario y compresión zstd.
+- leer_instantanea(ruta, columnas=[...]) lee solo las columnas pedidas (el
+  resto ni se descomprime). También lee los CSV antiguos. Con categorias=False
+  los textos vuelven como object (dashboards: groupby sin categorías vacías).
+- Cada escritura se anota en el catálogo (src.almacen.catalogo: consulta, fecha,
+  filas, hash del esquema, fichero, réplica, duración). listar_instantaneas(),
+  ultima_instantanea() y fecha_instantanea() consultan el catálogo, no el
+  directorio. Antes de consultarlo se reconcilia con la carpeta cuando esta
+  cambia (mtime del directorio): los ficheros sin línea en el manifiesto
+  (anteriores a él, traídos con git o copiados a mano, o de un proceso que cayó
+  antes de registrar) se anotan a partir de su nombre y esquema.
+- El CSV queda como exportación opcional (EXPORTAR_CSV=1 o exportar_csv=True),
+  con el mismo nombre y extensión .csv.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.almacen import catalogo
+
+RUTA_PROCESADOS = os.path.join("data", "processed")
+
+EXPORTAR_CSV = os.getenv("EXPORTAR_CSV", "0") == "1"
+COMPRESION = "zstd"
+NIVEL_COMPRESION = 6
+
+# Textos con menos de esta fracción de valores distintos → category (diccionario)
+MAX_FRACCION_DISTINTOS = 0.5
+
+EXTENSIONES = (".parquet", ".csv")
+
+_reconciliar_lock = threading.Lock()
+_reconciliadas: dict = {}  # carpeta → mtime (ns) del directorio en la última reconciliación
+_PATRON_NOMBRE = re.compile(r"_(\d{4}-\d{2}-\d{2})_(\d{2}-\d{2})_v(\d+)\.(parquet|csv)$")
+
+
+def generar_nombre_versionado(nombre_base, carpeta=RUTA_PROCESADOS, extension=".parquet"):
+    """<nombre_base>_<fecha>_<hora>_vNN<extension> que no exista todavía (en ningún formato)."""
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M")
+    base = f"{nombre_base}_{timestamp}"
+    version = 1
+
+    while True:
+        nombre = f"{base}_v{version:02d}"
+        if not any(os.path.exists(os.path.join(carpeta, nombre + ext)) for ext in EXTENSIONES):
+            return os.path.join(carpeta, nombre + extension)
+        version += 1
+
+
+# ============================================================
+#  Esquema tipado
+# ============================================================
+def _tipar_textos(df: pd.DataFrame) -> pd.DataFrame:
+    """Columnas object → boolean, binary (WKB en bytes), category (pocas distintas) o string."""
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        valores = df[col].dropna()
+        if valores.empty:
+            continue
+        tipos = valores.map(type)
+        if tipos.isin([bool, np.bool_]).all():
+            df[col] = df[col].astype("boolean")
+            continue
+        if tipos.isin([bytes, bytearray, memoryview]).all():
+            continue  # pyarrow lo guarda como binary
+        if not tipos.eq(str).all():
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        if valores.nunique() < MAX_FRACCION_DISTINTOS * len(valores):
+            df[col] = df[col].astype("category")
+    return df
+
+
+def tabla_tipada(df: pd.DataFrame) -> pa.Table:
+    return pa.Table.from_pandas(_tipar_textos(df), preserve_index=False)
+
+
+def hash_esquema(columnas: List[str], tipos: List[str]) -> str:
+    """Huella corta de (columna, tipo) para detectar cambios de esquema entre ejecuciones."""
+    return hashlib.sha1(json.dumps(list(zip(columnas, tipos))).encode()).hexdigest()[:16]
+
+
+# ============================================================
+#  Escritura / lectura
+# ============================================================
+def guardar_instantanea(
+    df: pd.DataFrame,
+    consulta: str,
+    carpeta: str = RUTA_PROCESADOS,
+    exportar_csv: Optional[bool] = None,
+    replica: Optional[str] = None,
+    duracion_s: Optional[float] = None,
+    fecha: Optional[datetime] = None,
+) -> str:
+    """
+    Escribe `df` como una instantánea nueva de `consulta` y la anota en el catálogo.
+    `fecha`: inicio de la ejecución (por defecto, ahora). Devuelve la ruta del Parquet.
+    """
+    fecha = fecha or datetime.now()
+    os.makedirs(carpeta, exist_ok=True)
+    _preparar_catalogo(carpeta)  # las no catalogadas, antes que la línea de esta
+    ruta = generar_nombre_versionado(consulta, carpeta)
+    tabla = tabla_tipada(df)
+    tmp = f"{ruta}.tmp"
+    pq.write_table(
+        tabla,
+        tmp,
+        compression=COMPRESION,
+        compression_level=NIVEL_COMPRESION,
+        use_dictionary=True,
+    )
+    entrada = {
+        "consulta": consulta,
+        "fecha": fecha.isoformat(timespec="seconds"),
+        "filas": tabla.num_rows,
+        "hash_esquema": hash_esquema(tabla.schema.names, [str(t) for t in tabla.schema.types]),
+        "fichero": os.path.basename(ruta),
+        "replica": replica,
+        "duracion_s": round(duracion_s, 3) if duracion_s is not None else None,
+    }
+    # Sin reconciliación a la vez: no se anotaría desde el nombre antes que con sus datos
+    with _reconciliar_lock:
+        os.replace(tmp, ruta)
+        catalogo.registrar(carpeta, entrada)
+
+    if EXPORTAR_CSV if exportar_csv is None else exportar_csv:
+        ruta_csv = ruta[: -len(".parquet")] + ".csv"
+        df.to_csv(ruta_csv, index=False)
+        print(f"📁 Exportado también a CSV: {ruta_csv}")
+    return ruta
+
+
+def columnas_instantanea(ruta: str) -> List[str]:
+    """Columnas de la instantánea sin leer los datos."""
+    if ruta.endswith(".parquet"):
+        return pq.read_schema(ruta).names
+    return list(pd.read_csv(ruta, nrows=0).columns)
+
+
+def leer_instantanea(ruta: str, columnas: Optional[List[str]] = None, categorias: bool = True) -> pd.DataFrame:
+    """
+    Lee la instantánea (solo `columnas` si se indican; las que no existan se ignoran).
+    categorias=False devuelve las columnas category como texto (object), igual que
+    el CSV: un groupby tras filtrar no saca filas de categorías sin datos.
+    """
+    if columnas is not None:
+        disponibles = set(columnas_instantanea(ruta))
+        columnas = [c for c in columnas if c in disponibles]
+    if ruta.endswith(".parquet"):
+        df = pq.read_table(ruta, columns=columnas).to_pandas()
+        if not categorias:
+            for col in df.columns[df.dtypes == "category"]:
+                df[col] = df[col].astype(object)
+        return df
+    return pd.read_csv(ruta, usecols=columnas)
+
+
+# ============================================================
+#  Búsqueda (vía catálogo)
+# ============================================================
+def _entrada_desde_nombre(carpeta: str, fichero: str) -> Optional[dict]:
+    """Entrada de catálogo para un fichero anterior al manifiesto (datos del nombre y del esquema)."""
+    m = _PATRON_NOMBRE.search(fichero)
+    if not m:
+        return None
+    ruta = os.path.join(carpeta, fichero)
+    filas = None
+    if fichero.endswith(".parquet"):
+        esquema = pq.read_schema(ruta)
+        filas = pq.read_metadata(ruta).num_rows
+        columnas, tipos = esquema.names, [str(t) for t in esquema.types]
+    else:
+        columnas = columnas_instantanea(ruta)
+        tipos = ["csv"] * len(columnas)
+    fecha = datetime.strptime(f"{m.group(1)}_{m.group(2)}", "%Y-%m-%d_%H-%M")
+    return {
+        "consulta": fichero[: m.start()],
+        "fecha": fecha.isoformat(timespec="seconds"),
+        "filas": filas,
+        "hash_esquema": hash_esquema(columnas, tipos),
+        "fichero": fichero,
+        "replica": None,
+        "duracion_s": None,
+    }
+
+
+def _anotar_no_catalogadas(carpeta: str) -> int:
+    """Anota en el catálogo las instantáneas de `carpeta` que no estén. Devuelve cuántas."""
+    ficheros = sorted(f for f in os.listdir(carpeta) if f.endswith(EXTENSIONES))
+    parquets = {os.path.splitext(f)[0] for f in ficheros if f.endswith(".parquet")}
+    catalogadas = catalogo.ficheros(carpeta)
+    anadidas = 0
+    for f in ficheros:
+        if f in catalogadas or (f.endswith(".csv") and os.path.splitext(f)[0] in parquets):
+            continue
+        try:
+            entrada = _entrada_desde_nombre(carpeta, f)
+        except Exception as e:
+            print(f"⚠️ No se pudo catalogar {f}: {e}")
+            continue
+        if entrada:
+            catalogo.registrar(carpeta, entrada)
+            anadidas += 1
+    return anadidas
+
+
+def reconstruir_manifiesto(carpeta: str = RUTA_PROCESADOS) -> int:
+    """
+    Anota en el catálogo las instantáneas de `carpeta` que no estén (una pasada por
+    el directorio; un CSV con el mismo nombre que su Parquet no se anota aparte).
+    Devuelve cuántas se añadieron.
+    """
+    if not os.path.isdir(carpeta):
+        return 0
+    t0 = time.perf_counter()
+    with _reconciliar_lock:
+        anadidas = _anotar_no_catalogadas(carpeta)
+    print(f"🗂️ Catálogo de {carpeta}: {anadidas} instantáneas añadidas en {time.perf_counter() - t0:.1f}s")
+    return anadidas
+
+
+def _preparar_catalogo(carpeta: str) -> None:
+    """Reconcilia la carpeta con el manifiesto si el directorio cambió desde la última vez."""
+    try:
+        mtime = os.stat(carpeta).st_mtime_ns
+    except FileNotFoundError:
+        return
+    with _reconciliar_lock:
+        if _reconciliadas.get(carpeta) == mtime:
+            return
+        anadidas = _anotar_no_catalogadas(carpeta)
+        if anadidas:
+            print(f"🗂️ Catálogo de {carpeta}: {anadidas} instantáneas sin catalogar añadidas")
+        # mtime de ANTES de listar: lo que llegue mientras tanto se ve la próxima vez.
+        # Un mtime de hace menos de un par de segundos no se da por bueno (la
+        # resolución del sistema de ficheros puede juntar dos cambios en el mismo).
+        if time.time_ns() - mtime > 2_000_000_000:
+            _reconciliadas[carpeta] = mtime
+
+
+def listar_instantaneas(
+    consulta: str,
+    carpeta: str = RUTA_PROCESADOS,
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+) -> List[str]:
+    """Instantáneas de `consulta` (desde <= fecha < hasta), de la más reciente a la más antigua."""
+    _preparar_catalogo(carpeta)
+    rutas = (os.path.join(carpeta, e["fichero"]) for e in catalogo.entradas(carpeta, consulta, desde, hasta))
+    return [r for r in rutas if os.path.exists(r)]
+
+
+def ultima_instantanea(consulta: str, carpeta: str = RUTA_PROCESADOS) -> Optional[str]:
+    _preparar_catalogo(carpeta)
+    for e in catalogo.entradas(carpeta, consulta):
+        ruta = os.path.join(carpeta, e["fichero"])
+        if os.path.exists(ruta):
+            return ruta
+    return None
+
+
+def fecha_instantanea(ruta: str) -> Optional[datetime]:
+    """Fecha de ejecución según el catálogo (o el nombre del fichero si no está catalogado)."""
+    e = catalogo.entrada(os.path.dirname(ruta), os.path.basename(ruta))
+    if e:
+        return datetime.fromisoformat(e["fecha"])
+    m = _PATRON_NOMBRE.search(os.path.basename(ruta))
+    return datetime.strptime(f"{m.group(1)}_{m.group(2)}", "%Y-%m-%d_%H-%M") if m else None
@@ -3,11 +3,14 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import os
 import inspect
-from datetime import datetime
 from matplotlib.colors import ListedColormap, BoundaryNorm
 
+from src.almacen.instantaneas import fecha_instantanea, leer_instantanea, listar_instantaneas
+
 plt.style.use("ggplot")
 
+COLUMNAS_NECESARIAS = {"clasificacion_conexion", "pct_recibidos_vs_esperados", "customer_name"}
+
 def ejecutar():
     nombre_script = os.path.splitext(os.path.basename(inspect.getfile(inspect.currentframe())))[0]
     carpeta_csv = "data/processed"
@@ -16,17 +19,14 @@ def ejecutar():
     subdir_top = os.path.join(carpeta_figs, "Top Clientes Inactivos y Ratio")
     os.makedirs(subdir_top, exist_ok=True)
 
-    archivos = sorted(
-        [f for f in os.listdir(carpeta_csv) if f.startswith(nombre_script) and f.endswith(".csv")],
-        reverse=True
-    )
+    archivos = [os.path.basename(r) for r in listar_instantaneas(nombre_script, carpeta_csv)]
 
     if not archivos:
-        print(f"⚠️ No hay CSVs para {nombre_script}")
+        print(f"⚠️ No hay instantáneas para {nombre_script}")
         return
 
     for archivo_csv in archivos:
-        nombre_base = archivo_csv.replace(".csv", "")
+        nombre_base = os.path.splitext(archivo_csv)[0]
         ruta_csv = os.path.join(carpeta_csv, archivo_csv)
         ruta_fig = os.path.join(subdir_top, f"{nombre_base}_heatmap_inactivos48h_y_ratios.png")
 
@@ -34,18 +34,16 @@ def ejecutar():
             print(f"✅ Heatmap ya generado para {archivo_csv}")
             continue
 
-        print(f"📄 Procesando CSV: {archivo_csv}")
-        df = pd.read_csv(ruta_csv)
+        print(f"📄 Procesando instantánea: {archivo_csv}")
+        df = leer_instantanea(ruta_csv, columnas=list(COLUMNAS_NECESARIAS), categorias=False)
 
         try:
-            fecha_str, hora_str = archivo_csv.split("_")[2:4]
-            dt_full = datetime.strptime(f"{fecha_str}_{hora_str}", "%Y-%m-%d_%H-%M")
+            dt_full = fecha_instantanea(ruta_csv)
             fecha_hora_titulo = dt_full.strftime("%d/%m/%Y %H:%M")
         except Exception:
             fecha_hora_titulo = "fecha desconocida"
 
-        columnas_necesarias = {"clasificacion_conexion", "pct_recibidos_vs_esperados", "customer_name"}
-        if not columnas_necesarias.issubset(df.columns):
+        if not COLUMNAS_NECESARIAS.issubset(df.columns):
             print(f"⚠️ Saltando heatmap: faltan columnas necesarias en {archivo_csv}")
             continue
 
@@ -3,9 +3,10 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import os
 import inspect
-from datetime import datetime
 from matplotlib.patches import Patch
 
+from src.almacen.instantaneas import fecha_instantanea, leer_instantanea, listar_instantaneas
+
 plt.style.use("ggplot")
 
 def ejecutar():
@@ -21,19 +22,16 @@ def ejecutar():
     os.makedirs(subdir_clasif, exist_ok=True)
     os.makedirs(subdir_inactividad, exist_ok=True)
 
-    archivos = sorted(
-        [f for f in os.listdir(carpeta_csv) if f.startswith(nombre_script) and f.endswith(".csv")],
-        reverse=True
-    )
+    archivos = [os.path.basename(r) for r in listar_instantaneas(nombre_script, carpeta_csv)]
 
     if not archivos:
-        print(f"⚠️ No hay CSVs para {nombre_script}")
+        print(f"⚠️ No hay instantáneas para {nombre_script}")
         return
 
     nuevos_generados = 0
 
     for archivo_csv in archivos:
-        nombre_base = archivo_csv.replace(".csv", "")
+        nombre_base = os.path.splitext(archivo_csv)[0]
         ruta_csv = os.path.join(carpeta_csv, archivo_csv)
 
         ruta_fig1 = os.path.join(subdir_hist, f"{nombre_base}_hist_ratio_mensajes.png")
@@ -50,14 +48,11 @@ def ejecutar():
             continue
 
 
-        print(f"📄 Procesando CSV: {archivo_csv}")
-        df = pd.read_csv(ruta_csv)
+        print(f"📄 Procesando instantánea: {archivo_csv}")
+        df = leer_instantanea(ruta_csv, categorias=False)
 
         try:
-            partes = archivo_csv.split("_")
-            fecha_str = partes[2]
-            hora_str = partes[3]
-            dt_full = datetime.strptime(f"{fecha_str}_{hora_str}", "%Y-%m-%d_%H-%M")
+            dt_full = fecha_instantanea(ruta_csv)
             fecha_hora_titulo = dt_full.strftime("%d/%m/%Y %H:%M")
         except Exception as e:
             print("⚠️ No se pudo extraer la fecha y hora:", e)
@@ -3,18 +3,19 @@ import matplotlib.pyplot as plt
 import os
 import inspect
 
+from src.almacen.instantaneas import leer_instantanea, ultima_instantanea
+
 plt.style.use("ggplot")
 
 def ejecutar():
     nombre_script = os.path.splitext(os.path.basename(inspect.getfile(inspect.currentframe())))[0]
     carpeta_csv = "data/processed"
-    archivos = sorted([f for f in os.listdir(carpeta_csv) if f.startswith(nombre_script) and f.endswith(".csv")], reverse=True)
-    if not archivos:
-        print(f"⚠️ No hay CSV para {nombre_script}")
+    ruta_csv = ultima_instantanea(nombre_script, carpeta_csv)
+    if not ruta_csv:
+        print(f"⚠️ No hay instantáneas para {nombre_script}")
         return
 
-    ruta_csv = os.path.join(carpeta_csv, archivos[0])
-    df = pd.read_csv(ruta_csv)
+    df = leer_instantanea(ruta_csv, categorias=False)
     print(f"📄 Usando: {ruta_csv}")
     out_dir = os.path.join("outputs", "figures", nombre_script)
     os.makedirs(out_dir, exist_ok=True)
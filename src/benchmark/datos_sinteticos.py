@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+Flota sintética con el esquema de data/raw/estructura_columnas_ixorigue.csv
+
+- crear_esquema(): CREATE TABLE de las tablas que leen las consultas (Devices,
+  Animals, Ranches, Customers, LoraGateways, RanchesLoraGateways, DeviceLocations)
+  con TODAS las columnas y tipos del CSV de estructura (+ las que usan las
+  consultas y aún no figuran en él), PostGIS para las geometrías e índices
+  equivalentes a los de producción.
+- generar_flota(): tablas de dimensiones en memoria con nº de dispositivos,
+  ranchos y gateways configurables.
+- generar_uplinks(): DeviceLocations por lotes de dispositivos (memoria acotada
+  también con 1M de dispositivos): uplinks/día y mezcla de validez GPS configurables.
+- cargar_postgres(): COPY FROM STDIN de todo lo anterior + ANALYZE.
+
+Las columnas que ninguna consulta usa quedan a NULL.
+"""
+
+import io
+import os
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+RUTA_ESTRUCTURA = os.path.join("data", "raw", "estructura_columnas_ixorigue.csv")
+
+TABLAS = [
+    "Customers",
+    "Ranches",
+    "LoraGateways",
+    "RanchesLoraGateways",
+    "Devices",
+    "Animals",
+    "DeviceLocations",
+]
+
+# Columnas que usan las consultas y no están en el CSV de estructura
+COLUMNAS_EXTRA = {
+    "Devices": {"IgnoreStatisticsUntil": "date"},
+    "Ranches": {"Country": "character varying", "Region": "character varying"},
+}
+
+COLUMNAS_GEOMETRIA = {"Location", "LastLocation", "LastValidLocation"}
+
+_TIPOS_PG = {
+    "uuid": "uuid",
+    "character varying": "varchar",
+    "text": "text",
+    "integer": "integer",
+    "smallint": "smallint",
+    "bigint": "bigint",
+    "double precision": "double precision",
+    "numeric": "numeric",
+    "boolean": "boolean",
+    "date": "date",
+    "timestamp with time zone": "timestamptz",
+    "jsonb": "jsonb",
+    "macaddr8": "macaddr8",
+    "USER-DEFINED": "text",  # enums → texto (las consultas comparan con literales)
+}
+
+INDICES = [
+    'CREATE INDEX ON "DeviceLocations" ("DeviceId", "Time")',
+    'CREATE INDEX ON "DeviceLocations" ("Time")',
+    'CREATE INDEX ON "Animals" ("DeviceId")',
+    'CREATE INDEX ON "Devices" ("RanchId")',
+    'CREATE INDEX ON "RanchesLoraGateways" ("RanchId")',
+]
+
+# Mezcla por defecto de uplinks (suma 1)
+MEZCLA_GPS = {
+    "valida": 0.72,
+    "valida_baja_precision": 0.06,
+    "no_valida_parameters": 0.07,
+    "no_valida_distance": 0.04,
+    "sin_gps": 0.11,
+}
+
+
+@dataclass
+class ConfigFlota:
+    dispositivos: int = 10_000
+    ranchos: Optional[int] = None  # por defecto 1 por cada 50 dispositivos
+    gateways: Optional[int] = None  # por defecto 2 por rancho
+    dias: int = 7
+    uplinks_por_dia: List[int] = field(default_factory=lambda: [12, 24, 48])
+    # Fracción media de uplinks esperados que llegan (varía por dispositivo)
+    recepcion_media: float = 0.8
+    mezcla_gps: Dict[str, float] = field(default_factory=lambda: dict(MEZCLA_GPS))
+    semilla: int = 42
+    hasta: Optional[datetime] = None  # fin de los uplinks (por defecto, ahora)
+
+    def __post_init__(self):
+        self.ranchos = self.ranchos or max(1, self.dispositivos // 50)
+        self.gateways = self.gateways or 2 * self.ranchos
+        self.hasta = self.hasta or datetime.now(timezone.utc).replace(microsecond=0)
+        total = sum(self.mezcla_gps.values())
+        if not np.isclose(total, 1.0):
+            raise ValueError(f"La mezcla GPS debe sumar 1 (suma {total})")
+
+
+# ============================================================
+#  Esquema
+# ============================================================
+def columnas_tabla(ruta_estructura: str = RUTA_ESTRUCTURA) -> Dict[str, Dict[str, str]]:
+    """{tabla: {columna: tipo Postgres}} según el CSV de estructura (+ COLUMNAS_EXTRA)."""
+    estructura = pd.read_csv(ruta_estructura)
+    columnas = {}
+    for tabla in TABLAS:
+        filas = estructura[estructura["table_name"] == tabla]
+        tipos = {}
+        for columna, tipo in zip(filas["column_name"], filas["data_type"]):
+            if columna in COLUMNAS_GEOMETRIA:
+                tipos[columna] = "geometry"
+            else:
+                tipos[columna] = _TIPOS_PG.get(tipo, "text")
+        for columna, tipo in COLUMNAS_EXTRA.get(tabla, {}).items():
+            tipos[columna] = _TIPOS_PG[tipo]
+        columnas[tabla] = tipos
+    return columnas
+
+
+def ddl(ruta_estructura: str = RUTA_ESTRUCTURA) -> List[str]:
+    sentencias = ["CREATE EXTENSION IF NOT EXISTS postgis"]
+    for tabla, tipos in columnas_tabla(ruta_estructura).items():
+        cuerpo = ",\n  ".join(f'"{c}" {t}' for c, t in tipos.items())
+        clave = ',\n  PRIMARY KEY ("Id")' if "Id" in tipos else ""
+        sentencias.append(f'DROP TABLE IF EXISTS "{tabla}"')
+        sentencias.append(f'CREATE TABLE "{tabla}" (\n  {cuerpo}{clave}\n)')
+    return sentencias
+
+
+def crear_esquema(engine, ruta_estructura: str = RUTA_ESTRUCTURA) -> None:
+    with engine.begin() as con:
+        for sentencia in ddl(ruta_estructura):
+            con.exec_driver_sql(sentencia)
+    print(f"🗂️ Esquema sintético creado ({len(TABLAS)} tablas)")
+
+
+# ============================================================
+#  Generación
+# ============================================================
+def _uuids(rng: np.random.Generator, n: int) -> np.ndarray:
+    """UUID v4 reproducibles a partir de la semilla."""
+    crudos = rng.integers(0, 256, size=(n, 16), dtype=np.uint8)
+    return np.array([str(uuid.UUID(bytes=bytes(fila), version=4)) for fila in crudos], dtype=object)
+
+
+def _puntos(lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """EWKT (SRID=4326;POINT(lon lat)), entrada válida para geometry en COPY."""
+    return np.char.add(
+        np.char.add(np.char.add("SRID=4326;POINT(", np.round(lon, 6).astype(str)), " "),
+        np.char.add(np.round(lat, 6).astype(str), ")"),
+    ).astype(object)
+
+
+def generar_flota(config: ConfigFlota) -> Dict[str, pd.DataFrame]:
+    """Clientes, ranchos, gateways, dispositivos y animales (sin DeviceLocations)."""
+    rng = np.random.default_rng(config.semilla)
+    hasta = pd.Timestamp(config.hasta)
+
+    n_clientes = max(1, config.ranchos // 5)
+    clientes = pd.DataFrame({
+        "Id": _uuids(rng, n_clientes),
+        "Number": np.arange(1, n_clientes + 1),
+        "Name": [f"Cliente {i:05d}" for i in range(n_clientes)],
+        "Status": rng.choice(["active", "inactive"], n_clientes, p=[0.9, 0.1]),
+        "Created": hasta - pd.Timedelta(days=400),
+    })
+
+    # Centros de rancho repartidos por la península
+    centro_lon = rng.uniform(-8.5, 2.5, config.ranchos)
+    centro_lat = rng.uniform(37.0, 43.0, config.ranchos)
+    ranchos = pd.DataFrame({
+        "Id": _uuids(rng, config.ranchos),
+        "Name": [f"Ganadería {i:05d}" for i in range(config.ranchos)],
+        "CustomerId": clientes["Id"].to_numpy()[rng.integers(0, n_clientes, config.ranchos)],
+        "Country": "ES",
+        "Region": rng.choice(["Andalucía", "Extremadura", "Castilla y León", "Asturias", "Cataluña"], config.ranchos),
+        "Location": _puntos(centro_lon, centro_lat),
+        "Disabled": False,
+        "Created": hasta - pd.Timedelta(days=365),
+    })
+
+    # Gateways: la mayoría vistos hace poco, algunos desconectados horas o días
+    retraso_h = np.where(rng.random(config.gateways) < 0.8, rng.uniform(0, 2, config.gateways), rng.uniform(3, 240, config.gateways))
+    rancho_gw = rng.integers(0, config.ranchos, config.gateways)
+    gateways = pd.DataFrame({
+        "Id": _uuids(rng, config.gateways),
+        "Name": [f"GW-{i:05d}" for i in range(config.gateways)],
+        "SerialNumber": np.arange(100000, 100000 + config.gateways),
+        "LastSeenAt": hasta - pd.to_timedelta(retraso_h, unit="h"),
+        "CreatedAt": hasta - pd.to_timedelta(rng.uniform(30, 700, config.gateways), unit="D"),
+        "Location": _puntos(centro_lon[rancho_gw] + rng.normal(0, 0.01, config.gateways),
+                            centro_lat[rancho_gw] + rng.normal(0, 0.01, config.gateways)),
+        "Installed": True,
+    })
+    ranchos_gateways = pd.DataFrame({
+        "Id": _uuids(rng, config.gateways),
+        "RanchId": ranchos["Id"].to_numpy()[rancho_gw],
+        "GatewayId": gateways["Id"],
+    })
+
+    n = config.dispositivos
+    rancho_dev = rng.integers(0, config.ranchos, n)
+    dispositivos = pd.DataFrame({
+        "Id": _uuids(rng, n),
+        "SerialNumber": [f"IXO{i:08d}" for i in range(n)],
+        "RanchId": ranchos["Id"].to_numpy()[rancho_dev],
+        "Model": rng.choice(["collar_v2", "collar_v3", "tag_v1"], n, p=[0.5, 0.35, 0.15]),
+        "UplinksPerDay": rng.choice(config.uplinks_por_dia, n),
+        "Disabled": rng.random(n) < 0.03,
+        "StatusType": rng.choice(["shipped", "stock", "returned"], n, p=[0.94, 0.04, 0.02]),
+        "LastSeenOn": hasta - pd.to_timedelta(rng.exponential(6, n), unit="h"),
+        "ResetsCount": rng.poisson(2, n),
+        "AverageGpsTtf": np.round(rng.gamma(4, 8, n), 2),
+        "BatteryEstimation": np.round(rng.uniform(5, 100, n), 1),
+        "ChangedBatteryOn": (hasta - pd.to_timedelta(rng.integers(10, 400, n), unit="D")).date,
+        "SumUplinksCount": rng.integers(1_000, 200_000, n),
+        "Created": hasta - pd.Timedelta(days=500),
+    })
+    # Algunos con estadísticas suspendidas hasta una fecha futura
+    dispositivos["IgnoreStatisticsUntil"] = np.where(rng.random(n) < 0.01, (hasta + pd.Timedelta(days=3)).date(), None)
+
+    con_animal = rng.random(n) < 0.92
+    n_animales = int(con_animal.sum())
+    animales = pd.DataFrame({
+        "Id": _uuids(rng, n_animales),
+        "RanchId": dispositivos.loc[con_animal, "RanchId"].to_numpy(),
+        "DeviceId": dispositivos.loc[con_animal, "Id"].to_numpy(),
+        "Name": [f"Animal {i:07d}" for i in range(n_animales)],
+        "EarTag": [f"ES{i:010d}" for i in range(n_animales)],
+        "Specie": rng.choice(["cow", "sheep", "goat", "horse"], n_animales, p=[0.7, 0.15, 0.1, 0.05]),
+        "IsDeregistered": rng.random(n_animales) < 0.05,
+        "Created": hasta - pd.Timedelta(days=300),
+    })
+
+    print(
+        f"🗂️ Flota sintética: {n} dispositivos | {config.ranchos} ranchos | "
+        f"{config.gateways} gateways | {n_animales} animales"
+    )
+    return {
+        "Customers": clientes,
+        "Ranches": ranchos,
+        "LoraGateways": gateways,
+        "RanchesLoraGateways": ranchos_gateways,
+        "Devices": dispositivos,
+        "Animals": animales,
+    }
+
+
+def generar_uplinks(
+    config: ConfigFlota,
+    dispositivos: pd.DataFrame,
+    ranchos: pd.DataFrame,
+    tamano_lote: int = 20_000,
+) -> Iterator[pd.DataFrame]:
+    """DeviceLocations de los últimos `config.dias`, por lotes de `tamano_lote` dispositivos."""
+    rng = np.random.default_rng(config.semilla + 1)
+    hasta = pd.Timestamp(config.hasta)
+    segundos = config.dias * 86400
+
+    centros = ranchos.set_index("Id")["Location"].str.extract(r"POINT\(([-\d.]+) ([-\d.]+)\)").astype(float)
+    tipos = list(config.mezcla_gps)
+    probabilidades = [config.mezcla_gps[t] for t in tipos]
+
+    for inicio in range(0, len(dispositivos), tamano_lote):
+        lote = dispositivos.iloc[inicio:inicio + tamano_lote]
+        # Recepción por dispositivo: la mayoría cerca de la media, una cola de dispositivos malos
+        recepcion = np.clip(rng.beta(8 * config.recepcion_media, 8 * (1 - config.recepcion_media), len(lote)), 0, 1)
+        esperados = lote["UplinksPerDay"].to_numpy() * config.dias * recepcion
+        cuantos = rng.poisson(esperados)
+        total = int(cuantos.sum())
+        if total == 0:
+            continue
+
+        indice = np.repeat(np.arange(len(lote)), cuantos)
+        tipo = np.array(tipos)[rng.choice(len(tipos), total, p=probabilidades)]
+        tiene_gps = tipo != "sin_gps"
+        valida = np.char.startswith(tipo.astype(str), "valida")
+
+        centro = centros.loc[lote["RanchId"].to_numpy()[indice]].to_numpy()
+        lon = centro[:, 0] + rng.normal(0, 0.01, total)
+        lat = centro[:, 1] + rng.normal(0, 0.01, total)
+        localizacion = np.where(tiene_gps, _puntos(lon, lat), None)
+
+        motivo = np.full(total, None, dtype=object)
+        motivo[tipo == "no_valida_parameters"] = "parameters"
+        motivo[tipo == "no_valida_distance"] = "distance"
+
+        yield pd.DataFrame({
+            "DeviceId": lote["Id"].to_numpy()[indice],
+            "Location": localizacion,
+            "HasLocation": tiene_gps,
+            "Time": hasta - pd.to_timedelta(rng.uniform(0, segundos, total), unit="s"),
+            "InvalidReason": motivo,
+            "IsValid": valida,
+            "IsLowAccuracy": tipo == "valida_baja_precision",
+            "TimeToFix": np.where(tiene_gps, rng.integers(5, 90, total), None),
+            "MaxRssi": rng.integers(-120, -60, total),
+            "MaxSnr": np.round(rng.normal(5, 4, total), 1),
+        })
+
+
+# ============================================================
+#  Carga (COPY)
+# ============================================================
+def _copiar(raw, tabla: str, df: pd.DataFrame) -> None:
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep="\\N", date_format="%Y-%m-%d %H:%M:%S.%f%z")
+    buffer.seek(0)
+    columnas = ", ".join(f'"{c}"' for c in df.columns)
+    with raw.cursor() as cur:
+        cur.copy_expert(f'COPY "{tabla}" ({columnas}) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')', buffer)
+
+
+def cargar_postgres(engine, config: ConfigFlota, ruta_estructura: str = RUTA_ESTRUCTURA) -> Dict[str, int]:
+    """Crea el esquema, carga la flota y los uplinks con COPY y hace ANALYZE. Devuelve filas por tabla."""
+    crear_esquema(engine, ruta_estructura)
+    flota = generar_flota(config)
+    filas = {}
+
+    with engine.connect() as con:
+        raw = con.connection.driver_connection
+        for tabla, df in flota.items():
+            _copiar(raw, tabla, df)
+            filas[tabla] = len(df)
+        raw.commit()
+
+        filas["DeviceLocations"] = 0
+        for lote in generar_uplinks(config, flota["Devices"], flota["Ranches"]):
+            _copiar(raw, "DeviceLocations", lote)
+            raw.commit()
+            filas["DeviceLocations"] += len(lote)
+        print(f"📁 DeviceLocations: {filas['DeviceLocations']} uplinks ({config.dias} días)")
+
+    with engine.begin() as con:
+        for sentencia in INDICES:
+            con.exec_driver_sql(sentencia)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as con:
+        con.exec_driver_sql("ANALYZE")
+    print("✅ Datos sintéticos cargados e indexados")
+    return filas
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Caché local de agregados DIARIOS por dispositivo (Parquet particionado por fecha)
+
+- Un fichero por día natural: data/cache/agregados_diarios/<zona>/fecha=YYYY-MM-DD/part.parquet
+- Contadores por dispositivo: recibidos_n, sin_gps_n, con_gps_n, validas_n,
+  baja_precision_n, no_validas_n, no_valida_calidad_gps_n, no_valida_filtro_velocidad_n
+- Solo se consulta la réplica para los días que faltan en caché.
+- Los días recientes (hoy y ayer por defecto, en la zona de los días naturales)
+  se leen siempre y NO se guardan, porque todavía pueden llegar uplinks.
+- Los contadores se calculan sobre TODO DeviceLocations del día (sin filtrar por base),
+  así el dato guardado no depende del estado actual de Devices/Animals.
+- Los contadores son sumables: cada día se lee con troceo adaptativo (trozos de
+  horas que se suman) y solo se guarda si no se omitió ningún trozo.
+"""
+
+import os
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+from sqlalchemy import text
+
+from src.almacen.escritura import escribir_atomico
+from src.db.ejecutor_chunks import ejecutar_chunks, leer_adaptativo
+
+RUTA_AGREGADOS = os.path.join("data", "cache", "agregados_diarios")
+
+# Días (contando hoy) que se consideran "vivos" y no se guardan en caché
+DIAS_MUTABLES = int(os.getenv("AGREGADOS_DIAS_MUTABLES", "2"))
+
+CONTADORES = [
+    "recibidos_n",
+    "sin_gps_n",
+    "con_gps_n",
+    "validas_n",
+    "baja_precision_n",
+    "no_validas_n",
+    "no_valida_calidad_gps_n",
+    "no_valida_filtro_velocidad_n",
+]
+
+# =========================
+#  SQL: contadores de 1 día para todos los dispositivos con uplinks
+# =========================
+SQL_AGREGADOS_DIA = text("""
+SELECT
+  dl."DeviceId" AS device_id,
+  COUNT(dl."Time")                                                     AS recibidos_n,
+  COUNT(dl."Time") FILTER (WHERE NOT dl."HasLocation")                 AS sin_gps_n,
+  COUNT(dl."Time") FILTER (WHERE dl."HasLocation")                     AS con_gps_n,
+  COUNT(dl."Time") FILTER (WHERE dl."HasLocation" AND dl."IsValid")    AS validas_n,
+  COUNT(dl."Time") FILTER (WHERE dl."HasLocation" AND dl."IsValid" AND dl."IsLowAccuracy") AS baja_precision_n,
+  COUNT(dl."Time") FILTER (WHERE dl."HasLocation" AND NOT dl."IsValid") AS no_validas_n,
+  COUNT(dl."Time") FILTER (WHERE dl."HasLocation" AND NOT dl."IsValid" AND dl."InvalidReason" = 'parameters') AS no_valida_calidad_gps_n,
+  COUNT(dl."Time") FILTER (WHERE dl."HasLocation" AND NOT dl."IsValid" AND dl."InvalidReason" = 'distance')   AS no_valida_filtro_velocidad_n
+FROM "DeviceLocations" dl
+WHERE dl."Time" >= :inicio
+  AND dl."Time" <  :fin
+GROUP BY dl."DeviceId";
+""")
+
+
+def _ruta_dia(fecha: date, set_timezone: str, raiz: str = RUTA_AGREGADOS) -> str:
+    """Los días naturales dependen de la TZ de sesión → una carpeta por zona."""
+    zona = (set_timezone or "UTC").replace("/", "-")
+    return os.path.join(raiz, zona, f"fecha={fecha:%Y-%m-%d}", "part.parquet")
+
+
+def es_cacheable(fecha: date, hoy: Optional[date] = None, set_timezone: str = "Europe/Madrid") -> bool:
+    """
+    Un día es inmutable si es anterior a los DIAS_MUTABLES más recientes.
+    `hoy` por defecto es la fecha actual en `set_timezone` (la de los días naturales),
+    no la del reloj local de la máquina.
+    """
+    hoy = hoy or datetime.now(ZoneInfo(set_timezone or "UTC")).date()
+    return fecha <= hoy - timedelta(days=DIAS_MUTABLES)
+
+
+def _normalizar(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.reindex(columns=["device_id"] + CONTADORES).copy()
+    df["device_id"] = df["device_id"].astype(str)
+    df[CONTADORES] = df[CONTADORES].fillna(0).astype("int64")
+    return df
+
+
+def _sumar_trozos(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Contadores de varios trozos del mismo día → un registro por dispositivo."""
+    todo = _normalizar(pd.concat(frames, ignore_index=True))
+    return todo.groupby("device_id", as_index=False)[CONTADORES].sum()
+
+
+def leer_dia_replica(con, fecha: date, statement_timeout: str = "10min") -> Tuple[pd.DataFrame, bool]:
+    """
+    Contadores de un día natural [00:00, 24:00) en la TZ de la sesión.
+    Devuelve (contadores, completo); completo=False si se omitió algún trozo.
+    """
+    ini = datetime.combine(fecha, datetime.min.time())
+    fin = ini + timedelta(days=1)
+    df, omitidas = leer_adaptativo(
+        con,
+        SQL_AGREGADOS_DIA,
+        lambda a, b: {"inicio": a.isoformat(sep=" "), "fin": b.isoformat(sep=" ")},
+        ini,
+        fin,
+        consulta="agregados_diarios",
+        combinar=_sumar_trozos,
+        statement_timeout=statement_timeout,
+    )
+    return _normalizar(df), not omitidas
+
+
+def guardar_dia(df: pd.DataFrame, fecha: date, set_timezone: str, raiz: str = RUTA_AGREGADOS) -> None:
+    ruta = _ruta_dia(fecha, set_timezone, raiz)
+    escribir_atomico(ruta, lambda tmp: df.to_parquet(tmp, index=False))
+
+
+def leer_dia_cache(fecha: date, set_timezone: str, raiz: str = RUTA_AGREGADOS):
+    """DataFrame del día si está en caché; None si falta."""
+    ruta = _ruta_dia(fecha, set_timezone, raiz)
+    if not os.path.exists(ruta):
+        return None
+    return _normalizar(pd.read_parquet(ruta))
+
+
+def obtener_agregados(
+    engine,
+    fechas: Iterable[date],
+    set_timezone: str = "Europe/Madrid",
+    raiz: str = RUTA_AGREGADOS,
+    max_workers: int = None,
+    statement_timeout: str = "10min",
+) -> pd.DataFrame:
+    """
+    Devuelve los contadores diarios (device_id, fecha, CONTADORES...) del rango.
+    - Días en caché → se leen de disco.
+    - Días que faltan → se piden a la réplica en paralelo (ejecutor de chunks)
+      y se guardan si ya son inmutables.
+    """
+    fechas = list(fechas)
+    por_fecha = {}
+    for fecha in fechas:
+        if es_cacheable(fecha, set_timezone=set_timezone):
+            df_dia = leer_dia_cache(fecha, set_timezone, raiz)
+            if df_dia is not None:
+                por_fecha[fecha] = df_dia
+
+    faltan = [f for f in fechas if f not in por_fecha]
+    ventanas = [
+        (datetime.combine(f, datetime.min.time()), datetime.combine(f + timedelta(days=1), datetime.min.time()))
+        for f in faltan
+    ]
+    leidos = ejecutar_chunks(
+        engine,
+        ventanas,
+        lambda con, ini, fin: leer_dia_replica(con, ini.date(), statement_timeout),
+        set_timezone=set_timezone,
+        max_workers=max_workers,
+        statement_timeout=statement_timeout,
+    )
+    for fecha, (df_dia, completo) in zip(faltan, leidos):
+        por_fecha[fecha] = df_dia
+        # Un día con trozos omitidos (o vacío) no se guarda: se volverá a pedir
+        if es_cacheable(fecha, set_timezone=set_timezone) and completo and not df_dia.empty:
+            guardar_dia(df_dia, fecha, set_timezone, raiz)
+
+    print(f"🗂️ Agregados diarios | Desde caché: {len(fechas) - len(faltan)} días | Desde réplica: {len(faltan)} días")
+
+    frames: List[pd.DataFrame] = []
+    for fecha in fechas:
+        df_dia = por_fecha[fecha].copy()
+        df_dia["fecha"] = fecha
+        frames.append(df_dia)
+
+    if not frames:
+        return pd.DataFrame(columns=["device_id", "fecha"] + CONTADORES)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+Último estado conocido por dispositivo (caché local incremental)
+
+Sustituye al CTE `gps_stats_full`, que en cada consulta agrupaba TODO
+"DeviceLocations" con dos subconsultas correlacionadas por dispositivo.
+
+- Una fila por dispositivo: último uplink, última posición GPS, su geometría y su
+  lon/lat (decodificados al actualizar, una vez por dispositivo).
+- Se guarda en Parquet (data/cache/ultimo_estado.parquet).
+- Se actualiza desde una marca de agua sobre DeviceLocations."Time"
+  (máximo "Time" ya guardado, acotado a ahora, menos un solape para uplinks tardíos).
+  Un "Time" en el futuro no adelanta la marca más allá de ahora.
+- Lo que llega con más retraso que el solape (cargas atrasadas) no entra por la
+  marca: cada RECONCILIAR_HORAS se recorre el histórico completo y se rehace.
+- Las consultas lo reciben como arrays (UNNEST) y hacen JOIN en el servidor,
+  sin volver a recorrer el histórico. Las troceadas solo envían los dispositivos
+  de su base (restringir_a_dispositivos), no el estado de toda la flota. Con
+  coordenadas (con_coordenadas_en_servidor) se envían lon/lat en lugar del WKB.
+- Con consultas concurrentes (main_consulta) la actualización va bajo un lock del
+  módulo y los parámetros se reutilizan VIGENCIA_S segundos: el orquestador
+  actualiza una vez antes de lanzar el pool y las consultas no repiten el delta.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import text
+
+from src.almacen.escritura import escribir_atomico, escribir_json_atomico
+from src.features.geometria import coords_desde_wkb
+
+RUTA_ULTIMO_ESTADO = os.path.join("data", "cache", "ultimo_estado.parquet")
+
+# Margen de re-lectura sobre la marca de agua (uplinks que llegan con retraso)
+SOLAPE_HORAS = int(os.getenv("ULTIMO_ESTADO_SOLAPE_HORAS", "6"))
+
+# Horas entre reconciliaciones completas (recorrido de todo el histórico; 0 = nunca)
+RECONCILIAR_HORAS = int(os.getenv("ULTIMO_ESTADO_RECONCILIAR_HORAS", "24"))
+
+# Segundos durante los que se reutilizan los parámetros ya calculados (0 = siempre actualizar)
+VIGENCIA_S = int(os.getenv("ULTIMO_ESTADO_VIGENCIA_S", "300"))
+
+_lock = threading.RLock()
+_vigentes: Dict[str, Tuple[float, dict]] = {}  # ruta → (time.monotonic() de la actualización, parámetros)
+
+COLUMNAS = [
+    "device_id",
+    "ultimo_mensaje_recibido",
+    "ultima_posicion_gps_valida",
+    "ultima_posicion_geom",
+    "ultima_posicion_lon",
+    "ultima_posicion_lat",
+]
+
+# =========================
+#  SQL: delta desde la marca de agua
+# =========================
+SQL_DELTA = text("""
+WITH nuevos AS (
+  SELECT dl."DeviceId", dl."Time", dl."HasLocation", dl."Location"
+  FROM "DeviceLocations" dl
+  WHERE dl."Time" > CAST(:desde AS timestamptz)
+),
+ultimo AS (
+  SELECT "DeviceId", MAX("Time") AS ultimo_mensaje_recibido
+  FROM nuevos
+  GROUP BY "DeviceId"
+),
+ultima_gps AS (
+  SELECT DISTINCT ON ("DeviceId")
+    "DeviceId",
+    "Time"     AS ultima_posicion_gps_valida,
+    "Location" AS ultima_posicion_geom
+  FROM nuevos
+  WHERE "HasLocation" = TRUE
+  ORDER BY "DeviceId", "Time" DESC
+)
+SELECT
+  u."DeviceId" AS device_id,
+  u.ultimo_mensaje_recibido,
+  g.ultima_posicion_gps_valida,
+  g.ultima_posicion_geom
+FROM ultimo u
+LEFT JOIN ultima_gps g ON g."DeviceId" = u."DeviceId";
+""")
+
+# =========================
+#  CTE que reemplaza a gps_stats_full en las consultas
+#  (mismos nombres de columna que el original)
+# =========================
+SQL_GPS_STATS_FULL = """gps_stats_full AS (
+  SELECT *
+  FROM UNNEST(
+    CAST(:ue_device_id AS uuid[]),
+    CAST(:ue_ultimo_mensaje AS timestamptz[]),
+    CAST(:ue_ultima_gps AS timestamptz[]),
+    CAST(:ue_ultima_geom AS text[])
+  ) AS ue("DeviceId", ultimo_mensaje_recibido, ultima_posicion_gps_valida, ultima_posicion_geom)
+)"""
+
+# Misma CTE con lon/lat de la caché en lugar del WKB (el WKB no se envía)
+SQL_GPS_STATS_FULL_XY = """gps_stats_full AS (
+  SELECT *
+  FROM UNNEST(
+    CAST(:ue_device_id AS uuid[]),
+    CAST(:ue_ultimo_mensaje AS timestamptz[]),
+    CAST(:ue_ultima_gps AS timestamptz[]),
+    CAST(:ue_ultima_lon AS float8[]),
+    CAST(:ue_ultima_lat AS float8[])
+  ) AS ue("DeviceId", ultimo_mensaje_recibido, ultima_posicion_gps_valida, ultima_posicion_lon, ultima_posicion_lat)
+)"""
+
+# =========================
+#  Posición en el SELECT final: WKB hex (por defecto) o lon/lat ya
+#  decodificados en la caché (ni WKB en los parámetros ni ST_X/ST_Y en el servidor)
+# =========================
+SQL_POSICION_WKB = "gf.ultima_posicion_geom,"
+SQL_POSICION_XY = """gf.ultima_posicion_lon,
+  gf.ultima_posicion_lat,"""
+
+
+def con_coordenadas_en_servidor(sql):
+    """Variante de `sql` (str o text()) que devuelve ultima_posicion_lon/lat en vez del WKB."""
+    es_text = hasattr(sql, "text")
+    crudo = sql.text if es_text else sql
+    if SQL_POSICION_WKB not in crudo or SQL_GPS_STATS_FULL not in crudo:
+        raise ValueError("La consulta no selecciona gf.ultima_posicion_geom desde SQL_GPS_STATS_FULL")
+    crudo = crudo.replace(SQL_GPS_STATS_FULL, SQL_GPS_STATS_FULL_XY).replace(SQL_POSICION_WKB, SQL_POSICION_XY)
+    return text(crudo) if es_text else crudo
+
+
+def _normalizar(df: pd.DataFrame) -> pd.DataFrame:
+    """Tipos estables: device_id texto, fechas UTC tz-aware, geometría en hex y su lon/lat."""
+    df = df.reindex(columns=COLUMNAS).copy()
+    df["device_id"] = df["device_id"].astype(str)
+    for col in ["ultimo_mensaje_recibido", "ultima_posicion_gps_valida"]:
+        df[col] = pd.to_datetime(df[col], errors="coerce", utc=True)
+    df["ultima_posicion_geom"] = df["ultima_posicion_geom"].astype("string")
+    # Siempre desde la geometría (cachés anteriores sin lon/lat incluidas)
+    df["ultima_posicion_lon"], df["ultima_posicion_lat"] = coords_desde_wkb(df["ultima_posicion_geom"])
+    return df
+
+
+def cargar_ultimo_estado(ruta: str = RUTA_ULTIMO_ESTADO) -> pd.DataFrame:
+    """Lee el estado guardado (vacío si todavía no existe)."""
+    if not os.path.exists(ruta):
+        return _normalizar(pd.DataFrame(columns=COLUMNAS))
+    return _normalizar(pd.read_parquet(ruta))
+
+
+def _fusionar(previo: pd.DataFrame, delta: pd.DataFrame) -> pd.DataFrame:
+    """
+    Combina estado previo + delta quedándose, por dispositivo, con:
+    - el último mensaje más reciente
+    - la última posición GPS más reciente (y SU geometría)
+    """
+    todo = pd.concat([previo, delta], ignore_index=True)
+    if todo.empty:
+        return _normalizar(todo)
+
+    ultimo = todo.groupby("device_id", as_index=False)["ultimo_mensaje_recibido"].max()
+
+    gps = (
+        todo.dropna(subset=["ultima_posicion_gps_valida"])
+        .sort_values("ultima_posicion_gps_valida")
+        .drop_duplicates("device_id", keep="last")
+        [["device_id", "ultima_posicion_gps_valida", "ultima_posicion_geom", "ultima_posicion_lon", "ultima_posicion_lat"]]
+    )
+
+    return _normalizar(ultimo.merge(gps, on="device_id", how="left"))
+
+
+def _guardar(df: pd.DataFrame, ruta: str) -> None:
+    """Escritura atómica para no dejar el fichero a medias."""
+    escribir_atomico(ruta, lambda tmp: df.to_parquet(tmp, index=False))
+
+
+def _ruta_meta(ruta: str) -> str:
+    """Fichero junto al Parquet con la fecha de la última reconciliación completa."""
+    return f"{os.path.splitext(ruta)[0]}_meta.json"
+
+
+def _ultima_reconciliacion(ruta: str) -> Optional[pd.Timestamp]:
+    try:
+        with open(_ruta_meta(ruta), "r", encoding="utf-8") as f:
+            return pd.Timestamp(json.load(f)["reconciliado"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _guardar_reconciliacion(ruta: str, momento: pd.Timestamp) -> None:
+    escribir_json_atomico(_ruta_meta(ruta), {"reconciliado": momento.isoformat()})
+
+
+def marca_de_agua(previo: pd.DataFrame, ahora: pd.Timestamp, solape_horas: int = SOLAPE_HORAS) -> Optional[pd.Timestamp]:
+    """
+    Desde dónde pedir el delta: último mensaje guardado, acotado a `ahora` (un "Time"
+    futuro no puede dejar la marca por delante), menos el solape. None → histórico completo.
+    """
+    marca = previo["ultimo_mensaje_recibido"].max() if not previo.empty else pd.NaT
+    if pd.isna(marca):
+        return None
+    return min(marca, ahora) - timedelta(hours=solape_horas)
+
+
+def toca_reconciliar(ruta: str, ahora: pd.Timestamp, horas: int = RECONCILIAR_HORAS) -> bool:
+    """True si nunca se reconcilió o la última reconciliación completa tiene más de `horas`."""
+    if horas <= 0:
+        return False
+    ultima = _ultima_reconciliacion(ruta)
+    return ultima is None or ahora - ultima >= timedelta(hours=horas)
+
+
+def actualizar_ultimo_estado(engine, ruta: str = RUTA_ULTIMO_ESTADO) -> pd.DataFrame:
+    """
+    Trae de la réplica solo los uplinks posteriores a la marca de agua y
+    actualiza el estado local. La primera vez, y cada RECONCILIAR_HORAS,
+    recorre el histórico completo y rehace el estado.
+    Un solo hilo a la vez (el resto espera y parte de lo ya guardado).
+    """
+    with _lock:
+        return _actualizar(engine, ruta)
+
+
+def _actualizar(engine, ruta: str) -> pd.DataFrame:
+    previo = cargar_ultimo_estado(ruta)
+    ahora = pd.Timestamp.now(tz="UTC")
+
+    marca = marca_de_agua(previo, ahora)
+    completo = marca is None or toca_reconciliar(ruta, ahora)
+    desde = "-infinity" if completo else marca.isoformat()
+
+    with engine.connect() as con:
+        delta = pd.read_sql_query(SQL_DELTA, con, params={"desde": desde})
+
+    # Reconciliación: el recorrido completo sustituye al estado previo
+    estado = _fusionar(previo.iloc[0:0] if completo else previo, _normalizar(delta))
+    _guardar(estado, ruta)
+    if completo:
+        _guardar_reconciliacion(ruta, ahora)
+    print(
+        f"🗂️ Último estado {'reconciliado (histórico completo)' if completo else f'actualizado desde {desde}'} | "
+        f"Dispositivos con cambios: {len(delta)} | Total: {len(estado)}"
+    )
+    return estado
+
+
+def parametros_sql(estado: pd.DataFrame) -> dict:
+    """Convierte el estado en los arrays que esperan SQL_GPS_STATS_FULL y SQL_GPS_STATS_FULL_XY."""
+    def _fechas(serie):
+        return [None if pd.isna(v) else v.to_pydatetime() for v in serie]
+
+    def _numeros(serie):
+        return [None if pd.isna(v) else float(v) for v in serie]
+
+    return {
+        "ue_device_id": estado["device_id"].tolist(),
+        "ue_ultimo_mensaje": _fechas(estado["ultimo_mensaje_recibido"]),
+        "ue_ultima_gps": _fechas(estado["ultima_posicion_gps_valida"]),
+        "ue_ultima_geom": [None if pd.isna(v) else str(v) for v in estado["ultima_posicion_geom"]],
+        "ue_ultima_lon": _numeros(estado["ultima_posicion_lon"]),
+        "ue_ultima_lat": _numeros(estado["ultima_posicion_lat"]),
+    }
+
+
+def restringir_a_dispositivos(params: dict, device_ids: Iterable) -> dict:
+    """
+    Mismos parámetros con los arrays ue_* reducidos a `device_ids` (p. ej. la base de
+    sesión de una consulta troceada): cada chunk no reenvía el estado de toda la flota.
+    """
+    ids = {str(d) for d in device_ids}
+    filas = [i for i, d in enumerate(params["ue_device_id"]) if d in ids]
+    return {
+        **params,
+        **{k: [v[i] for i in filas] for k, v in params.items() if k.startswith("ue_")},
+    }
+
+
+def parametros_gps_stats_full(engine, ruta: str = RUTA_ULTIMO_ESTADO, vigencia_s: float = VIGENCIA_S) -> dict:
+    """
+    Actualiza el estado y devuelve los parámetros listos para la consulta.
+    Si otra llamada lo actualizó hace menos de `vigencia_s` segundos, devuelve
+    esos mismos parámetros sin ir a la base de datos.
+    """
+    with _lock:
+        vigente = _vigentes.get(ruta)
+        if vigente is not None and time.monotonic() - vigente[0] <= vigencia_s:
+            return vigente[1]
+        params = parametros_sql(_actualizar(engine, ruta))
+        _vigentes[ruta] = (time.monotonic(), params)
+        return params
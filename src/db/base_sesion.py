@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Conjunto base de dispositivos y rollups de gateways, calculados UNA vez por ejecución
+
+- En las consultas troceadas por día, cada chunk re-evaluaba active_devices,
+  current_animals y base (Devices × Animals) más los CTEs de gateways, aunque
+  no cambian durante la ejecución.
+- La réplica es de solo lectura (hot standby): no se pueden crear tablas
+  temporales, así que el conjunto se descarga una vez y se vuelve a enviar en
+  cada chunk como arrays (UNNEST), igual que gps_stats_full (ver cache.ultimo_estado).
+- Cada chunk solo lee DeviceLocations de su ventana + Devices por clave primaria.
+
+Uso:
+    params_fijos = {**params_ue, **parametros_base_sesion(engine, SQL_BASE_Y_GATEWAYS, params_ue)}
+    ... SQL por día construido sobre SQL_BASE_Y_GATEWAYS_SESION ...
+"""
+
+from typing import Optional
+
+import pandas as pd
+from sqlalchemy import text
+
+from src.cache.ultimo_estado import SQL_GPS_STATS_FULL
+from src.db.registro_engines import fijar_zona_horaria
+
+# =========================
+#  CTEs que sustituyen a base / gw_derived / gw_latest en el SQL por día
+#  (mismos nombres de columna que los originales)
+# =========================
+SQL_BASE_SESION = """
+WITH base AS (
+  SELECT d.*, bs.animal_name
+  FROM UNNEST(
+    CAST(:base_device_id AS uuid[]),
+    CAST(:base_animal_name AS text[])
+  ) AS bs("Id", animal_name)
+  JOIN "Devices" d ON d."Id" = bs."Id"
+)"""
+
+SQL_GATEWAYS_SESION = """gw_derived AS (
+  SELECT *
+  FROM UNNEST(
+    CAST(:gw_ranch_id AS uuid[]),
+    CAST(:gw_total AS int[]),
+    CAST(:gw_online AS int[]),
+    CAST(:gw_all_online AS boolean[]),
+    CAST(:gw_status AS text[])
+  ) AS g(ranch_id, total_gateways, gateways_online, all_gateways_online, ranch_gateway_overall_status)
+),
+gw_latest AS (
+  SELECT g.*, 1 AS rn
+  FROM UNNEST(
+    CAST(:gwl_ranch_id AS uuid[]),
+    CAST(:gwl_gateway_id AS uuid[]),
+    CAST(:gwl_name AS text[]),
+    CAST(:gwl_serial AS int[]),
+    CAST(:gwl_last_seen AS timestamptz[]),
+    CAST(:gwl_location AS text[])
+  ) AS g(ranch_id, gateway_id, gateway_name, gateway_serial, gateway_last_seen, gateway_location)
+)"""
+
+SQL_BASE_Y_GATEWAYS_SESION = f"""{SQL_BASE_SESION},
+{SQL_GATEWAYS_SESION},
+{SQL_GPS_STATS_FULL}
+"""
+
+# Lecturas (una vez) sobre el SQL_BASE_Y_GATEWAYS original de cada consulta
+_SELECT_BASE = """
+SELECT b."Id" AS device_id, b.animal_name
+FROM base b;
+"""
+
+_SELECT_GW = """
+SELECT ranch_id, total_gateways, gateways_online, all_gateways_online, ranch_gateway_overall_status
+FROM gw_derived;
+"""
+
+_SELECT_GW_LATEST = """
+SELECT ranch_id, gateway_id, gateway_name, gateway_serial, gateway_last_seen, gateway_location
+FROM gw_latest
+WHERE rn = 1;
+"""
+
+
+def _a_lista(serie: pd.Series, entero: bool = False) -> list:
+    """Valores nativos de Python para psycopg2 (NaN/NaT → None)."""
+    valores = []
+    for v in serie.tolist():  # tolist() ya devuelve escalares de Python
+        if v is None or (not isinstance(v, str) and pd.isna(v)):
+            valores.append(None)
+        elif isinstance(v, pd.Timestamp):
+            valores.append(v.to_pydatetime())
+        elif entero:
+            valores.append(int(v))
+        else:
+            valores.append(v)
+    return valores
+
+
+def parametros_base_sesion(
+    engine,
+    sql_base_y_gateways: str,
+    params: Optional[dict] = None,
+    set_timezone: Optional[str] = None,
+) -> dict:
+    """
+    Ejecuta una vez los CTEs base + gateways de la consulta y devuelve los
+    parámetros (arrays) que consume SQL_BASE_Y_GATEWAYS_SESION.
+    `params` son los que necesite sql_base_y_gateways (p. ej. ranch_name, ue_*).
+    """
+    params = params or {}
+    with engine.connect() as con:
+        fijar_zona_horaria(con, set_timezone)
+        base = pd.read_sql_query(text(sql_base_y_gateways + _SELECT_BASE), con, params=params)
+        gw = pd.read_sql_query(text(sql_base_y_gateways + _SELECT_GW), con, params=params)
+        gwl = pd.read_sql_query(text(sql_base_y_gateways + _SELECT_GW_LATEST), con, params=params)
+
+    print(f"🗂️ Base de sesión: {len(base)} dispositivos | {len(gw)} ranchos con gateways")
+
+    return {
+        "base_device_id": _a_lista(base["device_id"]),
+        "base_animal_name": _a_lista(base["animal_name"]),
+        "gw_ranch_id": _a_lista(gw["ranch_id"]),
+        "gw_total": _a_lista(gw["total_gateways"], entero=True),
+        "gw_online": _a_lista(gw["gateways_online"], entero=True),
+        "gw_all_online": _a_lista(gw["all_gateways_online"]),
+        "gw_status": _a_lista(gw["ranch_gateway_overall_status"]),
+        "gwl_ranch_id": _a_lista(gwl["ranch_id"]),
+        "gwl_gateway_id": _a_lista(gwl["gateway_id"]),
+        "gwl_name": _a_lista(gwl["gateway_name"]),
+        "gwl_serial": _a_lista(gwl["gateway_serial"], entero=True),
+        "gwl_last_seen": _a_lista(gwl["gateway_last_seen"]),
+        "gwl_location": _a_lista(gwl["gateway_location"]),
+    }
@@ -0,0 +1,688 @@
+# -*- coding: utf-8 -*-
+"""
+Ejecutor de consultas troceadas por ventanas de tiempo (chunks)
+
+- Reparte las ventanas (normalmente días naturales) entre N conexiones del pool.
+- Concurrencia acotada: N <= pool_size del engine por llamada y, entre TODAS las
+  llamadas concurrentes sobre un engine (varias consultas a la vez en
+  main_consulta), como mucho conexiones_chunks(engine) = pool_size + max_overflow
+  menos los hilos de consulta en curso (consulta_en_curso): los dos niveles juntos
+  no agotan el pool (QueuePool TimeoutError). Sin orquestador, todo el pool.
+- Cada conexión fija su sesión una vez (TZ, lock_timeout, statement_timeout) y
+  procesa ventanas de una en una, con commit corto tras cada lectura.
+- Reintentos ante 'conflict with recovery' con backoff exponencial + jitter; si
+  el conflicto persiste el error se propaga (nunca se devuelve un día vacío en
+  silencio). Las ventanas que leer_adaptativo no consigue leer ni en trozos de
+  una hora se devuelven al llamante (exigir_completo: fallar o marcar el resultado).
+- Los resultados se devuelven en el MISMO orden que las ventanas.
+- Modo streaming (leer_en_lotes): cursor de servidor y lotes de tamaño fijo,
+  para exportaciones grandes donde no cabe todo en memoria.
+- Backend de lectura seleccionable ("pandas", "copy" o "preparado", ver extraccion_copy);
+  con "preparado" se informa al final de la planificación ahorrada.
+- Troceo adaptativo (leer_adaptativo): para lecturas divisibles por tiempo, la
+  ventana se parte en mitades (hasta 1 hora) si un trozo agota los reintentos o
+  salta el statement_timeout; el tamaño de trozo se aprende por consulta a partir
+  de las latencias observadas (data/cache/tamano_chunks.json).
+- Varias réplicas (src/db/replicas.py): si el engine es del registro, los chunks
+  se reparten entre las réplicas sanas (max_workers por réplica) y una ventana que
+  falla por conexión o recovery conflict persistente pasa a otra réplica.
+- Cancelación (parámetro `cancelada` o fijar_cancelacion() en el hilo de la
+  consulta): se comprueba entre chunks, trozos y reintentos; si está activa se
+  lanza ConsultaCancelada y no se envían más sentencias.
+"""
+
+import atexit
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy.exc import InternalError, OperationalError
+
+from src.almacen.escritura import escribir_json_atomico
+from src.db.lectura_tipada import Esquema, concatenar, leer_tipado
+from src.db.planes import capturar_si_activo
+from src.db.registro_engines import fijar_zona_horaria
+from src.db.replicas import engines_equivalentes, es_error_conexion, esta_disponible, marcar_caida, replica_de
+from src.db.sentencias_preparadas import estadisticas_preparadas, resumen_preparadas
+
+MAX_WORKERS = int(os.getenv("PG_CHUNK_WORKERS", "4"))
+TAMANO_LOTE = int(os.getenv("PG_TAMANO_LOTE", "50000"))
+
+Ventana = Tuple[datetime, datetime]
+
+# Troceo adaptativo
+RUTA_TAMANOS_CHUNK = os.path.join("data", "cache", "tamano_chunks.json")
+CHUNK_MINIMO = timedelta(hours=1)
+CHUNK_MAXIMO = timedelta(days=1)
+# Latencia buscada por trozo, como fracción del statement_timeout
+FRACCION_OBJETIVO = float(os.getenv("PG_CHUNK_FRACCION_OBJETIVO", "0.25"))
+# A partir de esta fracción del statement_timeout un trozo se considera al límite
+FRACCION_LIMITE = 0.8
+
+# Por hilo:
+# - propagar_conflictos: True si queda otra réplica a la que pasar la ventana en curso
+#   (leer_con_reintentos propaga el conflicto en vez de omitir el chunk)
+# - cancelada: threading.Event de la consulta en curso (ver fijar_cancelacion)
+_contexto = threading.local()
+
+
+class ConsultaCancelada(Exception):
+    """La consulta se canceló (p. ej. timeout del orquestador) entre dos chunks."""
+
+
+class VentanasOmitidas(Exception):
+    """Una lectura troceada terminó con ventanas sin leer: el resultado estaría incompleto."""
+
+    def __init__(self, consulta: str, ventanas: List["Ventana"]):
+        self.consulta = consulta
+        self.ventanas = list(ventanas)
+        super().__init__(f"{consulta}: {len(self.ventanas)} ventanas sin leer ({describir_ventanas(self.ventanas)})")
+
+
+def describir_ventanas(ventanas: List["Ventana"]) -> str:
+    return ", ".join(f"{ini:%Y-%m-%d %H:%M}→{fin:%H:%M}" for ini, fin in ventanas)
+
+
+def exigir_completo(consulta: str, omitidas: List["Ventana"], permitir_incompleto: bool = False) -> None:
+    """
+    Sin ventanas omitidas no hace nada. Con ellas, lanza VentanasOmitidas o, con
+    permitir_incompleto=True, solo avisa (el llamante marca el resultado).
+    """
+    if not omitidas:
+        return
+    if not permitir_incompleto:
+        raise VentanasOmitidas(consulta, omitidas)
+    print(f"⚠️ {consulta}: resultado INCOMPLETO, {len(omitidas)} ventanas sin leer: {describir_ventanas(omitidas)}")
+
+
+def fijar_cancelacion(cancelada: Optional[threading.Event]) -> None:
+    """Event de cancelación de la consulta que corre en este hilo (None para quitarlo)."""
+    _contexto.cancelada = cancelada
+
+
+def _evento_cancelacion(cancelada: Optional[threading.Event] = None) -> Optional[threading.Event]:
+    return cancelada if cancelada is not None else getattr(_contexto, "cancelada", None)
+
+
+def comprobar_cancelacion(cancelada: Optional[threading.Event] = None, etiqueta: str = "") -> None:
+    """Lanza ConsultaCancelada si `cancelada` (o la del hilo) está activa."""
+    evento = _evento_cancelacion(cancelada)
+    if evento is not None and evento.is_set():
+        raise ConsultaCancelada(f"Consulta cancelada antes de leer {etiqueta}".strip())
+
+
+# ============================================================
+#  Ventanas y sesión
+# ============================================================
+def ventanas_diarias(start: datetime, ndays: int) -> List[Ventana]:
+    """[(00:00 día i, 00:00 día i+1), ...] para N días naturales desde `start`."""
+    inicio = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    return [
+        (inicio + timedelta(days=i), inicio + timedelta(days=i + 1))
+        for i in range(ndays)
+    ]
+
+
+def preparar_sesion(
+    con,
+    set_timezone: Optional[str] = "Europe/Madrid",
+    lock_timeout: str = "5s",
+    statement_timeout: str = "10min",
+) -> None:
+    """SET de sesión (no SET LOCAL) y commit corto para no mantener tx abierta."""
+    fijar_zona_horaria(con, set_timezone)
+    con.exec_driver_sql(f"SET lock_timeout = '{lock_timeout}';")
+    con.exec_driver_sql(f"SET statement_timeout = '{statement_timeout}';")
+    try:
+        con.commit()
+    except Exception:
+        pass
+
+
+def es_conflicto_recovery(error: Exception) -> bool:
+    msg = str(error).lower()
+    return (
+        "conflict with recovery" in msg
+        or "serializationfailure" in msg
+        or "canceling statement due to conflict with recovery" in msg
+        or "current transaction is aborted" in msg
+    )
+
+
+def es_timeout(error: Exception) -> bool:
+    return "canceling statement due to statement timeout" in str(error).lower()
+
+
+def _segundos(valor: str) -> float:
+    """'500ms', '30s', '10min', '1h' → segundos (sin unidad = ms, como en Postgres)."""
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(ms|s|min|h|d)?\s*", str(valor))
+    if not m:
+        raise ValueError(f"statement_timeout no reconocido: {valor!r}")
+    factor = {"ms": 0.001, "s": 1, "min": 60, "h": 3600, "d": 86400}[m.group(2) or "ms"]
+    return float(m.group(1)) * factor
+
+
+def _rollback(con) -> None:
+    """Limpia 'current transaction is aborted' antes de reintentar."""
+    try:
+        con.rollback()
+    except Exception:
+        try:
+            con.exec_driver_sql("ROLLBACK")
+        except Exception:
+            pass
+
+
+# ============================================================
+#  Lectura de una ventana con reintentos
+# ============================================================
+def leer_con_reintentos(
+    con,
+    sql,
+    params: dict,
+    etiqueta: str = "",
+    max_retries: int = 4,
+    backend: Optional[str] = None,
+    esquema: Optional[Esquema] = None,
+    omitir: bool = False,
+    consulta: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Lanza `sql` con `params` (backend "pandas" o "copy"). Reintenta ante conflictos de recuperación.
+    - Con `esquema`, el resultado sale ya con dtypes compactos (ver lectura_tipada).
+    - Tras éxito: commit corto para soltar snapshot.
+    - Tras fallo: rollback para limpiar la transacción abortada.
+    - Si el conflicto persiste tras `max_retries`, propaga el último error (el
+      llamante trocea o falla); solo con omitir=True devuelve un DataFrame vacío.
+    - Cualquier otro error se propaga.
+    - Con `consulta` y el modo PG_EXPLAIN activo, se muestrea el plan del chunk (ver planes).
+    """
+    delay = 1.0
+    for attempt in range(1, max_retries + 1):
+        comprobar_cancelacion(etiqueta=etiqueta)
+        try:
+            with capturar_si_activo(con, consulta, etiqueta, chunk=True):
+                df = leer_tipado(con, sql, params, esquema, backend)
+            try:
+                con.commit()
+            except Exception:
+                pass
+            return df
+
+        except (OperationalError, InternalError) as e:
+            _rollback(con)
+
+            if not es_conflicto_recovery(e):
+                raise
+
+            if attempt < max_retries:
+                jitter = random.uniform(0, 0.5)
+                print(f"🔁 Recovery conflict en {etiqueta} (intento {attempt}/{max_retries}). Reintentando en {delay + jitter:.1f}s...")
+                time.sleep(delay + jitter)
+                delay *= 2
+                continue
+
+            if not omitir or getattr(_contexto, "propagar_conflictos", False):
+                raise
+            print(f"⚠️ Chunk {etiqueta} omitido tras {max_retries} intentos por recovery conflict.")
+            return pd.DataFrame()
+
+
+# ============================================================
+#  Troceo adaptativo con tamaño aprendido por consulta
+# ============================================================
+_tamanos_lock = threading.Lock()
+_tamanos: Dict[str, Dict[str, float]] = {}  # ruta → {consulta: horas}
+_tamanos_pendientes: set = set()  # rutas con cambios sin guardar (guardar_tamanos)
+
+
+def _tamanos_en(ruta: str) -> Dict[str, float]:
+    """Tamaños aprendidos (en horas) guardados en `ruta`; se leen una vez por proceso."""
+    if ruta not in _tamanos:
+        datos = {}
+        if os.path.exists(ruta):
+            try:
+                with open(ruta, encoding="utf-8") as fh:
+                    datos = {k: float(v) for k, v in json.load(fh).items()}
+            except (OSError, ValueError):
+                print(f"⚠️ No se pudo leer {ruta}; se empieza con trozos de {CHUNK_MAXIMO}.")
+        _tamanos[ruta] = datos
+    return _tamanos[ruta]
+
+
+def guardar_tamanos() -> None:
+    """
+    Escribe los tamaños aprendidos que cambiaron (escritura atómica). Se llama al
+    terminar ejecutar_chunks y al salir del proceso, no después de cada trozo.
+    """
+    with _tamanos_lock:
+        for ruta in sorted(_tamanos_pendientes):
+            try:
+                escribir_json_atomico(ruta, dict(_tamanos[ruta]), indent=2, sort_keys=True)
+            except OSError as e:
+                print(f"⚠️ No se pudieron guardar los tamaños de trozo en {ruta}: {e}")
+        _tamanos_pendientes.clear()
+
+
+atexit.register(guardar_tamanos)
+
+
+def tamano_chunk(consulta: str, ruta: str = RUTA_TAMANOS_CHUNK) -> timedelta:
+    """Tamaño de trozo aprendido para `consulta` (horas enteras, entre CHUNK_MINIMO y CHUNK_MAXIMO)."""
+    with _tamanos_lock:
+        horas = _tamanos_en(ruta).get(consulta, CHUNK_MAXIMO / timedelta(hours=1))
+    return max(CHUNK_MINIMO, min(CHUNK_MAXIMO, timedelta(hours=int(horas))))
+
+
+def _ajustar_tamano(consulta: str, horas: float, ruta: str) -> None:
+    minimo, maximo = CHUNK_MINIMO / timedelta(hours=1), CHUNK_MAXIMO / timedelta(hours=1)
+    with _tamanos_lock:
+        tamanos = _tamanos_en(ruta)
+        nuevo = round(max(minimo, min(maximo, horas)), 2)
+        if tamanos.get(consulta) != nuevo:
+            tamanos[consulta] = nuevo
+            _tamanos_pendientes.add(ruta)
+
+
+def registrar_latencia(
+    consulta: str,
+    ventana: timedelta,
+    segundos: float,
+    statement_timeout: str = "10min",
+    ruta: str = RUTA_TAMANOS_CHUNK,
+) -> None:
+    """
+    Ajusta el tamaño aprendido con la latencia de un trozo leído con éxito.
+    - Ideal: horas de ventana que caben en FRACCION_OBJETIVO del statement_timeout
+      al ritmo observado; se suaviza con el valor anterior.
+    - Crece como mucho al doble del trozo leído (tras partir por fallos no vuelve de golpe al día).
+    - Si el trozo quedó al límite (≥ FRACCION_LIMITE del timeout), al menos se reduce a la mitad.
+    """
+    horas_ventana = ventana / timedelta(hours=1)
+    if segundos <= 0 or horas_ventana <= 0:
+        return
+    timeout = _segundos(statement_timeout)
+    ideal = FRACCION_OBJETIVO * timeout / (segundos / horas_ventana)
+    previo = tamano_chunk(consulta, ruta) / timedelta(hours=1)
+    nuevo = min(0.5 * previo + 0.5 * ideal, max(previo, 2 * horas_ventana))
+    if segundos >= FRACCION_LIMITE * timeout:
+        nuevo = min(nuevo, horas_ventana / 2)
+        print(f"⚠️ {consulta}: trozo de {ventana} al límite del statement_timeout ({segundos:.0f}s)")
+    _ajustar_tamano(consulta, nuevo, ruta)
+
+
+def registrar_fallo(consulta: str, ventana: timedelta, ruta: str = RUTA_TAMANOS_CHUNK) -> None:
+    """Un trozo que no se pudo leer deja el tamaño aprendido en, como mucho, su mitad."""
+    previo = tamano_chunk(consulta, ruta) / timedelta(hours=1)
+    _ajustar_tamano(consulta, min(previo, ventana / timedelta(hours=1) / 2), ruta)
+
+
+def _partir(inicio: datetime, fin: datetime) -> Tuple[Ventana, Ventana]:
+    """Dos mitades cortadas en hora entera (la primera de al menos CHUNK_MINIMO)."""
+    horas = max(1, int((fin - inicio) / CHUNK_MINIMO) // 2)
+    mitad = inicio + horas * CHUNK_MINIMO
+    return (inicio, mitad), (mitad, fin)
+
+
+def leer_adaptativo(
+    con,
+    sql,
+    params_fn: Callable[[datetime, datetime], dict],
+    inicio: datetime,
+    fin: datetime,
+    consulta: str,
+    combinar: Optional[Callable[[List[pd.DataFrame]], pd.DataFrame]] = None,
+    max_retries: int = 2,
+    backend: Optional[str] = None,
+    esquema: Optional[Esquema] = None,
+    statement_timeout: str = "10min",
+    ruta: str = RUTA_TAMANOS_CHUNK,
+    cancelada: Optional[threading.Event] = None,
+) -> Tuple[pd.DataFrame, List[Ventana]]:
+    """
+    Lee [inicio, fin) en trozos del tamaño aprendido para `consulta`.
+    - Solo para SQL divisible por tiempo: filas por mensaje (se concatenan) o
+      contadores sumables (`combinar`, p. ej. groupby + sum).
+    - Un trozo que agota `max_retries` por recovery conflict o cancela por
+      statement_timeout se parte en dos y se reintentan las mitades.
+    - En CHUNK_MINIMO se insiste con 4 reintentos; si aun así falla, se omite.
+    - Cada trozo leído actualiza el tamaño aprendido (registrar_latencia).
+    - Antes de cada trozo se comprueba `cancelada` (por defecto, la del hilo).
+    Devuelve (resultado combinado en orden de tiempo, ventanas omitidas).
+    """
+    paso = tamano_chunk(consulta, ruta)
+    trozos: List[Ventana] = []
+    t = inicio
+    while t < fin:
+        trozos.append((t, min(t + paso, fin)))
+        t += paso
+
+    frames: List[pd.DataFrame] = []
+    omitidas: List[Ventana] = []
+    pila = list(reversed(trozos))  # recorrido en orden, las mitades se apilan delante
+    while pila:
+        ini, fin_trozo = pila.pop()
+        duracion = fin_trozo - ini
+        minimo = duracion <= CHUNK_MINIMO
+        etiqueta = f"{ini:%Y-%m-%d %H:%M} (+{duracion / timedelta(hours=1):g}h)"
+        comprobar_cancelacion(cancelada, etiqueta)
+        t0 = time.perf_counter()
+        try:
+            df = leer_con_reintentos(
+                con,
+                sql,
+                params_fn(ini, fin_trozo),
+                etiqueta,
+                max_retries=4 if minimo else max_retries,
+                backend=backend,
+                esquema=esquema,
+                omitir=False,
+                consulta=consulta,
+            )
+        except (OperationalError, InternalError) as e:
+            if not (es_conflicto_recovery(e) or es_timeout(e)):
+                raise
+            registrar_fallo(consulta, duracion, ruta)
+            if minimo and getattr(_contexto, "propagar_conflictos", False):
+                raise  # ejecutar_chunks pasa la ventana entera a otra réplica
+            if minimo:
+                print(f"⚠️ Chunk {etiqueta} omitido: sigue fallando con el tamaño mínimo ({CHUNK_MINIMO}).")
+                omitidas.append((ini, fin_trozo))
+                continue
+            primera, segunda = _partir(ini, fin_trozo)
+            print(f"🔁 {consulta}: {etiqueta} se parte en dos desde {primera[1]:%H:%M}")
+            pila.extend([segunda, primera])
+            continue
+
+        registrar_latencia(consulta, duracion, time.perf_counter() - t0, statement_timeout, ruta)
+        frames.append(df)
+
+    frames = [df for df in frames if not df.empty]
+    if not frames:
+        return pd.DataFrame(), omitidas
+    if combinar is not None:
+        return combinar(frames), omitidas
+    return concatenar(frames, esquema), omitidas
+
+
+# ============================================================
+#  Ejecución concurrente sobre el pool
+# ============================================================
+_cupos_lock = threading.Lock()
+_cupos: Dict[object, "_Cupo"] = {}  # engine → conexiones de chunks en uso
+_consultas: Dict[object, int] = {}  # engine → hilos de consulta del orquestador en curso
+
+
+@contextmanager
+def consulta_en_curso(engine):
+    """
+    Marca un hilo de consulta del orquestador (main_consulta) que puede tener una
+    conexión de `engine` abierta: mientras dure, los chunks le dejan esa conexión.
+    """
+    with _cupos_lock:
+        _consultas[engine] = _consultas.get(engine, 0) + 1
+    try:
+        yield
+    finally:
+        with _cupos_lock:
+            _consultas[engine] -= 1
+            if not _consultas[engine]:
+                del _consultas[engine]
+
+
+def conexiones_chunks(engine) -> int:
+    """
+    Conexiones que los chunks de todas las consultas pueden tener abiertas a la vez
+    sobre `engine`: capacidad del pool (pool_size + max_overflow) menos una por cada
+    hilo de consulta en curso (consulta_en_curso). Sin orquestador, todo el pool.
+    """
+    try:
+        tamano = engine.pool.size()
+    except Exception:
+        return MAX_WORKERS
+    overflow = getattr(engine.pool, "_max_overflow", 0)
+    if overflow < 0:  # overflow ilimitado
+        return max(MAX_WORKERS, tamano)
+    with _cupos_lock:
+        en_curso = _consultas.get(engine, 0)
+    return max(1, tamano + overflow - en_curso)
+
+
+class _Cupo:
+    """Conexiones de chunks en uso sobre un engine; el límite se recalcula en cada acquire()."""
+
+    def __init__(self, engine):
+        self._engine = engine
+        self._en_uso = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            libre = self._cond.wait_for(lambda: self._en_uso < conexiones_chunks(self._engine), timeout)
+            if libre:
+                self._en_uso += 1
+            return libre
+
+    def release(self) -> None:
+        with self._cond:
+            self._en_uso -= 1
+            self._cond.notify_all()
+
+
+def _cupo(engine) -> _Cupo:
+    with _cupos_lock:
+        if engine not in _cupos:
+            _cupos[engine] = _Cupo(engine)
+        return _cupos[engine]
+
+
+def _n_workers(engine, max_workers: Optional[int], n_ventanas: int) -> int:
+    n = max_workers or MAX_WORKERS
+    try:
+        n = min(n, engine.pool.size())
+    except Exception:
+        pass
+    return max(1, min(n, n_ventanas))
+
+
+def ejecutar_chunks(
+    engine,
+    ventanas: List[Ventana],
+    leer_chunk: Callable[..., pd.DataFrame],
+    set_timezone: Optional[str] = "Europe/Madrid",
+    max_workers: Optional[int] = None,
+    lock_timeout: str = "5s",
+    statement_timeout: str = "10min",
+    cancelada: Optional[threading.Event] = None,
+) -> List[pd.DataFrame]:
+    """
+    Ejecuta `leer_chunk(con, inicio, fin)` para cada ventana usando N conexiones
+    (N por réplica si `engine` es del registro y hay varias réplicas sanas).
+    Devuelve la lista de resultados alineada con `ventanas`.
+    - Con varias réplicas, una ventana que falla por conexión o recovery conflict
+      persistente vuelve a la cola, su réplica sale de rotación y la leen las demás.
+    - Si un chunk falla con un error no recuperable, se paran los demás y se propaga.
+    - Cada hilo toma un cupo de conexiones_chunks(engine) antes de conectar (cupo
+      compartido con las demás consultas en curso); si espera y ya no quedan
+      ventanas, termina sin conectar.
+    - `cancelada` (por defecto, la fijada en este hilo con fijar_cancelacion) se
+      comprueba antes de cada ventana y pasa a los hilos de chunks (leer_adaptativo
+      y los reintentos la ven): activada, no se lanzan más ventanas y se propaga
+      ConsultaCancelada.
+    """
+    if not ventanas:
+        return []
+    cancelada = _evento_cancelacion(cancelada)
+
+    engines = engines_equivalentes(engine)
+    varias = len(engines) > 1
+    asignacion = []  # engine de cada hilo, intercalando réplicas
+    cupos = [_n_workers(e, max_workers, len(ventanas)) for e in engines]
+    for ronda in range(max(cupos)):
+        asignacion.extend(e for e, cupo in zip(engines, cupos) if ronda < cupo)
+    asignacion = asignacion[: len(ventanas)]
+
+    resultados: List[Optional[pd.DataFrame]] = [None] * len(ventanas)
+    intentos = [0] * len(ventanas)
+    errores: List[Exception] = []
+    pendientes: "queue.Queue[Tuple[int, Ventana]]" = queue.Queue()
+    for i, ventana in enumerate(ventanas):
+        pendientes.put((i, ventana))
+    parar = threading.Event()
+
+    def trabajador(eng):
+        cupo = _cupo(eng)
+        while not cupo.acquire(timeout=1.0):
+            if parar.is_set() or pendientes.empty():
+                return
+            comprobar_cancelacion(cancelada)
+        try:
+            leer_ventanas(eng)
+        finally:
+            cupo.release()
+
+    def leer_ventanas(eng):
+        replica = replica_de(eng)
+        fijar_cancelacion(cancelada)
+        try:
+            con = eng.connect()
+        except (OperationalError, InternalError) as e:
+            if not (varias and es_error_conexion(e)):
+                raise
+            marcar_caida(replica)
+            errores.append(e)
+            return
+
+        try:
+            with con:
+                preparar_sesion(con, set_timezone, lock_timeout, statement_timeout)
+                while not parar.is_set():
+                    if varias and not esta_disponible(replica):
+                        return
+                    try:
+                        i, (ini, fin) = pendientes.get_nowait()
+                    except queue.Empty:
+                        return
+                    comprobar_cancelacion(cancelada, str(ini.date()))
+                    intentos[i] += 1
+                    quedan_replicas = varias and intentos[i] < len(engines)
+                    _contexto.propagar_conflictos = quedan_replicas
+                    try:
+                        resultados[i] = leer_chunk(con, ini, fin)
+                    except (OperationalError, InternalError) as e:
+                        if not (quedan_replicas and (es_error_conexion(e) or es_conflicto_recovery(e))):
+                            raise
+                        errores.append(e)
+                        pendientes.put((i, (ini, fin)))
+                        print(f"🔁 Chunk {ini.date()} pasa a otra réplica (falló en {replica})")
+                        marcar_caida(replica)
+                        return
+        finally:
+            _contexto.propagar_conflictos = False
+            fijar_cancelacion(None)
+
+    preparadas_antes = estadisticas_preparadas()
+    t0 = time.perf_counter()
+    try:
+        while True:
+            with ThreadPoolExecutor(max_workers=len(asignacion), thread_name_prefix="chunk") as pool:
+                futuros = [pool.submit(trabajador, eng) for eng in asignacion]
+                for futuro in as_completed(futuros):
+                    try:
+                        futuro.result()
+                    except Exception:
+                        parar.set()
+                        raise
+            if pendientes.empty():
+                break
+            # Ventanas devueltas a la cola cuando los demás hilos ya habían terminado
+            asignacion = [e for e in asignacion if esta_disponible(replica_de(e))][: pendientes.qsize()]
+            if not asignacion:
+                raise RuntimeError(
+                    f"{pendientes.qsize()} chunks sin leer: no queda ninguna réplica disponible"
+                ) from (errores[-1] if errores else None)
+    finally:
+        guardar_tamanos()  # lo aprendido en estos chunks, en una sola escritura
+
+    replicas_txt = f" en {len(engines)} réplicas" if varias else ""
+    print(f"⏱️ {len(ventanas)} chunks en {time.perf_counter() - t0:.1f}s con {len(asignacion)} conexiones{replicas_txt}")
+    if estadisticas_preparadas()["ejecuciones"] > preparadas_antes["ejecuciones"]:
+        print(f"⏱️ {resumen_preparadas(preparadas_antes)}")
+    return [df if df is not None else pd.DataFrame() for df in resultados]
+
+
+# ============================================================
+#  Streaming con cursor de servidor
+# ============================================================
+def leer_en_lotes(con, sql, params: dict, tamano_lote: int = TAMANO_LOTE) -> Iterator[pd.DataFrame]:
+    """
+    Ejecuta `sql` con cursor de servidor (stream_results) y va devolviendo
+    DataFrames de como mucho `tamano_lote` filas. La memoria queda acotada
+    por el tamaño del lote, no por el total de filas.
+    """
+    result = con.execution_options(yield_per=tamano_lote).execute(sql, params)
+    columnas = list(result.keys())
+    try:
+        for filas in result.partitions(tamano_lote):
+            yield pd.DataFrame.from_records(filas, columns=columnas)
+    finally:
+        result.close()
+
+
+def iterar_ventanas_en_lotes(
+    engine,
+    ventanas: List[Ventana],
+    sql,
+    params_fn: Callable[[datetime, datetime], dict],
+    set_timezone: Optional[str] = "Europe/Madrid",
+    tamano_lote: int = TAMANO_LOTE,
+    max_retries: int = 4,
+    lock_timeout: str = "5s",
+    statement_timeout: str = "10min",
+) -> Iterator[Tuple[Ventana, pd.DataFrame]]:
+    """
+    Recorre las ventanas EN ORDEN sobre una sola conexión y produce (ventana, lote).
+    - Reintenta una ventana ante recovery conflict solo si aún no se había
+      emitido ningún lote de ella (si ya se emitió, se propaga el error para
+      no dejar un día a medias).
+    - Commit corto al terminar cada ventana para soltar el snapshot.
+    """
+    with engine.connect() as con:
+        preparar_sesion(con, set_timezone, lock_timeout, statement_timeout)
+
+        for ventana in ventanas:
+            ini, fin = ventana
+            comprobar_cancelacion(etiqueta=str(ini.date()))
+            delay = 1.0
+            for attempt in range(1, max_retries + 1):
+                emitidos = 0
+                try:
+                    for lote in leer_en_lotes(con, sql, params_fn(ini, fin), tamano_lote):
+                        emitidos += 1
+                        yield ventana, lote
+                    try:
+                        con.commit()
+                    except Exception:
+                        pass
+                    break
+
+                except (OperationalError, InternalError) as e:
+                    _rollback(con)
+                    if emitidos or not es_conflicto_recovery(e):
+                        raise
+                    if attempt < max_retries:
+                        jitter = random.uniform(0, 0.5)
+                        print(f"🔁 Recovery conflict en {ini.date()} (intento {attempt}/{max_retries}). Reintentando en {delay + jitter:.1f}s...")
+                        time.sleep(delay + jitter)
+                        delay *= 2
+                        continue
+                    print(f"⚠️ Chunk {ini.date()} omitido tras {max_retries} intentos por recovery conflict.")
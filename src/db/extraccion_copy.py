@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Extracción con COPY (...) TO STDOUT como alternativa a pd.read_sql_query
+
+- Se lanza el MISMO SQL de la consulta (sqlalchemy.text + parámetros): los
+  parámetros se incrustan con mogrify del driver, porque COPY no admite binds.
+- El servidor envía CSV en bloque; se vuelca a un buffer (memoria y, si crece,
+  disco temporal) y pyarrow lo parsea por columnas, sin crear objetos Python por fila.
+- Los NUMERIC llegan ya como float64 y los booleanos 't'/'f' como bool.
+- NULL viaja como \\N (marcador explícito): el texto vacío '' no se convierte en nulo.
+- Los timestamptz se devuelven en UTC (con zona), no en la TZ de sesión.
+- Los errores del driver se envuelven en las excepciones de SQLAlchemy para que
+  los reintentos por 'conflict with recovery' funcionen igual que con pandas.
+
+Backends disponibles (parámetro `backend` o variable PG_BACKEND_EXTRACCION):
+  "pandas" → pd.read_sql_query (comportamiento original)
+  "copy"   → leer_copy
+  "preparado" → sentencias_preparadas.leer_preparado (PREPARE una vez por conexión,
+               EXECUTE por ventana; pensado para las consultas troceadas por día)
+"""
+
+import os
+import tempfile
+from typing import Iterator, Sequence
+
+import pandas as pd
+import pyarrow.csv as pa_csv
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from src.db.sentencias_preparadas import leer_preparado, leer_preparado_en_lotes
+
+BACKEND_EXTRACCION = os.getenv("PG_BACKEND_EXTRACCION", "pandas")
+BACKENDS = ("pandas", "copy", "preparado")
+
+# A partir de este tamaño el buffer de COPY pasa de memoria a fichero temporal
+MAX_BUFFER_MEMORIA = int(os.getenv("PG_COPY_BUFFER_MB", "256")) * 1024 * 1024
+
+# NULL explícito en el COPY: solo ese marcador (sin comillas) es nulo; '' sigue
+# siendo texto vacío, igual que con pandas
+MARCADOR_NULL = "\\N"
+
+_OPCIONES_CSV = pa_csv.ConvertOptions(
+    true_values=["t"],
+    false_values=["f"],
+    null_values=[MARCADOR_NULL],
+    strings_can_be_null=True,
+    quoted_strings_can_be_null=False,
+)
+
+
+# ============================================================
+#  SQL con parámetros incrustados
+# ============================================================
+def renderizar_sql(con, sql, params: dict = None) -> str:
+    """Devuelve el SQL final (parámetros ya incrustados) sin ';' final."""
+    stmt = sql if hasattr(sql, "compile") else text(sql)
+    compilado = stmt.compile(dialect=con.dialect)
+    valores = compilado.construct_params(params or {})
+
+    raw = con.connection.driver_connection
+    with raw.cursor() as cur:
+        consulta = cur.mogrify(str(compilado), valores)
+    if isinstance(consulta, bytes):
+        consulta = consulta.decode("utf-8")
+    return consulta.strip().rstrip(";").strip()
+
+
+# ============================================================
+#  Lectura
+# ============================================================
+def leer_copy(con, sql, params: dict = None, categorias: Sequence[str] = ()) -> pd.DataFrame:
+    """
+    Ejecuta `sql` vía COPY TO STDOUT (CSV con cabecera) y lo parsea con pyarrow.
+    Usa la transacción de `con`, así el commit/rollback del llamador aplica igual.
+    `categorias`: columnas de texto que pasan de Arrow a category sin crear los str.
+    """
+    consulta = renderizar_sql(con, sql, params)
+    copy_sql = f"COPY ({consulta}) TO STDOUT WITH (FORMAT csv, HEADER true, NULL '{MARCADOR_NULL}')"
+
+    if not con.in_transaction():
+        con.begin()
+    raw = con.connection.driver_connection
+
+    with tempfile.SpooledTemporaryFile(max_size=MAX_BUFFER_MEMORIA) as buf:
+        try:
+            with raw.cursor() as cur:
+                cur.copy_expert(copy_sql, buf)
+        except con.dialect.loaded_dbapi.Error as e:
+            raise DBAPIError.instance(copy_sql, None, e, con.dialect.loaded_dbapi.Error)
+
+        if buf.tell() == 0:
+            return pd.DataFrame()
+        buf.seek(0)
+        tabla = pa_csv.read_csv(buf, convert_options=_OPCIONES_CSV)
+
+    return tabla.to_pandas(
+        categories=[c for c in categorias if c in tabla.column_names],
+        split_blocks=True,
+        self_destruct=True,  # libera cada columna Arrow al convertirla
+    )
+
+
+def leer_sql(con, sql, params: dict = None, backend: str = None) -> pd.DataFrame:
+    """Punto único de lectura: elige backend ("pandas" por defecto, "copy" o "preparado")."""
+    backend = backend or BACKEND_EXTRACCION
+    if backend == "copy":
+        return leer_copy(con, sql, params)
+    if backend == "pandas":
+        return pd.read_sql_query(sql, con, params=params)
+    if backend == "preparado":
+        return leer_preparado(con, sql, params)
+    raise ValueError(f"Backend de extracción desconocido: {backend!r} (opciones: {BACKENDS})")
+
+
+def leer_sql_en_lotes(
+    con,
+    sql,
+    params: dict = None,
+    backend: str = None,
+    tamano_lote: int = 100000,
+    categorias: Sequence[str] = (),
+) -> Iterator[pd.DataFrame]:
+    """
+    Igual que leer_sql, pero sin construir nunca el resultado entero como objetos Python:
+    - "pandas": cursor de servidor (stream_results) y DataFrames de `tamano_lote` filas;
+    - "preparado": fetchmany de `tamano_lote` filas;
+    - "copy": un solo DataFrame (pyarrow ya parsea por columnas), con `categorias`
+      convertidas desde Arrow.
+    Siempre devuelve al menos un DataFrame (vacío si no hay filas).
+    """
+    backend = backend or BACKEND_EXTRACCION
+    if backend == "copy":
+        yield leer_copy(con, sql, params, categorias)
+    elif backend == "pandas":
+        stmt = (sql if hasattr(sql, "execution_options") else text(sql)).execution_options(stream_results=True)
+        yield from pd.read_sql_query(stmt, con, params=params, chunksize=tamano_lote)
+    elif backend == "preparado":
+        yield from leer_preparado_en_lotes(con, sql, params, tamano_lote)
+    else:
+        raise ValueError(f"Backend de extracción desconocido: {backend!r} (opciones: {BACKENDS})")
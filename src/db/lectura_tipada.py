@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Lectura tipada: esquema declarado por consulta → dtypes compactos al leer
+
+- psycopg2 devuelve los ROUND(... ::numeric ...) como Decimal; si un chunk trae la
+  columna entera a NULL (o se lee por lotes sin coerce_float) queda como object y
+  el relleno `select_dtypes(include=["number"]).fillna(0)` la ignora.
+- Con un esquema {columna: dtype} cada chunk sale ya con:
+    porcentajes → float32, coordenadas/horas → float64, contadores → Int32/Int64
+    (enteros con NULL), banderas → boolean, textos repetidos → category.
+- Las columnas que no estén en el esquema no se tocan; las que falten en el
+  DataFrame se ignoran (un mismo esquema sirve para varias consultas).
+- leer_tipado() aplica el esquema LOTE A LOTE mientras lee (extraccion_copy.
+  leer_sql_en_lotes): el resultado entero nunca existe como DataFrame de object,
+  así el pico de memoria es el de los lotes tipados y no el del resultado sin tipar.
+- Tras concatenar chunks o lotes, las category se rehacen (pd.concat de categorías
+  distintas devuelve object).
+- ranch_name y customer_name NO son category: los dashboards y los análisis
+  agrupan por ellas sin observed=True y saldrían grupos vacíos.
+"""
+
+import os
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from src.db.extraccion_copy import leer_sql, leer_sql_en_lotes
+
+Esquema = Dict[str, str]
+
+# Filas por lote al leer con esquema (memoria acotada por lote)
+TAMANO_LOTE_TIPADO = int(os.getenv("PG_LOTE_TIPADO", "100000"))
+
+# ============================================================
+#  Esquemas compartidos
+# ============================================================
+_PORCENTAJES = [
+    "pct_recibidos_vs_esperados",
+    "pct_sin_gps_vs_esperados",
+    "pct_sin_gps_recibidos",
+    "Mensajes recibidos (%)",
+    "Mensaje con posición GPS (%)",
+    "Posición GPS válida (%)",
+    "Baja precisión (%)",
+    "Posición GPS no válida (%)",
+    "No válida por calidad GPS (%)",
+    "No válida por filtro velocidad (%)",
+    "Posición válida vs esperadas (%)",
+    "% dispositivos OK en ganadería",
+    "% dispositivos OK en ganadería (ajustada)",
+    "media_ttf",
+    "porcentaje_bateria",
+]
+
+_CONTADORES = [
+    "mensajes_esperados",
+    "mensajes_recibidos",
+    "mensajes_sin_gps",
+    "Mensajes esperados (detallado)",
+    "Mensajes recibidos (n)",
+    "Mensaje con posición GPS (n)",
+    "Posición GPS válida (n)",
+    "Baja precisión (n)",
+    "Posición GPS no válida (n)",
+    "No válida por calidad GPS (n)",
+    "No válida por filtro velocidad (n)",
+    "Dispositivos NO OK",
+    "NO OK que comunicaron en 3 días",
+    "numero_reinicios",
+    "ranch_gateway_count",
+    "gateways_online",
+]
+
+_BANDERAS = [
+    "Dispositivo OK (≥50% válidas vs esperadas)",
+    "Ganadería OK",
+    "Ganadería OK (≥70% dispositivos OK)",
+    "Ganadería OK (ajustada)",
+    "Ajuste aplicado (todos NO OK comunicaron 3d)",
+    "all_gateways_online",
+]
+
+_CATEGORIAS = [
+    "Model",
+    "Country",
+    "Region",
+    "animal_specie",
+    "ranch_gateway_overall_status",
+    "gateway_name",
+]
+
+# Bloque común de las consultas estilo DT01 (24h, ayer, N días, detalle por mensaje)
+ESQUEMA_DT01: Esquema = {
+    **{c: "float32" for c in _PORCENTAJES},
+    **{c: "Int32" for c in _CONTADORES},
+    **{c: "boolean" for c in _BANDERAS},
+    **{c: "category" for c in _CATEGORIAS},
+    "suma_total_uplinks": "Int64",
+    "horas_desde_ultimo_visto": "float64",
+    "gateway_lat": "float64",
+    "gateway_lon": "float64",
+    "ultima_posicion_lat": "float64",
+    "ultima_posicion_lon": "float64",
+}
+
+# Registro crudo de DeviceLocations (detalle por mensaje)
+ESQUEMA_UPLINK: Esquema = {
+    "HasLocation": "boolean",
+    "IsValid": "boolean",
+    "IsLowAccuracy": "boolean",
+    "InvalidReason": "category",
+    "lat": "float64",
+    "lon": "float64",
+}
+
+
+# ============================================================
+#  Conversión
+# ============================================================
+def _convertir(serie: pd.Series, dtype: str) -> pd.Series:
+    if dtype == "category":
+        return serie if isinstance(serie.dtype, pd.CategoricalDtype) else serie.astype("category")
+    if dtype == "boolean":
+        return serie.astype("boolean")
+    # Numéricos: Decimal/None/object → número (errores → NaN) y luego dtype final
+    return pd.to_numeric(serie, errors="coerce").astype(dtype)
+
+
+def aplicar_esquema(df: pd.DataFrame, esquema: Optional[Esquema]) -> pd.DataFrame:
+    """
+    Convierte in situ las columnas del esquema presentes en `df`.
+    Además, cualquier otra columna object con Decimal pasa a float64.
+    """
+    if df is None or df.empty:
+        return df
+    for col in df.columns:
+        dtype = (esquema or {}).get(col)
+        if dtype is not None:
+            df[col] = _convertir(df[col], dtype)
+        elif df[col].dtype == object:
+            no_nulos = df[col].dropna()
+            if not no_nulos.empty and isinstance(no_nulos.iloc[0], Decimal):
+                df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+    return df
+
+
+def concatenar(frames: List[pd.DataFrame], esquema: Optional[Esquema]) -> pd.DataFrame:
+    """pd.concat + rehacer category (categorías distintas por chunk → object)."""
+    df = pd.concat(frames, ignore_index=True)
+    for col, dtype in (esquema or {}).items():
+        if dtype == "category" and col in df.columns:
+            df[col] = _convertir(df[col], dtype)
+    return df
+
+
+def leer_tipado(con, sql, params: dict = None, esquema: Optional[Esquema] = None, backend: str = None) -> pd.DataFrame:
+    """
+    Lectura (backend "pandas", "copy" o "preparado") con el esquema aplicado a cada
+    lote según llega; sin esquema, leer_sql tal cual.
+    """
+    if not esquema:
+        return aplicar_esquema(leer_sql(con, sql, params, backend), esquema)
+
+    categorias = [c for c, dtype in esquema.items() if dtype == "category"]
+    lotes = [
+        aplicar_esquema(lote, esquema)
+        for lote in leer_sql_en_lotes(con, sql, params, backend, TAMANO_LOTE_TIPADO, categorias)
+    ]
+    if len(lotes) == 1:
+        return lotes[0]
+    df = concatenar(lotes, esquema)
+    # Columnas fuera del esquema con un lote todo NULL quedan object al concatenar:
+    # se vuelven a inferir (fechas, números) y los Decimal pasan a float64
+    return aplicar_esquema(df.infer_objects(), None)
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Captura de planes (EXPLAIN ANALYZE, BUFFERS) y detección de regresiones por consulta
+
+- Modo instrumentado (PG_EXPLAIN=1 o activar_explain()): la lectura muestreada
+  se hace con auto_explain activo en la sesión (log_analyze, log_buffers, formato
+  JSON, log_level NOTICE). El plan de ESA MISMA ejecución llega al cliente como
+  NOTICE: la consulta no se relanza y los datos se leen una sola vez.
+- Los planes son caché local (no se versionan):
+      data/cache/planes/<consulta>/<AAAAmmdd_HHMMSS_ffffff>.json
+- auto_explain.* son parámetros de superusuario: el usuario de la réplica necesita
+  `GRANT SET ON PARAMETER auto_explain.log_min_duration, ...` (PG15+) o tener la
+  librería en session_preload_libraries. Si no se puede activar, se avisa una vez
+  y no se capturan planes (nunca se duplica la consulta).
+- El coste del modo es el de ANALYZE (cronometrar cada nodo), no una segunda
+  ejecución. Las consultas troceadas por día se muestrean (PG_EXPLAIN_MUESTREO,
+  por defecto 1 de cada 10 chunks); las de un solo SQL se capturan siempre.
+- Cada plan se compara con el último guardado de la misma consulta y se avisa de:
+    · Seq Scan nuevo sobre una tabla grande (DeviceLocations),
+    · salto en las filas estimadas de un nodo (x FACTOR_FILAS),
+    · Sort o Hash que pasa a disco (spill) y antes no,
+    · tiempo de ejecución x FACTOR_TIEMPO.
+- Un fallo al capturar el plan nunca rompe la consulta (solo se avisa).
+"""
+
+import json
+import os
+import random
+import re
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+from src.almacen.escritura import escribir_json_atomico
+
+RUTA_PLANES = os.path.join("data", "cache", "planes")
+
+ACTIVO = os.getenv("PG_EXPLAIN", "0") == "1"
+MUESTREO_CHUNKS = float(os.getenv("PG_EXPLAIN_MUESTREO", "0.1"))
+
+TABLAS_VIGILADAS = {"DeviceLocations"}
+FACTOR_FILAS = 10
+MIN_FILAS_SALTO = 1000
+FACTOR_TIEMPO = 2.0
+MIN_TIEMPO_MS = 1000
+
+SQL_ACTIVAR_AUTO_EXPLAIN = """
+LOAD 'auto_explain';
+SET auto_explain.log_min_duration = 0;
+SET auto_explain.log_analyze = on;
+SET auto_explain.log_buffers = on;
+SET auto_explain.log_format = json;
+SET auto_explain.log_level = notice;
+"""
+SQL_DESACTIVAR_AUTO_EXPLAIN = "SET auto_explain.log_min_duration = -1;"
+
+_auto_explain_disponible = True
+
+
+def activar_explain(activo: bool = True, muestreo: Optional[float] = None) -> None:
+    """Activa/desactiva el modo instrumentado desde código (sin variable de entorno)."""
+    global ACTIVO, MUESTREO_CHUNKS
+    ACTIVO = activo
+    if muestreo is not None:
+        MUESTREO_CHUNKS = muestreo
+
+
+# ============================================================
+#  Resumen del plan
+# ============================================================
+def _nodos(nodo: dict) -> Iterator[dict]:
+    yield nodo
+    for hijo in nodo.get("Plans", []):
+        yield from _nodos(hijo)
+
+
+def _clave(nodo: dict) -> str:
+    return f"{nodo['Node Type']}:{nodo.get('Relation Name') or nodo.get('CTE Name') or '-'}"
+
+
+def resumir_plan(explain: list) -> dict:
+    """Tiempos, buffers de la raíz y los datos de cada nodo que se usan para comparar."""
+    raiz = explain[0]
+    plan = raiz["Plan"]
+    nodos = []
+    for nodo in _nodos(plan):
+        spill = nodo.get("Sort Space Type") == "Disk" or int(nodo.get("Hash Batches", 1) or 1) > 1
+        nodos.append({
+            "clave": _clave(nodo),
+            "tipo": nodo["Node Type"],
+            "relacion": nodo.get("Relation Name"),
+            "indice": nodo.get("Index Name"),
+            "filas_estimadas": nodo.get("Plan Rows", 0),
+            "filas_reales": nodo.get("Actual Rows", 0) * nodo.get("Actual Loops", 1),
+            "spill": spill,
+        })
+    return {
+        "planificacion_ms": raiz.get("Planning Time"),
+        "ejecucion_ms": raiz.get("Execution Time"),
+        "bloques_cache": plan.get("Shared Hit Blocks", 0),
+        "bloques_leidos": plan.get("Shared Read Blocks", 0),
+        "bloques_temp": plan.get("Temp Written Blocks", 0),
+        "nodos": nodos,
+    }
+
+
+def detectar_regresiones(actual: dict, previo: Optional[dict]) -> List[str]:
+    """Avisos de `actual` frente a `previo` (resúmenes de resumir_plan)."""
+    avisos = []
+    previos = previo["nodos"] if previo else []
+
+    seq_previos = {n["relacion"] for n in previos if n["tipo"] == "Seq Scan"}
+    for n in actual["nodos"]:
+        if n["tipo"] == "Seq Scan" and n["relacion"] in TABLAS_VIGILADAS and n["relacion"] not in seq_previos:
+            avisos.append(f"Seq Scan sobre {n['relacion']}")
+
+    estimadas_previas: Dict[str, float] = {}
+    for n in previos:
+        estimadas_previas[n["clave"]] = max(estimadas_previas.get(n["clave"], 0), n["filas_estimadas"])
+    vistos = set()
+    for n in actual["nodos"]:
+        antes = estimadas_previas.get(n["clave"])
+        if n["clave"] in vistos or not antes:
+            continue
+        vistos.add(n["clave"])
+        if n["filas_estimadas"] >= MIN_FILAS_SALTO and n["filas_estimadas"] >= FACTOR_FILAS * antes:
+            avisos.append(f"Filas estimadas en {n['clave']}: {antes:.0f} → {n['filas_estimadas']:.0f}")
+
+    spill_previos = {n["clave"] for n in previos if n["spill"]}
+    for n in actual["nodos"]:
+        if n["spill"] and n["clave"] not in spill_previos:
+            avisos.append(f"{n['tipo']} a disco en {n['clave']}")
+
+    if previo and previo.get("ejecucion_ms") and actual.get("ejecucion_ms"):
+        if actual["ejecucion_ms"] >= MIN_TIEMPO_MS and actual["ejecucion_ms"] >= FACTOR_TIEMPO * previo["ejecucion_ms"]:
+            avisos.append(f"Ejecución {previo['ejecucion_ms']:.0f} ms → {actual['ejecucion_ms']:.0f} ms")
+
+    return avisos
+
+
+# ============================================================
+#  Almacenamiento
+# ============================================================
+def _carpeta(consulta: str, raiz: str) -> str:
+    return os.path.join(raiz, consulta)
+
+
+def ultimo_plan(consulta: str, raiz: str = RUTA_PLANES) -> Optional[dict]:
+    """Último plan guardado de `consulta` (None si no hay ninguno)."""
+    carpeta = _carpeta(consulta, raiz)
+    if not os.path.isdir(carpeta):
+        return None
+    ficheros = sorted(f for f in os.listdir(carpeta) if f.endswith(".json"))
+    if not ficheros:
+        return None
+    with open(os.path.join(carpeta, ficheros[-1]), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _guardar(registro: dict, consulta: str, raiz: str) -> str:
+    carpeta = _carpeta(consulta, raiz)
+    os.makedirs(carpeta, exist_ok=True)
+    ruta = os.path.join(carpeta, f"{datetime.now():%Y%m%d_%H%M%S_%f}.json")
+    escribir_json_atomico(ruta, registro, indent=2, ensure_ascii=False, default=str)
+    return ruta
+
+
+# ============================================================
+#  Captura (auto_explain → NOTICE)
+# ============================================================
+_RE_DURACION = re.compile(r"duration:\s*([0-9.]+)\s*ms")
+
+
+def plan_desde_aviso(aviso: str) -> Optional[list]:
+    """
+    NOTICE de auto_explain ("duration: X ms  plan:\\n{...}") → lista con la forma
+    de EXPLAIN (FORMAT JSON), para resumir_plan. None si el aviso no es un plan.
+    """
+    inicio = aviso.find("{")
+    if "plan:" not in aviso or inicio < 0:
+        return None
+    try:
+        plan = json.loads(aviso[inicio:])
+    except ValueError:
+        return None
+    if "Plan" not in plan:
+        return None
+    duracion = _RE_DURACION.search(aviso)
+    plan.setdefault("Execution Time", float(duracion.group(1)) if duracion else None)
+    return [plan]
+
+
+def _activar(raw) -> bool:
+    """auto_explain en la sesión, en un savepoint para no abortar la transacción si falla."""
+    global _auto_explain_disponible
+    with raw.cursor() as cur:
+        cur.execute("SAVEPOINT planes_auto_explain;")
+        try:
+            cur.execute(SQL_ACTIVAR_AUTO_EXPLAIN)
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT planes_auto_explain;")
+            _auto_explain_disponible = False
+            print(f"⚠️ auto_explain no disponible, no se capturan planes: {str(e).splitlines()[0] if str(e) else e}")
+            return False
+        cur.execute("RELEASE SAVEPOINT planes_auto_explain;")
+    return True
+
+
+def _desactivar(raw) -> None:
+    try:
+        with raw.cursor() as cur:
+            cur.execute(SQL_DESACTIVAR_AUTO_EXPLAIN)
+    except Exception:
+        pass  # transacción abortada: el rollback del llamante deshace los SET
+
+
+def registrar_plan(explain: list, consulta: str, etiqueta: str = "", raiz: str = RUTA_PLANES) -> dict:
+    """Guarda el plan, lo compara con el último de `consulta` y avisa de regresiones."""
+    resumen = resumir_plan(explain)
+    previo = ultimo_plan(consulta, raiz)
+    regresiones = detectar_regresiones(resumen, previo["resumen"] if previo else None)
+    registro = {
+        "consulta": consulta,
+        "etiqueta": etiqueta,
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "resumen": resumen,
+        "regresiones": regresiones,
+        "plan": explain,
+    }
+    ruta = _guardar(registro, consulta, raiz)
+
+    print(
+        f"⏱️ Plan {consulta} {etiqueta}: {resumen['ejecucion_ms'] or 0:.0f} ms | "
+        f"bloques leídos {resumen['bloques_leidos']} | 📁 {ruta}"
+    )
+    for aviso in regresiones:
+        print(f"⚠️ Regresión de plan en {consulta}: {aviso}")
+    return registro
+
+
+@contextmanager
+def capturar_si_activo(con, consulta: Optional[str], etiqueta: str = "", chunk: bool = False) -> Iterator[None]:
+    """
+    Envuelve la lectura real de `consulta`:
+
+        with capturar_si_activo(con, "consulta_01"):
+            df = leer_tipado(con, ...)
+
+    Solo en modo instrumentado (los chunks, con probabilidad MUESTREO_CHUNKS) y
+    si auto_explain se pudo activar. Se registra el plan de la última sentencia
+    del bloque (la lectura). Un fallo al capturar nunca rompe la consulta.
+    """
+    if not (consulta and ACTIVO and _auto_explain_disponible) or (chunk and random.random() >= MUESTREO_CHUNKS):
+        yield
+        return
+
+    raw = con.connection.driver_connection
+    if not _activar(raw):
+        yield
+        return
+
+    del raw.notices[:]  # psycopg2 guarda solo los 50 últimos: se vacía para no confundirlos
+    yield
+    _desactivar(raw)
+
+    try:
+        planes = [p for p in map(plan_desde_aviso, raw.notices) if p]
+        if not planes:
+            print(f"⚠️ No llegó el plan de {consulta} {etiqueta} (¿auto_explain.log_level?)")
+            return
+        registrar_plan(planes[-1], consulta, etiqueta)
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar el plan de {consulta} {etiqueta}: {e}")
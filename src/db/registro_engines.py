@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Registro único de engines por perfil de carga (batch, api, dashboard)
+
+- Un engine por perfil, creado la primera vez que se pide (singleton por proceso).
+- Cada perfil fija su pool y su sesión: zona horaria, solo lectura y timeouts.
+- La sesión se configura UNA vez por conexión física (evento "connect"), no con
+  un SET antes de cada consulta; fijar_zona_horaria() se salta el SET si la
+  conexión ya tiene esa zona. Una zona cambiada se restaura a la del perfil al
+  devolver la conexión al pool (evento "checkin"): no pasa a otros usuarios.
+- calentar(): abre las conexiones del pool al arrancar (main_consulta, API) para
+  que la primera consulta no pague el handshake SSL ni la configuración.
+
+Con varias réplicas (src/db/replicas.py) hay un engine por (perfil, réplica);
+sin indicar réplica se usa la principal (DB_CONFIG).
+
+Conexión y credenciales por entorno: PG_HOST, PG_PORT, PG_DBNAME, PG_USER,
+PG_PASSWORD (obligatoria), PG_SSLMODE. Pool y timeouts por perfil: ver PERFILES.
+
+Sustituye a las tres factorías anteriores (db_connection.get_engine,
+src/db/connection.conectar_db y api/db/connection.get_engine), que ahora
+delegan aquí.
+"""
+
+import os
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, Engine
+
+# Credenciales y réplica principal desde el entorno (sin contraseña en el código)
+DB_CONFIG = {
+    "host": os.getenv("PG_HOST", "10.0.1.6"),
+    "port": int(os.getenv("PG_PORT", "31702")),
+    "dbname": os.getenv("PG_DBNAME", "ixorigue"),
+    "user": os.getenv("PG_USER", "ixorigue_reader"),
+    "password": os.getenv("PG_PASSWORD", ""),
+    "sslmode": os.getenv("PG_SSLMODE", "require"),
+}
+
+
+def _entorno(prefijo: str, nombre: str, defecto: int) -> int:
+    """Ajuste del pool/sesión del perfil: <prefijo><nombre> (p. ej. PG_API_POOL_SIZE) o el valor por defecto."""
+    return int(os.getenv(f"{prefijo}{nombre}", str(defecto)))
+
+
+def _perfil(prefijo: str, *, pool_size: int, max_overflow: int, pool_recycle: int, statement_timeout_ms: int, **resto) -> dict:
+    """Perfil con los mismos overrides de entorno que tenía db_connection.get_engine (PG_POOL_SIZE, ...)."""
+    return {
+        "pool_size": _entorno(prefijo, "POOL_SIZE", pool_size),
+        "max_overflow": _entorno(prefijo, "MAX_OVERFLOW", max_overflow),
+        "pool_recycle": _entorno(prefijo, "POOL_RECYCLE", pool_recycle),
+        "pool_timeout": _entorno(prefijo, "POOL_TIMEOUT", 30),
+        "statement_timeout_ms": _entorno(prefijo, "STATEMENT_TIMEOUT_MS", statement_timeout_ms),
+        "idle_tx_timeout_ms": _entorno(prefijo, "IDLE_TX_TIMEOUT_MS", 30000),
+        **resto,
+    }
+
+
+# =========================
+#  Perfiles de carga
+#  Overrides por entorno: PG_* para batch, PG_API_* y PG_DASHBOARD_* para el resto
+#  (POOL_SIZE, MAX_OVERFLOW, POOL_RECYCLE, POOL_TIMEOUT, STATEMENT_TIMEOUT_MS, IDLE_TX_TIMEOUT_MS)
+# =========================
+PERFILES: Dict[str, dict] = {
+    # Extracciones largas (main_consulta, chunks por día)
+    "batch": _perfil(
+        "PG_",
+        pool_size=5,
+        max_overflow=10,
+        pool_recycle=3600,
+        statement_timeout_ms=600000,  # 10 min
+        isolation_level="REPEATABLE READ",
+        zona_horaria="Europe/Madrid",
+        application_name="ixo-batch",
+    ),
+    # API (FastAPI): peticiones concurrentes y cortas
+    "api": _perfil(
+        "PG_API_",
+        pool_size=3,
+        max_overflow=5,
+        pool_recycle=1800,
+        statement_timeout_ms=300000,  # 5 min
+        isolation_level=None,
+        zona_horaria="UTC",
+        application_name="ixo-api",
+    ),
+    # Dashboards (Streamlit): pocas conexiones, consultas interactivas
+    "dashboard": _perfil(
+        "PG_DASHBOARD_",
+        pool_size=2,
+        max_overflow=2,
+        pool_recycle=1800,
+        statement_timeout_ms=120000,  # 2 min
+        isolation_level=None,
+        zona_horaria="Europe/Madrid",
+        application_name="ixo-dashboard",
+    ),
+}
+
+REPLICA_PRINCIPAL = f"{DB_CONFIG['host']}:{DB_CONFIG['port']}"
+
+_engines: Dict[Tuple[str, str], Engine] = {}  # (perfil, "host:puerto") → engine
+_lock = threading.Lock()
+
+
+def _url(replica: str = REPLICA_PRINCIPAL, config: dict = DB_CONFIG) -> URL:
+    if not config["password"]:
+        raise RuntimeError("❌ Falta la contraseña de la base de datos (variable de entorno PG_PASSWORD)")
+    host, _, puerto = replica.rpartition(":")
+    return URL.create(
+        drivername="postgresql+psycopg2",
+        username=config["user"],
+        password=config["password"],
+        host=host,
+        port=int(puerto),
+        database=config["dbname"],
+        query={"sslmode": config["sslmode"]},
+    )
+
+
+def _ejecutar_autocommit(dbapi_con, sentencias) -> None:
+    """SETs en autocommit sobre la conexión DBAPI (para que persistan en la sesión)."""
+    autocommit = dbapi_con.autocommit
+    dbapi_con.autocommit = True
+    try:
+        with dbapi_con.cursor() as cur:
+            for sentencia in sentencias:
+                cur.execute(sentencia)
+    finally:
+        dbapi_con.autocommit = autocommit
+
+
+def _configurar_sesion(engine: Engine, perfil: dict) -> None:
+    """
+    Evento "connect": SETs de sesión una vez por conexión física.
+    Evento "checkin": si alguien cambió la zona (fijar_zona_horaria), se vuelve a
+    la del perfil al devolver la conexión, para que no la herede el siguiente.
+    """
+    zona = perfil["zona_horaria"]
+    sentencias = [
+        f"SET TIME ZONE '{zona}'",
+        "SET default_transaction_read_only = on",
+        f"SET statement_timeout = {int(perfil['statement_timeout_ms'])}",
+        f"SET idle_in_transaction_session_timeout = {int(perfil['idle_tx_timeout_ms'])}",
+        f"SET application_name = '{perfil['application_name']}'",
+    ]
+
+    @event.listens_for(engine, "connect")
+    def _al_conectar(dbapi_con, registro):
+        _ejecutar_autocommit(dbapi_con, sentencias)
+        registro.info["zona_horaria"] = zona
+
+    @event.listens_for(engine, "checkin")
+    def _al_devolver(dbapi_con, registro):
+        if dbapi_con is None or registro.info.get("zona_horaria") == zona:
+            return
+        try:
+            _ejecutar_autocommit(dbapi_con, [f"SET TIME ZONE '{zona}'"])
+            registro.info["zona_horaria"] = zona
+        except Exception as e:
+            # Sin poder restaurar la zona, la conexión no vuelve a usarse
+            registro.invalidate(e)
+
+
+def _crear_engine(nombre: str, replica: str) -> Engine:
+    perfil = PERFILES[nombre]
+    opciones = {}
+    if perfil["isolation_level"]:
+        opciones["isolation_level"] = perfil["isolation_level"]
+
+    engine = create_engine(
+        _url(replica),
+        connect_args={
+            "connect_timeout": 10,
+            # TCP keepalives (Linux; en Windows algunos drivers ignoran estos flags)
+            "keepalives": 1,
+            "keepalives_idle": 30,
+            "keepalives_interval": 10,
+            "keepalives_count": 3,
+        },
+        pool_pre_ping=True,
+        pool_size=perfil["pool_size"],
+        max_overflow=perfil["max_overflow"],
+        pool_recycle=perfil["pool_recycle"],
+        pool_timeout=perfil["pool_timeout"],
+        **opciones,
+    )
+    _configurar_sesion(engine, perfil)
+    return engine
+
+
+def obtener_engine(perfil: str = "batch", replica: Optional[str] = None) -> Engine:
+    """
+    Engine del perfil (se crea en la primera llamada y se reutiliza después).
+    replica: "host:puerto"; None → REPLICA_PRINCIPAL.
+    """
+    if perfil not in PERFILES:
+        raise ValueError(f"Perfil de engine desconocido: {perfil!r} (válidos: {', '.join(PERFILES)})")
+    clave = (perfil, replica or REPLICA_PRINCIPAL)
+    engine = _engines.get(clave)
+    if engine is None:
+        with _lock:
+            engine = _engines.get(clave)
+            if engine is None:
+                engine = _crear_engine(*clave)
+                _engines[clave] = engine
+    return engine
+
+
+def identificar(engine) -> Optional[Tuple[str, str]]:
+    """(perfil, réplica) de un engine del registro; None si se creó fuera de él."""
+    for clave, registrado in list(_engines.items()):
+        if registrado is engine:
+            return clave
+    return None
+
+
+def calentar(perfiles: Iterable[str] = ("batch",), conexiones: Optional[int] = None) -> Dict[str, Engine]:
+    """
+    Abre `conexiones` (por defecto pool_size) por perfil y las devuelve al pool.
+    Si la réplica no responde, el error sale aquí y no en la primera consulta.
+    """
+    engines = {}
+    for nombre in perfiles:
+        engine = obtener_engine(nombre)
+        n = conexiones or PERFILES[nombre]["pool_size"]
+        abiertas = []
+        try:
+            for _ in range(n):
+                abiertas.append(engine.connect())
+        finally:
+            for con in abiertas:
+                con.close()
+        print(f"🔗 Engine '{nombre}' listo ({n} conexiones abiertas)")
+        engines[nombre] = engine
+    return engines
+
+
+def cerrar_todos() -> None:
+    """dispose() de todos los engines creados (p. ej. al apagar la API)."""
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+
+def fijar_zona_horaria(con, zona: Optional[str]) -> None:
+    """
+    SET TIME ZONE solo si la conexión no tiene ya esa zona.
+    - Fuera de transacción: SET + commit (persiste mientras se use esta conexión;
+      al devolverla al pool vuelve a la zona del perfil) y se anota.
+    - Dentro de una transacción: SET y la zona queda como desconocida (depende de
+      si la transacción acaba en commit o rollback).
+    """
+    if not zona or con.info.get("zona_horaria") == zona:
+        return
+    en_transaccion = con.in_transaction()
+    con.exec_driver_sql(f"SET TIME ZONE '{zona}';")
+    if en_transaccion:
+        con.info.pop("zona_horaria", None)
+    else:
+        con.commit()
+        con.info["zona_horaria"] = zona
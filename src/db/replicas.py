@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Enrutado entre réplicas de lectura (salud, retraso y carga)
+
+- Réplicas en PG_REPLICAS ("host:puerto,host:puerto"); la primera es la principal.
+- Comprobación de salud en paralelo, cacheada INTERVALO_SALUD_S segundos:
+    · conecta y mide la latencia del round trip,
+    · retraso de replicación: 0 si ya se ha aplicado todo el WAL recibido
+      (receive LSN = replay LSN, p. ej. con el primario sin escrituras); si no,
+      now() - pg_last_xact_replay_timestamp(), más los bytes pendientes,
+    · sesiones activas en la base de datos.
+- Las extracciones van a la réplica con mejor puntuación (menos retraso y menos
+  carga, contando también lo que este proceso ya le ha asignado).
+- Réplicas caídas (error de conexión o recovery conflict persistente) quedan
+  fuera PENALIZACION_S segundos y el trabajo pasa a las demás.
+- ejecutor_chunks reparte los chunks de un engine del registro entre todas las
+  réplicas sanas (engines_equivalentes), así el throughput crece con las réplicas.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from src.db.registro_engines import REPLICA_PRINCIPAL, identificar, obtener_engine
+
+REPLICAS: List[str] = [
+    r.strip()
+    for r in os.getenv("PG_REPLICAS", f"{REPLICA_PRINCIPAL},10.0.1.2:31700").split(",")
+    if r.strip()
+]
+
+INTERVALO_SALUD_S = int(os.getenv("PG_REPLICAS_INTERVALO_S", "60"))
+# Por encima de este retraso la réplica no recibe extracciones
+MAX_RETRASO_S = float(os.getenv("PG_REPLICAS_MAX_RETRASO_S", "300"))
+PENALIZACION_S = 120
+
+SQL_SALUD = text("""
+SELECT
+  pg_is_in_recovery() AS en_recovery,
+  CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM (now() - pg_last_xact_replay_timestamp())), 0)
+  END AS retraso_s,
+  COALESCE(pg_wal_lsn_diff(pg_last_wal_receive_lsn(), pg_last_wal_replay_lsn()), 0) AS retraso_bytes,
+  (SELECT COUNT(*) FROM pg_stat_activity
+    WHERE state = 'active' AND datname = current_database()) AS activas;
+""")
+
+_lock = threading.Lock()
+_estado: Dict[str, dict] = {}  # réplica → última comprobación
+_asignadas: Dict[str, int] = {}  # réplica → extracciones asignadas desde la última comprobación
+_caidas: Dict[str, float] = {}  # réplica → time.monotonic() hasta el que queda fuera
+
+
+# ============================================================
+#  Errores que justifican cambiar de réplica
+# ============================================================
+def es_error_conexion(error: Exception) -> bool:
+    msg = str(error).lower()
+    return any(
+        patron in msg
+        for patron in (
+            "could not connect",
+            "connection refused",
+            "server closed the connection",
+            "terminating connection",
+            "timeout expired",
+            "connection not open",
+            "ssl syscall error",
+        )
+    )
+
+
+def marcar_caida(replica: str, segundos: float = PENALIZACION_S) -> None:
+    with _lock:
+        _caidas[replica] = time.monotonic() + segundos
+    print(f"⚠️ Réplica {replica} fuera de rotación {segundos:.0f}s")
+
+
+def esta_disponible(replica: str) -> bool:
+    return _caidas.get(replica, 0.0) <= time.monotonic()
+
+
+# ============================================================
+#  Salud
+# ============================================================
+def comprobar_replica(replica: str, perfil: str = "batch") -> dict:
+    """Una comprobación: ok, latencia_ms, retraso_s, retraso_bytes, activas."""
+    t0 = time.perf_counter()
+    try:
+        with obtener_engine(perfil, replica).connect() as con:
+            fila = con.execute(SQL_SALUD).mappings().one()
+        estado = {
+            "ok": True,
+            "en_recovery": bool(fila["en_recovery"]),
+            "latencia_ms": (time.perf_counter() - t0) * 1000,
+            "retraso_s": float(fila["retraso_s"] or 0),
+            "retraso_bytes": int(fila["retraso_bytes"] or 0),
+            "activas": int(fila["activas"] or 0),
+        }
+    except Exception as e:
+        estado = {"ok": False, "error": str(e).splitlines()[0] if str(e) else type(e).__name__}
+    estado["comprobado"] = time.monotonic()
+    return estado
+
+
+def comprobar_todas(perfil: str = "batch", forzar: bool = False) -> Dict[str, dict]:
+    """Estado de todas las réplicas; solo re-comprueba las caducadas (o todas con forzar)."""
+    ahora = time.monotonic()
+    caducadas = [
+        r for r in REPLICAS
+        if forzar or ahora - _estado.get(r, {}).get("comprobado", -INTERVALO_SALUD_S) >= INTERVALO_SALUD_S
+    ]
+    if caducadas:
+        with ThreadPoolExecutor(max_workers=len(caducadas), thread_name_prefix="salud") as pool:
+            resultados = dict(zip(caducadas, pool.map(lambda r: comprobar_replica(r, perfil), caducadas)))
+        with _lock:
+            for replica, estado in resultados.items():
+                _estado[replica] = estado
+                _asignadas[replica] = 0
+                if not estado["ok"]:
+                    print(f"⚠️ Réplica {replica} no disponible: {estado.get('error', '')}")
+    return dict(_estado)
+
+
+def _puntuacion(replica: str) -> float:
+    """Menor es mejor: retraso (s) + carga (sesiones activas + asignadas aquí) + latencia."""
+    estado = _estado[replica]
+    carga = estado["activas"] + 2 * _asignadas.get(replica, 0)
+    return estado["retraso_s"] + 5 * carga + estado["latencia_ms"] / 100
+
+
+def replicas_ordenadas(perfil: str = "batch") -> List[str]:
+    """Réplicas sanas, disponibles y con retraso aceptable, de mejor a peor."""
+    comprobar_todas(perfil)
+    with _lock:
+        sanas = [
+            r for r in REPLICAS
+            if _estado.get(r, {}).get("ok") and esta_disponible(r) and _estado[r]["retraso_s"] <= MAX_RETRASO_S
+        ]
+        return sorted(sanas, key=_puntuacion)
+
+
+def elegir_replica(perfil: str = "batch") -> str:
+    """Mejor réplica ahora mismo (la principal si ninguna pasa la comprobación) y la anota como asignada."""
+    candidatas = replicas_ordenadas(perfil)
+    replica = candidatas[0] if candidatas else REPLICA_PRINCIPAL
+    with _lock:
+        _asignadas[replica] = _asignadas.get(replica, 0) + 1
+    return replica
+
+
+def engine_extraccion(perfil: str = "batch") -> Engine:
+    """Engine del perfil en la réplica con mejor puntuación."""
+    return obtener_engine(perfil, elegir_replica(perfil))
+
+
+def engine_para(engine) -> Engine:
+    """Mismo perfil que `engine` en la mejor réplica (tal cual si no es del registro)."""
+    clave = identificar(engine)
+    if clave is None or len(REPLICAS) < 2:
+        return engine
+    return engine_extraccion(clave[0])
+
+
+def engines_equivalentes(engine) -> List[Engine]:
+    """
+    Mismo perfil en todas las réplicas sanas, empezando por la de `engine`.
+    Engines creados fuera del registro (o una sola réplica) → [engine].
+    """
+    clave = identificar(engine)
+    if clave is None or len(REPLICAS) < 2:
+        return [engine]
+    perfil, propia = clave
+    sanas = replicas_ordenadas(perfil)
+    if propia in sanas or not sanas:
+        orden = [propia] + [r for r in sanas if r != propia]
+    else:
+        orden = sanas
+    return [obtener_engine(perfil, r) for r in orden]
+
+
+def replica_de(engine) -> Optional[str]:
+    clave = identificar(engine)
+    return clave[1] if clave else None
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Sentencias preparadas en el servidor para las consultas que se repiten por ventana
+
+- Las consultas por día (SQL_DIA_DETALLE, SQL_DIA_METRICAS, SQL_DIA_UPLINKS, ...)
+  se lanzan hasta 60 veces por ejecución con el mismo texto y distinto :inicio/:fin;
+  sin preparar, el planificador rehace cada vez el plan del CTE completo.
+- backend="preparado" (ver extraccion_copy.leer_sql):
+    · PREPARE una vez por conexión (mismo SQL → mismo nombre, ixo_<hash>),
+    · EXECUTE por ventana con plan genérico (plan_cache_mode = force_generic_plan,
+      un SET de sesión la primera vez en cada conexión, anotado en con.info; solo
+      afecta a sentencias preparadas, no a las lecturas de los otros backends),
+    · los tipos de cada $n se leen de pg_prepared_statements y los argumentos
+      van con CAST explícito (arrays de uuid, timestamptz, ...).
+- La primera vez en cada conexión se mide el tiempo de planificación con
+  EXPLAIN (SUMMARY) EXECUTE (no ejecuta la consulta y deja el plan en caché);
+  resumen_preparadas() da una ESTIMACIÓN del tiempo de planificación ahorrado
+  (planificación medida de la sentencia × EXECUTE posteriores que reutilizan el
+  plan); los EXECUTE no se vuelven a medir.
+- Las sentencias preparadas viven lo que la conexión del pool; se anotan en
+  con.info y, tras un error, se vuelve a mirar pg_prepared_statements.
+
+PG_PLAN_CACHE_MODE=auto deja que Postgres decida entre plan genérico y a medida.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Iterator, Optional
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import psycopg2 as pg_psycopg2
+from sqlalchemy.exc import DBAPIError
+
+PLAN_CACHE_MODE = os.getenv("PG_PLAN_CACHE_MODE", "force_generic_plan")
+
+# Compilador con marcadores $1..$n (los de PREPARE)
+_DIALECTO_DOLAR = pg_psycopg2.dialect(paramstyle="numeric_dollar")
+
+_lock = threading.Lock()
+_estadisticas = {"preparadas": 0, "ejecuciones": 0, "planificacion_ms": 0.0, "ahorro_estimado_ms": 0.0}
+
+
+def _compilar(sql):
+    """(texto con $n, nombres de parámetro en orden de $n)."""
+    stmt = sql if hasattr(sql, "compile") else text(sql)
+    compilado = stmt.compile(dialect=_DIALECTO_DOLAR)
+    return str(compilado).strip().rstrip(";").strip(), list(compilado.positiontup or [])
+
+
+def _ejecutar_driver(con, cur, sentencia: str, valores=None):
+    try:
+        cur.execute(sentencia, valores)
+    except con.dialect.loaded_dbapi.Error as e:
+        raise DBAPIError.instance(sentencia, valores, e, con.dialect.loaded_dbapi.Error)
+
+
+def _fijar_plan_cache_mode(con) -> None:
+    """
+    SET plan_cache_mode de sesión, solo si la conexión no lo tiene ya (como
+    registro_engines.fijar_zona_horaria):
+    - Fuera de transacción: SET + commit y se anota en con.info.
+    - Dentro de la transacción del llamador: SET sin anotar (un rollback lo
+      desharía); se repite en la siguiente lectura.
+    """
+    if PLAN_CACHE_MODE == "auto" or con.info.get("plan_cache_mode") == PLAN_CACHE_MODE:
+        return
+    en_transaccion = con.in_transaction()
+    con.exec_driver_sql(f"SET plan_cache_mode = {PLAN_CACHE_MODE};")
+    if not en_transaccion:
+        con.commit()
+        con.info["plan_cache_mode"] = PLAN_CACHE_MODE
+
+
+def preparar(con, sql) -> dict:
+    """
+    PREPARE de `sql` en la conexión (solo la primera vez) y sus metadatos:
+    nombre, parámetros (en orden de $n), tipos y planificación medida (ms).
+    """
+    cuerpo, nombres = _compilar(sql)
+    nombre = "ixo_" + hashlib.sha1(cuerpo.encode("utf-8")).hexdigest()[:16]
+    preparadas = con.info.setdefault("sentencias_preparadas", {})
+    if nombre in preparadas:
+        return preparadas[nombre]
+
+    consulta_tipos = "SELECT parameter_types::text[] FROM pg_prepared_statements WHERE name = %s"
+    raw = con.connection.driver_connection
+    with raw.cursor() as cur:
+        # Puede existir ya en la sesión aunque no esté anotada (p. ej. tras un error)
+        _ejecutar_driver(con, cur, consulta_tipos, (nombre,))
+        fila = cur.fetchone()
+        if fila is None:
+            _ejecutar_driver(con, cur, f"PREPARE {nombre} AS {cuerpo}")
+            _ejecutar_driver(con, cur, consulta_tipos, (nombre,))
+            fila = cur.fetchone()
+            with _lock:
+                _estadisticas["preparadas"] += 1
+        tipos = list(fila[0] or [])
+
+    info = {"nombre": nombre, "parametros": nombres, "tipos": tipos, "planificacion_ms": None}
+    preparadas[nombre] = info
+    return info
+
+
+def _argumentos(info: dict, params: dict):
+    """'CAST(%s AS tipo), ...' + valores en el orden de $n."""
+    faltan = [p for p in info["parametros"] if p not in params]
+    if faltan:
+        raise KeyError(f"Faltan parámetros para {info['nombre']}: {', '.join(faltan)}")
+    marcadores = ", ".join(f"CAST(%s AS {tipo})" for tipo in info["tipos"])
+    return marcadores, [params[p] for p in info["parametros"]]
+
+
+def _medir_planificacion(con, cur, info: dict, marcadores: str, valores) -> float:
+    """EXPLAIN (SUMMARY) EXECUTE: tiempo de planificación, sin ejecutar la consulta."""
+    sentencia = f"EXPLAIN (SUMMARY ON, FORMAT JSON) EXECUTE {info['nombre']} ({marcadores})"
+    _ejecutar_driver(con, cur, sentencia, valores)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return float(plan[0].get("Planning Time", 0.0))
+
+
+def leer_preparado(con, sql, params: dict = None) -> pd.DataFrame:
+    """
+    EXECUTE de la sentencia preparada de `sql` con `params`.
+    Usa la transacción de `con` (commit/rollback del llamador, como leer_copy).
+    """
+    return list(leer_preparado_en_lotes(con, sql, params))[0]
+
+
+def leer_preparado_en_lotes(con, sql, params: dict = None, tamano_lote: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """
+    Como leer_preparado, pero construye los DataFrames de `tamano_lote` en `tamano_lote`
+    filas (fetchmany; None → uno solo). Siempre devuelve al menos uno (vacío con columnas).
+    """
+    params = params or {}
+    _fijar_plan_cache_mode(con)
+    if not con.in_transaction():
+        con.begin()
+    info = preparar(con, sql)
+    marcadores, valores = _argumentos(info, params)
+
+    raw = con.connection.driver_connection
+    try:
+        with raw.cursor() as cur:
+            if info["planificacion_ms"] is None:
+                info["planificacion_ms"] = _medir_planificacion(con, cur, info, marcadores, valores)
+                with _lock:
+                    _estadisticas["planificacion_ms"] += info["planificacion_ms"]
+            else:
+                # Estimación: cada EXECUTE posterior reutiliza el plan y se ahorra
+                # lo que costó planificarlo la primera vez (no se mide)
+                with _lock:
+                    _estadisticas["ahorro_estimado_ms"] += info["planificacion_ms"]
+
+            _ejecutar_driver(con, cur, f"EXECUTE {info['nombre']} ({marcadores})", valores)
+            columnas = [d[0] for d in cur.description]
+            primero = True
+            while True:
+                filas = cur.fetchall() if tamano_lote is None else cur.fetchmany(tamano_lote)
+                if filas or primero:
+                    yield pd.DataFrame.from_records(filas, columns=columnas, coerce_float=True)
+                primero = False
+                if tamano_lote is None or len(filas) < tamano_lote:
+                    break
+    except DBAPIError:
+        # Tras el rollback del llamador se vuelve a comprobar en pg_prepared_statements
+        con.info.get("sentencias_preparadas", {}).pop(info["nombre"], None)
+        raise
+
+    with _lock:
+        _estadisticas["ejecuciones"] += 1
+
+
+def estadisticas_preparadas() -> dict:
+    with _lock:
+        return dict(_estadisticas)
+
+
+def resumen_preparadas(desde: dict = None) -> str:
+    """Texto con sentencias, EXECUTEs y planificación ahorrada estimada (opcionalmente desde otra foto)."""
+    ahora = estadisticas_preparadas()
+    base = desde or {k: 0 for k in ahora}
+    d = {k: ahora[k] - base.get(k, 0) for k in ahora}
+    return (
+        f"Sentencias preparadas: {d['preparadas']} | EXECUTE: {d['ejecuciones']} | "
+        f"Planificación: {d['planificacion_ms']:.0f} ms medidos, ~{d['ahorro_estimado_ms']:.0f} ms ahorrados (estimado)"
+    )
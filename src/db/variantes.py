@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Variantes de SQL por consulta: registro, comprobación de equivalencia y promoción
+
+- Cada consulta puede declarar formulaciones alternativas del MISMO resultado
+  (p. ej. el RIGHT JOIN current_animals ... WHERE d."Id" IS NOT NULL como JOIN
+  interno, o gw_latest con DISTINCT ON en lugar de ROW_NUMBER() ... rn = 1).
+- comparar_variantes() las ejecuta todas sobre la MISMA foto de la réplica
+  (una conexión y una transacción REPEATABLE READ), comprueba fila a fila que
+  devuelven lo mismo que la original y mide tiempos (mediana de varias vueltas,
+  alternando el orden para no favorecer a ninguna con la caché).
+- La más rápida de las equivalentes queda promovida en data/cache/variantes.json;
+  sql_activa() devuelve su SQL (la original si no hay nada promovido o si la
+  promovida ya no está declarada).
+
+Uso:
+    registrar_variantes("consulta_01", {"original": query, "inner_join": inner_join_base(query)},
+                        parametros=parametros_gps_stats_full)
+    sql = sql_activa("consulta_01")
+    resumen = comparar_variantes(engine, "consulta_01")
+"""
+
+import json
+import os
+import re
+import statistics
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Callable, Dict, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import text
+
+from src.almacen.escritura import escribir_json_atomico
+from src.db.registro_engines import fijar_zona_horaria
+
+RUTA_VARIANTES = os.path.join("data", "cache", "variantes.json")
+ORIGINAL = "original"
+
+# Decimales con los que se comparan los valores numéricos
+DECIMALES_COMPARACION = 6
+
+_registro: Dict[str, Dict[str, str]] = {}  # consulta → {variante: SQL}
+_parametros: Dict[str, Callable] = {}  # consulta → f(engine) -> params
+
+
+# ============================================================
+#  Reescrituras reutilizables
+# ============================================================
+_PATRON_RIGHT_JOIN = re.compile(
+    r'RIGHT JOIN current_animals ca\s+ON ca\."DeviceId" = d\."Id"\s+WHERE d\."Id" IS NOT NULL'
+)
+
+_PATRON_GW_LATEST = re.compile(
+    r'gw_latest AS \(\s*SELECT(?P<columnas>.*?),\s*ROW_NUMBER\(\) OVER \(\s*'
+    r'PARTITION BY rlg\."RanchId"\s*ORDER BY (?P<orden>[^)]*?)\s*\) AS rn\s*'
+    r'(?P<origen>FROM "RanchesLoraGateways" rlg\s+JOIN "LoraGateways" lg\s+ON lg\."Id" = rlg\."GatewayId")\s*\)',
+    re.DOTALL,
+)
+
+
+def inner_join_base(sql: str) -> str:
+    """base con JOIN interno: el RIGHT JOIN filtrado por d."Id" IS NOT NULL ya es un inner join."""
+    nuevo, n = _PATRON_RIGHT_JOIN.subn('JOIN current_animals ca\n    ON ca."DeviceId" = d."Id"', sql)
+    if n == 0:
+        raise ValueError('La consulta no tiene el RIGHT JOIN current_animals ... WHERE d."Id" IS NOT NULL')
+    return nuevo
+
+
+def gw_latest_distinct_on(sql: str) -> str:
+    """gw_latest con DISTINCT ON por rancho (conserva la columna rn = 1 que usa el JOIN final)."""
+
+    def _reemplazo(m):
+        return (
+            'gw_latest AS (\n  SELECT DISTINCT ON (rlg."RanchId")'
+            f'{m.group("columnas")},\n    1 AS rn\n  {m.group("origen")}\n'
+            f'  ORDER BY rlg."RanchId", {m.group("orden")}\n)'
+        )
+
+    nuevo, n = _PATRON_GW_LATEST.subn(_reemplazo, sql)
+    if n == 0:
+        raise ValueError("La consulta no tiene gw_latest con ROW_NUMBER() por rancho")
+    return nuevo
+
+
+# ============================================================
+#  Registro
+# ============================================================
+def registrar_variantes(
+    consulta: str,
+    variantes: Dict[str, str],
+    parametros: Optional[Callable] = None,
+) -> Dict[str, str]:
+    """
+    Declara las variantes de `consulta` ({nombre: SQL}; debe incluir "original").
+    parametros: f(engine) -> dict con los parámetros que necesitan (para el arnés).
+    """
+    if ORIGINAL not in variantes:
+        raise ValueError(f"Las variantes de {consulta} deben incluir '{ORIGINAL}'")
+    _registro[consulta] = dict(variantes)
+    if parametros is not None:
+        _parametros[consulta] = parametros
+    return _registro[consulta]
+
+
+def variantes_de(consulta: str) -> Dict[str, str]:
+    if consulta not in _registro:
+        raise KeyError(f"{consulta} no tiene variantes registradas")
+    return _registro[consulta]
+
+
+# ============================================================
+#  Promoción (persistida)
+# ============================================================
+def _cargar(ruta: str = RUTA_VARIANTES) -> dict:
+    if not os.path.exists(ruta):
+        return {}
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ No se pudo leer {ruta}: {e}")
+        return {}
+
+
+def _guardar(datos: dict, ruta: str = RUTA_VARIANTES) -> None:
+    escribir_json_atomico(ruta, datos, indent=2, ensure_ascii=False)
+
+
+def variante_activa(consulta: str, ruta: str = RUTA_VARIANTES) -> str:
+    """Nombre de la variante promovida ("original" si no hay ninguna válida)."""
+    promovida = _cargar(ruta).get(consulta, {}).get("promovida", ORIGINAL)
+    return promovida if promovida in _registro.get(consulta, {}) else ORIGINAL
+
+
+def sql_activa(consulta: str, ruta: str = RUTA_VARIANTES) -> str:
+    return variantes_de(consulta)[variante_activa(consulta, ruta)]
+
+
+# ============================================================
+#  Equivalencia
+# ============================================================
+def _normalizar(df: pd.DataFrame, columnas) -> pd.DataFrame:
+    """Columnas en el orden de la original, valores comparables como texto y filas ordenadas."""
+    df = df[list(columnas)].copy()
+    for col in df.columns:
+        serie = df[col]
+        if serie.dtype == object and serie.map(lambda v: isinstance(v, Decimal)).any():
+            serie = pd.to_numeric(serie, errors="coerce")
+        if pd.api.types.is_float_dtype(serie):
+            serie = serie.round(DECIMALES_COMPARACION)
+        df[col] = serie.map(lambda v: "<NULL>" if v is None or (not isinstance(v, str) and pd.isna(v)) else str(v))
+    return df.sort_values(list(df.columns), kind="mergesort").reset_index(drop=True)
+
+
+def resultados_equivalentes(referencia: pd.DataFrame, candidata: pd.DataFrame) -> Tuple[bool, str]:
+    """(equivalentes, motivo): mismas columnas y mismas filas (sin importar el orden)."""
+    if set(referencia.columns) != set(candidata.columns):
+        faltan = set(referencia.columns) - set(candidata.columns)
+        sobran = set(candidata.columns) - set(referencia.columns)
+        return False, f"columnas distintas (faltan {sorted(faltan)}, sobran {sorted(sobran)})"
+    if len(referencia) != len(candidata):
+        return False, f"filas: {len(referencia)} vs {len(candidata)}"
+
+    a = _normalizar(referencia, referencia.columns)
+    b = _normalizar(candidata, referencia.columns)
+    distintas = (a != b).any(axis=1)
+    if distintas.any():
+        columnas = [c for c in a.columns if (a[c] != b[c]).any()]
+        return False, f"{int(distintas.sum())} filas distintas (columnas: {', '.join(columnas[:5])})"
+    return True, ""
+
+
+# ============================================================
+#  Arnés
+# ============================================================
+def _leer(con, sql: str, params: dict) -> Tuple[pd.DataFrame, float]:
+    t0 = time.perf_counter()
+    resultado = con.execute(text(sql), params)
+    df = pd.DataFrame(resultado.fetchall(), columns=list(resultado.keys()))
+    return df, time.perf_counter() - t0
+
+
+def comparar_variantes(
+    engine,
+    consulta: str,
+    params: Optional[dict] = None,
+    repeticiones: int = 3,
+    set_timezone: Optional[str] = None,
+    promover: bool = True,
+    ruta: str = RUTA_VARIANTES,
+) -> pd.DataFrame:
+    """
+    Ejecuta todas las variantes de `consulta` sobre la misma foto y devuelve una
+    fila por variante: equivalente, motivo, mediana_s, minimo_s, filas.
+    Con promover=True anota la más rápida de las equivalentes en `ruta`.
+    """
+    variantes = variantes_de(consulta)
+    if params is None:
+        params = _parametros[consulta](engine) if consulta in _parametros else {}
+
+    resultados, tiempos = {}, {nombre: [] for nombre in variantes}
+    with engine.connect().execution_options(isolation_level="REPEATABLE READ") as con:
+        fijar_zona_horaria(con, set_timezone)
+        with con.begin():
+            # Toda la comparación en una transacción → misma foto para todas las variantes
+            for vuelta in range(max(1, repeticiones)):
+                nombres = list(variantes)
+                desplazamiento = vuelta % len(nombres)
+                for nombre in nombres[desplazamiento:] + nombres[:desplazamiento]:
+                    df, segundos = _leer(con, variantes[nombre], params)
+                    tiempos[nombre].append(segundos)
+                    if vuelta == 0:
+                        resultados[nombre] = df
+
+    filas = []
+    for nombre in variantes:
+        equivalente, motivo = (
+            (True, "") if nombre == ORIGINAL else resultados_equivalentes(resultados[ORIGINAL], resultados[nombre])
+        )
+        filas.append({
+            "variante": nombre,
+            "equivalente": equivalente,
+            "motivo": motivo,
+            "mediana_s": statistics.median(tiempos[nombre]),
+            "minimo_s": min(tiempos[nombre]),
+            "filas": len(resultados[nombre]),
+        })
+    resumen = pd.DataFrame(filas).sort_values("mediana_s").reset_index(drop=True)
+
+    for fila in resumen.itertuples():
+        marca = "✅" if fila.equivalente else "❌"
+        detalle = "" if fila.equivalente else f" | {fila.motivo}"
+        print(f"⏱️ {consulta}/{fila.variante}: {fila.mediana_s:.2f}s (mediana de {repeticiones}) {marca}{detalle}")
+
+    if promover:
+        mejor = resumen[resumen["equivalente"]].iloc[0]["variante"]
+        datos = _cargar(ruta)
+        datos[consulta] = {
+            "promovida": mejor,
+            "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "repeticiones": repeticiones,
+            "mediana_s": {f.variante: round(f.mediana_s, 4) for f in resumen.itertuples()},
+            "no_equivalentes": {f.variante: f.motivo for f in resumen.itertuples() if not f.equivalente},
+        }
+        _guardar(datos, ruta)
+        print(f"🔁 {consulta}: variante promovida '{mejor}'")
+
+    return resumen
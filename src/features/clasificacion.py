@@ -0,0 +1,105 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+# === Clasificación por tramos de antigüedad (conexión y GPS) ===
+#  - Una tabla de cortes por clasificación: (límite superior INCLUSIVO, etiqueta),
+#    de más reciente a más antiguo; por encima del último corte → "resto";
+#    sin fecha → "sin_dato".
+#  - Python: np.searchsorted sobre la columna entera → Categorical ORDENADO.
+#  - SQL: sql_case() genera el CASE de la consulta desde la MISMA tabla
+#    (consulta_06), así Python y SQL no pueden separarse.
+
+CLASIFICACIONES = {
+    # Desde `ultimo_mensaje_recibido`
+    "clasificacion_conexion": {
+        "columna": "ultimo_mensaje_recibido",
+        "tramos": [
+            (timedelta(days=1), "Conectado hoy"),
+            (timedelta(days=2), "Conexión 24-48h"),
+            (timedelta(days=3), "Conexión 48-72h"),
+            (timedelta(days=7), "Conexión 3-7 días"),
+            (timedelta(days=15), "Conexión 7-15 días"),
+            (timedelta(days=30), "Conexión 15 días - 1 mes"),
+            (timedelta(days=90), "Conexión 1-3 meses"),
+        ],
+        "resto": "Conexión >3 meses",
+        "sin_dato": "Conexión >3 meses",
+    },
+    # Desde `ultima_posicion_gps_valida`
+    "clasificacion_gps": {
+        "columna": "ultima_posicion_gps_valida",
+        "tramos": [
+            (timedelta(hours=24), "GPS activo hoy"),
+            (timedelta(hours=48), "GPS 24-48h"),
+            (timedelta(hours=72), "GPS 48-72h"),
+            (timedelta(hours=168), "GPS 3-7 días"),
+            (timedelta(hours=360), "GPS 7-15 días"),
+            (timedelta(hours=720), "GPS 15 días - 1 mes"),
+            (timedelta(hours=2160), "GPS 1-3 meses"),
+        ],
+        "resto": "GPS >3 meses",
+        "sin_dato": "Sin posición GPS válida",
+    },
+}
+
+
+def categorias(nombre: str) -> list:
+    """Etiquetas de `nombre` en orden (más reciente → más antiguo → sin dato)."""
+    definicion = CLASIFICACIONES[nombre]
+    etiquetas = [etiqueta for _, etiqueta in definicion["tramos"]] + [definicion["resto"], definicion["sin_dato"]]
+    return list(dict.fromkeys(etiquetas))
+
+
+def como_categoria(serie: pd.Series, nombre: str) -> pd.Series:
+    """Convierte etiquetas ya calculadas (p. ej. por el SQL) al Categorical ordenado de `nombre`."""
+    return pd.Series(pd.Categorical(serie, categories=categorias(nombre), ordered=True), index=serie.index)
+
+
+def clasificar(fechas: pd.Series, nombre: str, ahora: pd.Timestamp) -> pd.Series:
+    """Clasificación vectorizada de `fechas` (UTC tz-aware) según la tabla `nombre`."""
+    definicion = CLASIFICACIONES[nombre]
+    limites = np.array([pd.Timedelta(limite).value for limite, _ in definicion["tramos"]], dtype=np.int64)
+    etiquetas = np.array([etiqueta for _, etiqueta in definicion["tramos"]] + [definicion["resto"]], dtype=object)
+
+    antiguedad = ahora - pd.to_datetime(fechas, errors="coerce", utc=True)
+    sin_dato = antiguedad.isna().to_numpy()
+    # Primer tramo cuyo límite (inclusivo) alcanza la antigüedad; más allá del último → resto
+    indice = np.searchsorted(limites, antiguedad.to_numpy(dtype="timedelta64[ns]").astype(np.int64), side="left")
+    valores = np.where(sin_dato, definicion["sin_dato"], etiquetas[indice])
+    return como_categoria(pd.Series(valores, index=fechas.index), nombre)
+
+
+def anadir_clasificaciones(df: pd.DataFrame, ahora: pd.Timestamp = None) -> pd.DataFrame:
+    """Añade todas las columnas de CLASIFICACIONES (sin fecha de origen → "sin_dato")."""
+    ahora = ahora if ahora is not None else pd.Timestamp.now(tz="UTC")
+    for nombre, definicion in CLASIFICACIONES.items():
+        if definicion["columna"] in df.columns:
+            df[nombre] = clasificar(df[definicion["columna"]], nombre, ahora)
+        else:
+            df[nombre] = como_categoria(pd.Series(definicion["sin_dato"], index=df.index), nombre)
+    return df
+
+
+def _intervalo_sql(limite: timedelta) -> str:
+    segundos = int(limite.total_seconds())
+    if segundos % 86400 == 0:
+        dias = segundos // 86400
+        return f"INTERVAL '{dias} day{'s' if dias != 1 else ''}'"
+    if segundos % 3600 == 0:
+        return f"INTERVAL '{segundos // 3600} hours'"
+    return f"INTERVAL '{segundos} seconds'"
+
+
+def sql_case(nombre: str, columna_sql: str, ahora_sql: str = "NOW()") -> str:
+    """CASE equivalente a clasificar() para usar en el SELECT de una consulta."""
+    definicion = CLASIFICACIONES[nombre]
+    lineas = ["CASE"]
+    if definicion["sin_dato"] != definicion["resto"]:
+        lineas.append(f"    WHEN {columna_sql} IS NULL THEN '{definicion['sin_dato']}'")
+    for limite, etiqueta in definicion["tramos"]:
+        lineas.append(f"    WHEN {columna_sql} >= {ahora_sql} - {_intervalo_sql(limite)} THEN '{etiqueta}'")
+    lineas.append(f"    ELSE '{definicion['resto']}'")
+    lineas.append("  END")
+    return "\n".join(lineas)
@@ -1,125 +1,86 @@
 import pandas as pd
-from shapely import wkb
-from shapely.errors import WKBReadingError
-
-# === Función auxiliar para extraer lat/lon de WKB ===
-def extraer_coords(geom_str):
-    try:
-        geom = wkb.loads(bytes.fromhex(geom_str))
-        # Devolvemos en orden lon, lat
-        return pd.Series([geom.x, geom.y], index=["lon", "lat"])
-    except (WKBReadingError, TypeError, ValueError, AttributeError):
-        return pd.Series([None, None], index=["lon", "lat"])
+
+from src.features.clasificacion import anadir_clasificaciones
+from src.features.geometria import anadir_lon_lat
+from src.features.pipeline import ejecutar_pipeline, registrar_feature
+
+# Nombre del pipeline de features de esta consulta (ver src.features.pipeline)
+PIPELINE = "consulta_01"
+
+COLUMNAS_FECHA = ["ultimo_mensaje_recibido", "ultima_posicion_gps_valida", "visto_ultima_vez"]
+COLUMNAS_CONTEO = ["mensajes_recibidos", "mensajes_sin_gps", "mensajes_esperados"]
+# pct -> (numerador, denominador)
+KPIS_RECEPCION = {
+    "pct_recibidos_vs_esperados": ("mensajes_recibidos", "mensajes_esperados"),
+    "pct_sin_gps_vs_esperados": ("mensajes_sin_gps", "mensajes_esperados"),
+    "pct_sin_gps_recibidos": ("mensajes_sin_gps", "mensajes_recibidos"),
+}
+
+
+# ======== Fechas -> UTC tz-aware ========
+def _fechas_utc(df: pd.DataFrame) -> pd.DataFrame:
+    for col in df.columns:
+        df[col] = pd.to_datetime(df[col], errors="coerce", utc=True)
+    return df
+
+
+# ======== Forzar NaNs a 0 en métricas de conteo ========
+def _contadores(df: pd.DataFrame) -> pd.DataFrame:
+    for col in df.columns:
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+    return df
+
+
+# ======== KPIs derivados (con guardas /0; no se recalculan si ya vienen) ========
+def _kpis_recepcion(df: pd.DataFrame) -> pd.DataFrame:
+    for pct, (num, den) in KPIS_RECEPCION.items():
+        if pct not in df.columns and {num, den}.issubset(df.columns):
+            df[pct] = (df[num] / df[den].where(df[den] != 0)).astype(float)
+    return df
+
+
+# ======== Clasificaciones CONEXIÓN y GPS (vectorizadas) ========
+#  Tramos en src.features.clasificacion.CLASIFICACIONES (los mismos que el CASE de consulta_06):
+#  conexión desde `ultimo_mensaje_recibido` (<=1d, 2d, 3d, 7d, 15d, 30d, 90d; >90d/NaT -> >3 meses),
+#  GPS desde `ultima_posicion_gps_valida` (<=24h, ..., 2160h; NaT -> Sin posición GPS válida).
+def _clasificaciones(df: pd.DataFrame) -> pd.DataFrame:
+    return anadir_clasificaciones(df, pd.Timestamp.now(tz="UTC"))
+
+
+# ======== Extraer lon/lat (columna entera de una vez) si no existen ========
+def _lon_lat(df: pd.DataFrame) -> pd.DataFrame:
+    if "lon" not in df.columns or "lat" not in df.columns:
+        df = anadir_lon_lat(df)
+    return df
+
+
+registrar_feature(PIPELINE, "fechas_utc", _fechas_utc, COLUMNAS_FECHA, COLUMNAS_FECHA)
+registrar_feature(PIPELINE, "contadores", _contadores, COLUMNAS_CONTEO, COLUMNAS_CONTEO)
+registrar_feature(
+    PIPELINE, "kpis_recepcion", _kpis_recepcion,
+    COLUMNAS_CONTEO + list(KPIS_RECEPCION), list(KPIS_RECEPCION),
+)
+# Depende del reloj (antigüedad respecto a ahora): nunca desde caché
+registrar_feature(
+    PIPELINE, "clasificaciones", _clasificaciones,
+    ["ultimo_mensaje_recibido", "ultima_posicion_gps_valida"], ["clasificacion_conexion", "clasificacion_gps"],
+    cacheable=False,
+)
+registrar_feature(
+    PIPELINE, "lon_lat", _lon_lat,
+    ["ultima_posicion_geom", "ultima_posicion_lon", "ultima_posicion_lat", "lon", "lat"], ["lon", "lat"],
+)
+
 
 # === Función principal de enriquecimiento ===
 def aplicar_clasificaciones_temporales(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Enriquecimiento:
+    Enriquecimiento (todas las features de PIPELINE, sin caché):
     - KPIs básicos de recepción (con guardas /0).
     - Fechas a UTC tz-aware.
     - Clasificación de conexión desde `ultimo_mensaje_recibido` (alineado con el SQL).
     - Clasificación GPS desde `ultima_posicion_gps_valida`.
-    - Extracción lon/lat desde WKB si procede.
+    - Extracción lon/lat desde WKB (vectorizada) o tal cual si la consulta ya los trae.
     """
-    df = df.copy()
-
-    # ======== Fechas -> UTC tz-aware ========
-    dt_cols = ["ultimo_mensaje_recibido", "ultima_posicion_gps_valida", "visto_ultima_vez"]
-    for col in dt_cols:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors="coerce", utc=True)
-
-    ahora_utc = pd.Timestamp.now(tz="UTC")
-
-    # ======== Forzar NaNs a 0 en métricas de conteo ========
-    for col in ["mensajes_recibidos", "mensajes_sin_gps", "mensajes_esperados"]:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
-
-    # ======== KPIs derivados (con guardas /0) ========
-    if (
-        "pct_recibidos_vs_esperados" not in df.columns
-        and {"mensajes_recibidos", "mensajes_esperados"}.issubset(df.columns)
-    ):
-        den = df["mensajes_esperados"].replace(0, pd.NA)
-        df["pct_recibidos_vs_esperados"] = (df["mensajes_recibidos"] / den).astype(float)
-
-    if (
-        "pct_sin_gps_vs_esperados" not in df.columns
-        and {"mensajes_sin_gps", "mensajes_esperados"}.issubset(df.columns)
-    ):
-        den = df["mensajes_esperados"].replace(0, pd.NA)
-        df["pct_sin_gps_vs_esperados"] = (df["mensajes_sin_gps"] / den).astype(float)
-
-    if (
-        "pct_sin_gps_recibidos" not in df.columns
-        and {"mensajes_sin_gps", "mensajes_recibidos"}.issubset(df.columns)
-    ):
-        den = df["mensajes_recibidos"].replace(0, pd.NA)
-        df["pct_sin_gps_recibidos"] = (df["mensajes_sin_gps"] / den).astype(float)
-
-    # ======== Clasificación CONEXIÓN (desde último mensaje) ========
-    #  <=1d  -> Conectado hoy
-    #  <=2d  -> Conexión 24-48h
-    #  <=3d  -> Conexión 48-72h
-    #  <=7d  -> Conexión 3-7 días
-    #  <=15d -> Conexión 7-15 días
-    #  <=30d -> Conexión 15 días - 1 mes
-    #  <=90d -> Conexión 1-3 meses
-    #  >90d/NaT -> Conexión >3 meses
-    def clasif_conexion_from_ts(ts: pd.Timestamp) -> str:
-        if pd.isna(ts):
-            return "Conexión >3 meses"
-        delta = ahora_utc - ts
-        if delta <= pd.Timedelta(days=1):
-            return "Conectado hoy"
-        if delta <= pd.Timedelta(days=2):
-            return "Conexión 24-48h"
-        if delta <= pd.Timedelta(days=3):
-            return "Conexión 48-72h"
-        if delta <= pd.Timedelta(days=7):
-            return "Conexión 3-7 días"
-        if delta <= pd.Timedelta(days=15):
-            return "Conexión 7-15 días"
-        if delta <= pd.Timedelta(days=30):
-            return "Conexión 15 días - 1 mes"
-        if delta <= pd.Timedelta(days=90):
-            return "Conexión 1-3 meses"
-        return "Conexión >3 meses"
-
-    if "ultimo_mensaje_recibido" in df.columns:
-        df["clasificacion_conexion"] = df["ultimo_mensaje_recibido"].apply(clasif_conexion_from_ts)
-    else:
-        df["clasificacion_conexion"] = "Conexión >3 meses"
-
-    # ======== Clasificación GPS (desde última posición GPS válida) ========
-    def clasif_gps_from_hours(horas):
-        if pd.isna(horas):
-            return "Sin posición GPS válida"
-        if horas <= 24:
-            return "GPS activo hoy"
-        if horas <= 48:
-            return "GPS 24-48h"
-        if horas <= 72:
-            return "GPS 48-72h"
-        if horas <= 168:
-            return "GPS 3-7 días"
-        if horas <= 360:
-            return "GPS 7-15 días"
-        if horas <= 720:
-            return "GPS 15 días - 1 mes"
-        if horas <= 2160:
-            return "GPS 1-3 meses"
-        return "GPS >3 meses"
-
-    if "ultima_posicion_gps_valida" in df.columns:
-        horas_gps = (ahora_utc - df["ultima_posicion_gps_valida"]).dt.total_seconds() / 3600
-        df["clasificacion_gps"] = pd.Series(horas_gps, index=df.index).apply(clasif_gps_from_hours)
-    else:
-        df["clasificacion_gps"] = "Sin posición GPS válida"
-
-    # ======== Extraer lon/lat desde WKB si no existen ========
-    if "ultima_posicion_geom" in df.columns and ("lon" not in df.columns or "lat" not in df.columns):
-        df[["lon", "lat"]] = df["ultima_posicion_geom"].apply(extraer_coords)
-
+    df, _ = ejecutar_pipeline(df, PIPELINE, usar_cache=False)
     return df
@@ -1,14 +1,6 @@
 import pandas as pd
-from shapely import wkb
-from shapely.errors import WKBReadingError
 
-# === Función auxiliar para extraer lat/lon de WKB ===
-def extraer_coords(geom_str):
-    try:
-        geom = wkb.loads(bytes.fromhex(geom_str))
-        return pd.Series([geom.x, geom.y])
-    except (WKBReadingError, TypeError, ValueError):
-        return pd.Series([None, None])
+from src.features.geometria import anadir_lon_lat
 
 # === Función principal de enriquecimiento ===
 def aplicar_clasificaciones_temporales(df):
@@ -90,8 +82,8 @@ def aplicar_clasificaciones_temporales(df):
         axis=1
     )
 
-    # Extraer lat/lon si existe geometría en formato WKB
-    if "ultima_posicion_geom" in df.columns and "lon" not in df.columns and "lat" not in df.columns:
-        df[["lon", "lat"]] = df["ultima_posicion_geom"].apply(extraer_coords)
+    # Extraer lat/lon (vectorizado) si existe geometría WKB o lon/lat del servidor
+    if "lon" not in df.columns and "lat" not in df.columns:
+        df = anadir_lon_lat(df)
 
     return df
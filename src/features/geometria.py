@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import shapely
+
+# === Decodificación vectorizada de geometrías WKB (hex) ===
+#  - shapely 2: from_wkb sobre la columna entera + get_x/get_y → arrays float64.
+#  - Nulos, WKB inválido, puntos vacíos o geometrías que no son punto → NaN (sin excepciones por fila).
+#  - Si la consulta ya trae lon/lat (caché de último estado o ST_X/ST_Y), se usan tal cual.
+
+
+def coords_desde_wkb(serie: pd.Series):
+    """Devuelve (lon, lat) como arrays float64 alineados con `serie` (WKB en hex o bytes)."""
+    valores = pd.Series(serie, copy=False).astype(object)
+    valores = valores.where(valores.notna(), None).to_numpy()
+    geoms = shapely.from_wkb(valores, on_invalid="ignore")
+    geoms[shapely.is_empty(geoms)] = None  # get_x/get_y fallan con POINT EMPTY
+    return shapely.get_x(geoms), shapely.get_y(geoms)
+
+
+def anadir_lon_lat(
+    df: pd.DataFrame,
+    columna_geom: str = "ultima_posicion_geom",
+    prefijo_servidor: str = "ultima_posicion_",
+) -> pd.DataFrame:
+    """
+    Añade columnas `lon` y `lat`:
+    - desde `<prefijo_servidor>lon/lat` si la consulta ya las calculó en el servidor;
+    - si no, decodificando `columna_geom` en una sola llamada.
+    """
+    col_lon, col_lat = f"{prefijo_servidor}lon", f"{prefijo_servidor}lat"
+    if col_lon in df.columns and col_lat in df.columns:
+        df["lon"] = pd.to_numeric(df[col_lon], errors="coerce").astype(np.float64)
+        df["lat"] = pd.to_numeric(df[col_lat], errors="coerce").astype(np.float64)
+    elif columna_geom in df.columns:
+        df["lon"], df["lat"] = coords_desde_wkb(df[columna_geom])
+    return df
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Registro de features con dependencias entre columnas
+
+- Cada feature declara las columnas que lee (`entradas`) y las que escribe
+  (`salidas`) y recibe SOLO esas entradas (copia); devuelve un DataFrame con sus
+  salidas, alineado con el índice. Una columna puede ser entrada y salida de la
+  misma feature (p. ej. normalizar fechas); dos features no pueden escribir la
+  misma columna.
+- ejecutar_pipeline() ordena las features por niveles (B depende de A si lee
+  algo que A escribe) y lanza en paralelo las de un mismo nivel.
+- Caché (data/cache/features/<pipeline>/): si la huella de las entradas (valores,
+  índice, dtypes) y del código de la feature coincide con la de la ejecución
+  anterior, se reutilizan sus salidas sin recalcular. Las features que dependen
+  del reloj (cacheable=False) se calculan siempre.
+- Un error en una feature no para el resto (solo se avisa); las que dependen
+  de ella se ejecutan con las columnas que haya.
+- Devuelve también el tiempo de cada feature (y si vino de caché).
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from src.almacen.escritura import escribir_atomico, escribir_json_atomico
+
+RUTA_CACHE_FEATURES = os.path.join("data", "cache", "features")
+
+# pipeline -> nombre de feature -> definición
+_registro: Dict[str, Dict[str, dict]] = {}
+
+
+def registrar_feature(
+    pipeline: str,
+    nombre: str,
+    funcion: Callable[[pd.DataFrame], pd.DataFrame],
+    entradas: List[str],
+    salidas: List[str],
+    cacheable: bool = True,
+) -> None:
+    """Añade (o sustituye) la feature `nombre` al `pipeline`."""
+    features = _registro.setdefault(pipeline, {})
+    for otro, definicion in features.items():
+        repetidas = set(salidas) & set(definicion["salidas"])
+        if otro != nombre and repetidas:
+            raise ValueError(f"{pipeline}: {nombre} y {otro} escriben las mismas columnas {sorted(repetidas)}")
+    features[nombre] = {
+        "funcion": funcion,
+        "entradas": list(entradas),
+        "salidas": list(salidas),
+        "cacheable": cacheable,
+    }
+
+
+def features_de(pipeline: str) -> Dict[str, dict]:
+    return _registro.get(pipeline, {})
+
+
+def niveles(pipeline: str) -> List[List[str]]:
+    """Features agrupadas por niveles: cada una solo depende de niveles anteriores."""
+    features = features_de(pipeline)
+    productor = {col: nombre for nombre, f in features.items() for col in f["salidas"]}
+    dependencias = {
+        nombre: {productor[col] for col in f["entradas"] if col in productor and productor[col] != nombre}
+        for nombre, f in features.items()
+    }
+
+    resultado, hechas = [], set()
+    while len(hechas) < len(features):
+        nivel = sorted(n for n, deps in dependencias.items() if n not in hechas and deps <= hechas)
+        if not nivel:
+            pendientes = sorted(set(features) - hechas)
+            raise ValueError(f"{pipeline}: dependencia circular entre {pendientes}")
+        resultado.append(nivel)
+        hechas.update(nivel)
+    return resultado
+
+
+# ============================================================
+#  Caché
+# ============================================================
+def _huella(entradas: pd.DataFrame, funcion: Callable) -> Optional[str]:
+    """Huella de las entradas + el código de la feature (None si no se puede calcular)."""
+    try:
+        h = hashlib.sha1()
+        h.update(json.dumps([list(entradas.columns), [str(t) for t in entradas.dtypes]]).encode())
+        h.update(pd.util.hash_pandas_object(entradas, index=True).to_numpy().tobytes())
+        try:
+            h.update(inspect.getsource(funcion).encode())
+        except (OSError, TypeError):
+            h.update(funcion.__qualname__.encode())
+        return h.hexdigest()
+    except Exception:
+        return None
+
+
+def _rutas(pipeline: str, nombre: str, raiz: str) -> Tuple[str, str]:
+    carpeta = os.path.join(raiz, pipeline)
+    return os.path.join(carpeta, f"{nombre}.json"), os.path.join(carpeta, f"{nombre}.parquet")
+
+
+def _leer_cache(pipeline: str, nombre: str, huella: str, raiz: str) -> Optional[pd.DataFrame]:
+    ruta_meta, ruta_datos = _rutas(pipeline, nombre, raiz)
+    try:
+        with open(ruta_meta, "r", encoding="utf-8") as f:
+            if json.load(f).get("huella") != huella:
+                return None
+        return pd.read_parquet(ruta_datos)
+    except Exception:
+        return None
+
+
+def _guardar_cache(pipeline: str, nombre: str, huella: str, salidas: pd.DataFrame, raiz: str) -> None:
+    ruta_meta, ruta_datos = _rutas(pipeline, nombre, raiz)
+    try:
+        # Datos antes que la huella: con la huella nueva y los datos viejos se recalcularía igual
+        escribir_atomico(ruta_datos, salidas.to_parquet)
+        escribir_json_atomico(ruta_meta, {"huella": huella, "filas": len(salidas)})
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar en caché la feature {nombre}: {e}")
+
+
+# ============================================================
+#  Ejecución
+# ============================================================
+def _ejecutar_feature(pipeline: str, nombre: str, definicion: dict, entradas: pd.DataFrame, usar_cache: bool, raiz: str) -> dict:
+    t0 = time.perf_counter()
+    huella = _huella(entradas, definicion["funcion"]) if usar_cache and definicion["cacheable"] else None
+    if huella:
+        salidas = _leer_cache(pipeline, nombre, huella, raiz)
+        if salidas is not None:
+            return {"feature": nombre, "salidas": salidas, "segundos": time.perf_counter() - t0, "cache": True, "error": None}
+
+    try:
+        salidas = definicion["funcion"](entradas)
+        salidas = salidas[[c for c in definicion["salidas"] if c in salidas.columns]]
+    except Exception as e:
+        return {"feature": nombre, "salidas": None, "segundos": time.perf_counter() - t0, "cache": False, "error": str(e)}
+
+    if huella:
+        _guardar_cache(pipeline, nombre, huella, salidas, raiz)
+    return {"feature": nombre, "salidas": salidas, "segundos": time.perf_counter() - t0, "cache": False, "error": None}
+
+
+def ejecutar_pipeline(
+    df: pd.DataFrame,
+    pipeline: str,
+    usar_cache: bool = True,
+    max_workers: Optional[int] = None,
+    raiz: str = RUTA_CACHE_FEATURES,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Aplica las features de `pipeline` a `df` (no lo modifica).
+    Devuelve (df enriquecido, informe con segundos/caché/error por feature).
+    """
+    df = df.copy()
+    features = features_de(pipeline)
+    informe = []
+    t0 = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="feature") as pool:
+        for nivel in niveles(pipeline):
+            futuros = []
+            for nombre in nivel:
+                definicion = features[nombre]
+                columnas = [c for c in definicion["entradas"] if c in df.columns]
+                futuros.append(pool.submit(
+                    _ejecutar_feature, pipeline, nombre, definicion, df[columnas].copy(), usar_cache, raiz
+                ))
+
+            for futuro in futuros:
+                r = futuro.result()
+                if r["error"] is not None:
+                    print(f"    ⚠️ Error en `{r['feature']}`: {r['error']}")
+                else:
+                    for col in r["salidas"].columns:
+                        df[col] = r["salidas"][col]
+                origen = " (caché)" if r["cache"] else ""
+                print(f"  ⏱️ {r['feature']}: {r['segundos']:.3f}s{origen}")
+                informe.append({k: r[k] for k in ("feature", "segundos", "cache", "error")})
+
+    informe = pd.DataFrame(informe, columns=["feature", "segundos", "cache", "error"])
+    aplicadas = int(informe["error"].isna().sum())
+    print(f"✅ {pipeline}: {aplicadas}/{len(features)} features en {time.perf_counter() - t0:.2f}s")
+    return df, informe
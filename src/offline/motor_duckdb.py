@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Motor analítico local: el SQL de las consultas sobre una instantánea en Parquet con DuckDB
+
+- extraer_instantanea(): baja UNA vez de la réplica las tablas pequeñas (Devices,
+  Animals, Ranches, Customers, LoraGateways, RanchesLoraGateways), un extracto
+  de DeviceLocations acotado a los últimos `dias` y el último estado por
+  dispositivo (cache.ultimo_estado) a data/offline/<AAAA-mm-dd_HH-MM>/.
+- ejecutar_local() / ejecutar_consulta_local(): lanzan el SQL de la consulta (o
+  una versión retocada: otros umbrales, otras ventanas) con DuckDB sobre esos
+  Parquet. Repetir un análisis cuesta segundos y no toca la réplica.
+- adaptar_sql() traduce lo poco que DuckDB no entiende igual que Postgres:
+    · NOW() → instante de la extracción (resultados reproducibles),
+    · :param → $param,
+    · gps_stats_full desde ultimo_estado.parquet (en vez de los arrays UNNEST),
+    · ST_X/ST_Y(... ::geometry) → funciones locales sobre el WKB (shapely),
+    · make_interval(days => n) → to_days(n).
+  El resto (FILTER, DISTINCT ON, DATE_TRUNC, AT TIME ZONE, ...) es compatible.
+
+Requiere `duckdb` (opcional: solo para este modo offline).
+
+Uso:
+    ruta = extraer_instantanea(engine, dias=35)
+    df = ejecutar_consulta_local("consulta_06", dias_ventana=5)
+    df = ejecutar_consulta_local("consulta_07", ventanas={"14d": timedelta(days=14)})
+"""
+
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy import text
+
+from src.almacen.escritura import escribir_atomico
+from src.cache.ultimo_estado import SQL_GPS_STATS_FULL, SQL_GPS_STATS_FULL_XY, actualizar_ultimo_estado
+from src.features.geometria import coords_desde_wkb
+
+RUTA_OFFLINE = os.path.join("data", "offline")
+FICHERO_INSTANTANEA = "instantanea.json"
+
+# =========================
+#  Tablas de la instantánea (solo las columnas que usan las consultas;
+#  enums y geometrías como texto)
+# =========================
+TABLAS: Dict[str, str] = {
+    "Devices": """
+SELECT "Id", "SerialNumber", "Model"::text AS "Model", "RanchId", "UplinksPerDay",
+       "Disabled", "StatusType"::text AS "StatusType", "IgnoreStatisticsUntil",
+       "LastSeenOn", "ResetsCount", "AverageGpsTtf", "BatteryEstimation",
+       "ChangedBatteryOn", "SumUplinksCount"
+FROM "Devices";
+""",
+    "Animals": """
+SELECT "DeviceId", "Name", "Specie"::text AS "Specie", "IsDeregistered"
+FROM "Animals"
+WHERE "DeviceId" IS NOT NULL;
+""",
+    "Ranches": """
+SELECT "Id", "Name", "CustomerId", "Country", "Region"
+FROM "Ranches";
+""",
+    "Customers": """
+SELECT "Id", "Name", "Status"::text AS "Status"
+FROM "Customers";
+""",
+    "LoraGateways": """
+SELECT "Id", "Name", "SerialNumber", "LastSeenAt", "CreatedAt", "Location"
+FROM "LoraGateways";
+""",
+    "RanchesLoraGateways": """
+SELECT "RanchId", "GatewayId"
+FROM "RanchesLoraGateways";
+""",
+}
+
+SQL_DEVICE_LOCATIONS = text("""
+SELECT "DeviceId", "Time", "HasLocation", "IsValid", "IsLowAccuracy",
+       "InvalidReason"::text AS "InvalidReason", "Location"
+FROM "DeviceLocations"
+WHERE "Time" >= CAST(:desde AS timestamptz)
+  AND "Time" <  CAST(:hasta AS timestamptz);
+""")
+
+# gps_stats_full desde el Parquet del último estado (columnas de las dos variantes del CTE;
+# lon/lat desde el WKB para instantáneas guardadas antes de que la caché los tuviera)
+SQL_GPS_STATS_FULL_LOCAL = """gps_stats_full AS (
+  SELECT
+    device_id                  AS "DeviceId",
+    ultimo_mensaje_recibido,
+    ultima_posicion_gps_valida,
+    ultima_posicion_geom,
+    wkb_x(ultima_posicion_geom) AS ultima_posicion_lon,
+    wkb_y(ultima_posicion_geom) AS ultima_posicion_lat
+  FROM ultimo_estado
+)"""
+
+
+def _duckdb():
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError("El modo offline necesita duckdb (pip install duckdb)") from e
+    return duckdb
+
+
+# ============================================================
+#  Extracción (una vez, desde la réplica)
+# ============================================================
+def _a_parquet(df: pd.DataFrame, ruta: str) -> None:
+    escribir_atomico(ruta, lambda tmp: df.to_parquet(tmp, index=False))
+
+
+def extraer_instantanea(engine, dias: int = 35, raiz: str = RUTA_OFFLINE) -> str:
+    """
+    Baja las tablas + `dias` de DeviceLocations + el último estado a una carpeta nueva.
+    Devuelve la ruta de la instantánea.
+    """
+    hasta = datetime.now(timezone.utc).replace(microsecond=0)
+    desde = hasta - timedelta(days=dias)
+    ruta = os.path.join(raiz, hasta.strftime("%Y-%m-%d_%H-%M"))
+    os.makedirs(ruta, exist_ok=True)
+
+    filas = {}
+    with engine.connect() as con:
+        for tabla, sql in TABLAS.items():
+            df = pd.read_sql_query(text(sql), con)
+            _a_parquet(df, os.path.join(ruta, f"{tabla}.parquet"))
+            filas[tabla] = len(df)
+        df = pd.read_sql_query(SQL_DEVICE_LOCATIONS, con, params={"desde": desde, "hasta": hasta})
+        _a_parquet(df, os.path.join(ruta, "DeviceLocations.parquet"))
+        filas["DeviceLocations"] = len(df)
+
+    estado = actualizar_ultimo_estado(engine)
+    _a_parquet(estado, os.path.join(ruta, "ultimo_estado.parquet"))
+    filas["ultimo_estado"] = len(estado)
+
+    with open(os.path.join(ruta, FICHERO_INSTANTANEA), "w", encoding="utf-8") as f:
+        json.dump({"desde": desde.isoformat(), "hasta": hasta.isoformat(), "dias": dias, "filas": filas}, f, indent=2)
+
+    print(f"📁 Instantánea offline en {ruta} | DeviceLocations: {filas['DeviceLocations']} filas ({dias} días)")
+    return ruta
+
+
+def ultima_instantanea(raiz: str = RUTA_OFFLINE) -> str:
+    """Carpeta de la instantánea más reciente (las carpetas se nombran por fecha)."""
+    carpetas = sorted(
+        d for d in (os.listdir(raiz) if os.path.isdir(raiz) else [])
+        if os.path.exists(os.path.join(raiz, d, FICHERO_INSTANTANEA))
+    )
+    if not carpetas:
+        raise FileNotFoundError(f"No hay instantáneas offline en {raiz} (ver extraer_instantanea)")
+    return os.path.join(raiz, carpetas[-1])
+
+
+def leer_metadatos(ruta: str) -> dict:
+    with open(os.path.join(ruta, FICHERO_INSTANTANEA), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ============================================================
+#  Dialecto
+# ============================================================
+_PATRON_NOW = re.compile(r"\bNOW\(\)", re.IGNORECASE)
+_PATRON_PARAM = re.compile(r"(?<![:\w]):(\w+)")
+_PATRON_ST_CAST = re.compile(r"ST_([XY])\(\s*CAST\((.+?) AS geometry\)\s*\)")
+_PATRON_ST_DOS_PUNTOS = re.compile(r"ST_([XY])\(\s*([\w.\"]+)::geometry\s*\)")
+_PATRON_MAKE_INTERVAL = re.compile(r"make_interval\(\s*days\s*=>\s*([^()]+?)\s*\)")
+
+
+def adaptar_sql(sql: str, hasta: str) -> str:
+    """SQL de Postgres → DuckDB sobre la instantánea (`hasta`: instante de la extracción, ISO)."""
+    sql = sql.text if hasattr(sql, "text") else sql
+    sql = sql.replace(SQL_GPS_STATS_FULL, SQL_GPS_STATS_FULL_LOCAL).replace(SQL_GPS_STATS_FULL_XY, SQL_GPS_STATS_FULL_LOCAL)
+    sql = _PATRON_NOW.sub(f"CAST('{hasta}' AS TIMESTAMPTZ)", sql)
+    sql = _PATRON_ST_CAST.sub(lambda m: f"wkb_{m.group(1).lower()}({m.group(2)})", sql)
+    sql = _PATRON_ST_DOS_PUNTOS.sub(lambda m: f"wkb_{m.group(1).lower()}({m.group(2)})", sql)
+    sql = _PATRON_MAKE_INTERVAL.sub(r"to_days(CAST(\1 AS INTEGER))", sql)
+    return _PATRON_PARAM.sub(r"$\1", sql)
+
+
+def _wkb_coordenada(indice: int):
+    def _f(valores: pa.Array) -> pa.Array:
+        coords = coords_desde_wkb(valores.to_pandas())[indice]
+        return pa.array(coords, type=pa.float64(), from_pandas=True)  # NaN → NULL
+    return _f
+
+
+# ============================================================
+#  Ejecución local
+# ============================================================
+def conectar(ruta: Optional[str] = None, set_timezone: str = "Europe/Madrid"):
+    """Conexión DuckDB en memoria con una vista por tabla de la instantánea."""
+    duckdb = _duckdb()
+    ruta = ruta or ultima_instantanea()
+    con = duckdb.connect()
+    con.execute(f"SET TimeZone = '{set_timezone}'")
+    for fichero in sorted(os.listdir(ruta)):
+        if fichero.endswith(".parquet"):
+            tabla = fichero[: -len(".parquet")]
+            destino = os.path.join(ruta, fichero).replace("'", "''")
+            con.execute(f"CREATE VIEW \"{tabla}\" AS SELECT * FROM read_parquet('{destino}')")
+    for eje, indice in (("x", 0), ("y", 1)):
+        con.create_function(f"wkb_{eje}", _wkb_coordenada(indice), ["VARCHAR"], "DOUBLE", type="arrow", null_handling="special")
+    return con
+
+
+def ejecutar_local(
+    sql,
+    params: Optional[dict] = None,
+    ruta: Optional[str] = None,
+    set_timezone: str = "Europe/Madrid",
+) -> pd.DataFrame:
+    """Lanza `sql` (dialecto de las consultas, con :parametros) sobre la instantánea."""
+    ruta = ruta or ultima_instantanea()
+    sql_local = adaptar_sql(sql, leer_metadatos(ruta)["hasta"])
+    # Solo los parámetros que aparecen en el SQL (DuckDB rechaza los sobrantes)
+    usados = set(re.findall(r"\$(\w+)", sql_local))
+    params = {k: v for k, v in (params or {}).items() if k in usados}
+
+    con = conectar(ruta, set_timezone)
+    try:
+        return con.execute(sql_local, params).df()
+    finally:
+        con.close()
+
+
+def ejecutar_consulta_local(nombre: str, ruta: Optional[str] = None, **opciones) -> pd.DataFrame:
+    """
+    Consulta del repo sobre la instantánea, con sus mismos parámetros:
+      consulta_01 / consulta_02 / consulta_06 (dias_ventana) / consulta_07 (ventanas).
+    """
+    if nombre == "consulta_01":
+        from scripts.consultas.consulta_01 import query as sql
+        params, zona = {}, "UTC"
+    elif nombre == "consulta_02":
+        from scripts.consultas.consulta_02 import query as sql
+        params, zona = {}, "Europe/Madrid"
+    elif nombre == "consulta_06":
+        from scripts.consultas.consulta_06 import query as sql
+        params, zona = {"dias_ventana": int(opciones.get("dias_ventana", 3))}, "Europe/Madrid"
+    elif nombre == "consulta_07":
+        from scripts.consultas.consulta_07 import construir_query, parametros
+        ventanas = opciones.get("ventanas")
+        sql, params, zona = construir_query(ventanas), parametros(ventanas), "Europe/Madrid"
+    else:
+        raise ValueError(f"Consulta sin modo offline: {nombre}")
+
+    ruta = ruta or ultima_instantanea()
+    ventana_max = params.get("ventana_max")
+    if ventana_max is not None and ventana_max > timedelta(days=leer_metadatos(ruta)["dias"]):
+        print(f"⚠️ La ventana {ventana_max} supera los {leer_metadatos(ruta)['dias']} días de DeviceLocations de la instantánea")
+    df = ejecutar_local(sql, params, ruta, opciones.get("set_timezone", zona))
+    print(f"✅ Consulta {nombre} (offline, {os.path.basename(ruta)}). Filas: {len(df)} | Columnas: {len(df.columns)}")
+    return df
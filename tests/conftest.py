@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""Tests sin base de datos: se ejecutan desde la raíz del repositorio (pytest tests/)."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Caché de agregados diarios: qué días se guardan y escritura atómica (sin réplica)."""
+
+import os
+import threading
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+from src.cache import agregados_diarios as ad
+
+
+def test_es_cacheable_con_hoy_explicito():
+    hoy = date(2026, 10, 17)
+    assert ad.es_cacheable(hoy - timedelta(days=ad.DIAS_MUTABLES), hoy)
+    assert not ad.es_cacheable(hoy - timedelta(days=ad.DIAS_MUTABLES - 1), hoy)
+
+
+def test_es_cacheable_usa_la_fecha_de_la_zona_de_los_dias_naturales():
+    # UTC+14 y UTC-12: a cualquier hora, "hoy" es un día distinto en cada zona
+    hoy_adelantada = datetime.now(ZoneInfo("Pacific/Kiritimati")).date()
+    fecha = hoy_adelantada - timedelta(days=ad.DIAS_MUTABLES)
+
+    assert ad.es_cacheable(fecha, set_timezone="Pacific/Kiritimati")
+    assert not ad.es_cacheable(fecha, set_timezone="Etc/GMT+12")
+
+
+def test_guardar_dia_concurrente_sin_temporales_ni_ficheros_a_medias(tmp_path):
+    raiz = str(tmp_path)
+    fecha = date(2026, 10, 1)
+    frames = [
+        ad._normalizar(pd.DataFrame({"device_id": [f"d{i}"], **{c: [i] for c in ad.CONTADORES}}))
+        for i in range(8)
+    ]
+
+    hilos = [threading.Thread(target=ad.guardar_dia, args=(df, fecha, "Europe/Madrid", raiz)) for df in frames]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    leido = ad.leer_dia_cache(fecha, "Europe/Madrid", raiz)
+    assert len(leido) == 1 and leido["device_id"].iloc[0] in {f"d{i}" for i in range(8)}
+    carpeta = os.path.dirname(ad._ruta_dia(fecha, "Europe/Madrid", raiz))
+    assert os.listdir(carpeta) == ["part.parquet"]
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Catálogo (manifiesto.jsonl): índice incremental y líneas a medio escribir."""
+
+import json
+import os
+from datetime import datetime
+
+from src.almacen import catalogo
+
+
+def _entrada(consulta: str, fecha: str, fichero: str) -> dict:
+    return {"consulta": consulta, "fecha": fecha, "filas": 10, "hash_esquema": "x", "fichero": fichero}
+
+
+def _anadir(carpeta: str, texto: str) -> None:
+    """Escritura directa al manifiesto (otro proceso, un merge de git...)."""
+    with open(catalogo.ruta_manifiesto(carpeta), "a", encoding="utf-8") as f:
+        f.write(texto)
+
+
+def _offset(carpeta: str) -> int:
+    return catalogo._indices[catalogo.ruta_manifiesto(carpeta)]["offset"]
+
+
+def test_registrar_y_consultar_por_fecha(tmp_path):
+    carpeta = str(tmp_path)
+    catalogo.registrar(carpeta, _entrada("consulta_01", "2026-01-10T12:00:00", "c1_b.parquet"))
+    catalogo.registrar(carpeta, _entrada("consulta_01", "2026-01-09T12:00:00", "c1_a.parquet"))
+    catalogo.registrar(carpeta, _entrada("consulta_02", "2026-01-11T12:00:00", "c2.parquet"))
+
+    assert [e["fichero"] for e in catalogo.entradas(carpeta, "consulta_01")] == ["c1_b.parquet", "c1_a.parquet"]
+    desde, hasta = datetime(2026, 1, 9, 13), datetime(2026, 1, 11)
+    assert [e["fichero"] for e in catalogo.entradas(carpeta, "consulta_01", desde, hasta)] == ["c1_b.parquet"]
+    assert catalogo.entrada(carpeta, "c2.parquet")["consulta"] == "consulta_02"
+    assert catalogo.ficheros(carpeta) == {"c1_a.parquet", "c1_b.parquet", "c2.parquet"}
+    assert catalogo.entradas(carpeta, "consulta_99") == []
+
+
+def test_lee_solo_lo_anadido_desde_la_ultima_vez(tmp_path):
+    carpeta = str(tmp_path)
+    catalogo.registrar(carpeta, _entrada("consulta_01", "2026-01-09T12:00:00", "a.parquet"))
+    offset = _offset(carpeta)
+    assert offset == os.path.getsize(catalogo.ruta_manifiesto(carpeta))
+
+    _anadir(carpeta, json.dumps(_entrada("consulta_01", "2026-01-10T12:00:00", "b.parquet")) + "\n")
+    assert catalogo.entradas(carpeta, "consulta_01")[0]["fichero"] == "b.parquet"
+    assert _offset(carpeta) > offset
+
+    # Una línea repetida (p. ej. tras un merge=union) no duplica la entrada
+    _anadir(carpeta, json.dumps(_entrada("consulta_01", "2026-01-10T12:00:00", "b.parquet")) + "\n")
+    assert len(catalogo.entradas(carpeta, "consulta_01")) == 2
+
+
+def test_linea_a_medio_escribir_se_indexa_al_completarse(tmp_path):
+    carpeta = str(tmp_path)
+    catalogo.registrar(carpeta, _entrada("consulta_01", "2026-01-09T12:00:00", "a.parquet"))
+    linea = json.dumps(_entrada("consulta_01", "2026-01-10T12:00:00", "b.parquet"))
+
+    _anadir(carpeta, linea[:20])
+    offset = _offset(carpeta)
+    assert [e["fichero"] for e in catalogo.entradas(carpeta, "consulta_01")] == ["a.parquet"]
+    assert _offset(carpeta) == offset  # no avanza sobre la línea incompleta
+
+    _anadir(carpeta, linea[20:] + "\n")
+    assert [e["fichero"] for e in catalogo.entradas(carpeta, "consulta_01")] == ["b.parquet", "a.parquet"]
+
+
+def test_linea_invalida_se_ignora(tmp_path, capsys):
+    carpeta = str(tmp_path)
+    _anadir(carpeta, "{no es json\n")
+    _anadir(carpeta, json.dumps({"consulta": "consulta_01"}) + "\n")  # sin fichero ni fecha
+    catalogo.registrar(carpeta, _entrada("consulta_01", "2026-01-10T12:00:00", "a.parquet"))
+
+    assert [e["fichero"] for e in catalogo.entradas(carpeta, "consulta_01")] == ["a.parquet"]
+    assert capsys.readouterr().out.count("Línea inválida") == 2
+
+
+def test_manifiesto_sustituido_por_uno_mas_corto_se_reindexa(tmp_path):
+    carpeta = str(tmp_path)
+    for i in range(3):
+        catalogo.registrar(carpeta, _entrada("consulta_01", f"2026-01-1{i}T12:00:00", f"{i}.parquet"))
+    assert len(catalogo.entradas(carpeta, "consulta_01")) == 3
+
+    with open(catalogo.ruta_manifiesto(carpeta), "w", encoding="utf-8") as f:
+        f.write(json.dumps(_entrada("consulta_01", "2026-01-20T12:00:00", "nuevo.parquet")) + "\n")
+    assert [e["fichero"] for e in catalogo.entradas(carpeta, "consulta_01")] == ["nuevo.parquet"]
+    assert catalogo.entrada(carpeta, "0.parquet") is None
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""clasificacion.clasificar frente al np.select de los umbrales anteriores."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.features.clasificacion import categorias, clasificar
+
+AHORA = pd.Timestamp("2026-01-10 12:00", tz="UTC")
+
+# Umbrales de antes de la tabla de cortes (límite inclusivo, etiqueta)
+CONEXION_ANTES = (
+    [(pd.Timedelta(days=d), e) for d, e in [
+        (1, "Conectado hoy"), (2, "Conexión 24-48h"), (3, "Conexión 48-72h"), (7, "Conexión 3-7 días"),
+        (15, "Conexión 7-15 días"), (30, "Conexión 15 días - 1 mes"), (90, "Conexión 1-3 meses"),
+    ]],
+    "Conexión >3 meses",
+    "Conexión >3 meses",
+)
+GPS_ANTES = (
+    [(pd.Timedelta(hours=h), e) for h, e in [
+        (24, "GPS activo hoy"), (48, "GPS 24-48h"), (72, "GPS 48-72h"), (168, "GPS 3-7 días"),
+        (360, "GPS 7-15 días"), (720, "GPS 15 días - 1 mes"), (2160, "GPS 1-3 meses"),
+    ]],
+    "GPS >3 meses",
+    "Sin posición GPS válida",
+)
+
+
+def _np_select(fechas: pd.Series, tramos, resto, sin_dato) -> np.ndarray:
+    antiguedad = AHORA - fechas
+    condiciones = [antiguedad.isna().to_numpy()] + [(antiguedad <= limite).to_numpy() for limite, _ in tramos]
+    return np.select(condiciones, [sin_dato] + [e for _, e in tramos], default=resto)
+
+
+def _fechas(tramos) -> pd.Series:
+    """Justo en cada límite, un segundo antes y después, aleatorias hasta 200 días, futuras y NaT."""
+    rng = np.random.default_rng(0)
+    antiguedades = [pd.Timedelta(0), pd.Timedelta(seconds=-30)]
+    for limite, _ in tramos:
+        antiguedades += [limite - pd.Timedelta(seconds=1), limite, limite + pd.Timedelta(seconds=1)]
+    antiguedades += list(pd.to_timedelta(rng.integers(0, 200 * 86400, 500), unit="s"))
+    fechas = pd.Series([AHORA - a for a in antiguedades] + [pd.NaT], dtype="datetime64[ns, UTC]")
+    return fechas.sample(frac=1, random_state=1)  # el índice desordenado también debe respetarse
+
+
+@pytest.mark.parametrize("nombre, antes", [
+    ("clasificacion_conexion", CONEXION_ANTES),
+    ("clasificacion_gps", GPS_ANTES),
+])
+def test_clasificar_coincide_con_np_select(nombre, antes):
+    fechas = _fechas(antes[0])
+    resultado = clasificar(fechas, nombre, AHORA)
+
+    assert resultado.index.equals(fechas.index)
+    assert resultado.cat.ordered and list(resultado.cat.categories) == categorias(nombre)
+    assert resultado.astype(str).tolist() == _np_select(fechas, *antes).tolist()
+
+
+def test_clasificar_acepta_texto_y_fechas_invalidas():
+    fechas = pd.Series(["2026-01-10T06:00:00Z", "no es una fecha", None])
+    resultado = clasificar(fechas, "clasificacion_gps", AHORA)
+    assert resultado.astype(str).tolist() == ["GPS activo hoy", "Sin posición GPS válida", "Sin posición GPS válida"]
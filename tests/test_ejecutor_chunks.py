@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Troceo por horas de ejecutor_chunks, con una lectura simulada (sin base de datos)."""
+
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+
+from src.db import ejecutor_chunks
+from src.db.ejecutor_chunks import (
+    CHUNK_MINIMO,
+    VentanasOmitidas,
+    _partir,
+    conexiones_chunks,
+    consulta_en_curso,
+    exigir_completo,
+    leer_adaptativo,
+    tamano_chunk,
+    ventanas_diarias,
+)
+
+INICIO = datetime(2026, 1, 10)
+
+
+def _timeout() -> OperationalError:
+    return OperationalError("SELECT ...", {}, Exception("canceling statement due to statement timeout"))
+
+
+@pytest.mark.parametrize("horas, corte", [(24, 12), (7, 3), (3, 1), (2, 1)])
+def test_partir_en_hora_entera(horas, corte):
+    primera, segunda = _partir(INICIO, INICIO + timedelta(hours=horas))
+    assert primera == (INICIO, INICIO + timedelta(hours=corte))
+    assert segunda == (INICIO + timedelta(hours=corte), INICIO + timedelta(hours=horas))
+
+
+def test_partir_con_fin_que_no_es_hora_entera():
+    fin = INICIO + timedelta(hours=5, minutes=30)
+    primera, segunda = _partir(INICIO, fin)
+    assert primera[1] == INICIO + timedelta(hours=2) and segunda[1] == fin
+    assert primera[1] - primera[0] >= CHUNK_MINIMO
+
+
+def test_ventanas_diarias_desde_medianoche():
+    ventanas = ventanas_diarias(datetime(2026, 1, 10, 15, 30), 3)
+    assert ventanas[0] == (INICIO, INICIO + timedelta(days=1))
+    assert ventanas[-1][1] == INICIO + timedelta(days=3)
+    assert all(fin == siguiente for (_, fin), (siguiente, _) in zip(ventanas, ventanas[1:]))
+
+
+def _lectura_simulada(monkeypatch, max_horas: float, horas_malas=()):
+    """leer_con_reintentos falso: timeout si el trozo pasa de `max_horas` o contiene una de `horas_malas`."""
+    leidas = []
+
+    def leer(con, sql, params, etiqueta, **kwargs):
+        ini, fin = params["desde"], params["hasta"]
+        if (fin - ini) > timedelta(hours=max_horas) or any(ini <= h < fin for h in horas_malas):
+            raise _timeout()
+        leidas.append((ini, fin))
+        return pd.DataFrame({"hora": pd.date_range(ini, fin, freq="h", inclusive="left")})
+
+    monkeypatch.setattr(ejecutor_chunks, "leer_con_reintentos", leer)
+    return leidas
+
+
+def _params(ini, fin):
+    return {"desde": ini, "hasta": fin}
+
+
+def test_leer_adaptativo_parte_por_horas_hasta_que_cabe(tmp_path, monkeypatch):
+    ruta = str(tmp_path / "tamanos.json")
+    leidas = _lectura_simulada(monkeypatch, max_horas=6)
+
+    df, omitidas = leer_adaptativo(None, "SELECT 1", _params, INICIO, INICIO + timedelta(days=1), "c", ruta=ruta)
+
+    assert omitidas == []
+    assert leidas == [(INICIO + timedelta(hours=h), INICIO + timedelta(hours=h + 6)) for h in (0, 6, 12, 18)]
+    assert df["hora"].tolist() == list(pd.date_range(INICIO, periods=24, freq="h"))  # en orden, sin huecos
+    assert tamano_chunk("c", ruta) <= timedelta(hours=12)  # aprendido: la próxima vez no empieza por el día
+
+
+def test_leer_adaptativo_omite_la_hora_que_sigue_fallando(tmp_path, monkeypatch):
+    mala = INICIO + timedelta(hours=2)
+    leidas = _lectura_simulada(monkeypatch, max_horas=24, horas_malas={mala})
+
+    df, omitidas = leer_adaptativo(
+        None, "SELECT 1", _params, INICIO, INICIO + timedelta(hours=4), "c", ruta=str(tmp_path / "t.json")
+    )
+
+    assert omitidas == [(mala, mala + CHUNK_MINIMO)]
+    assert len(df) == 3 and mala not in set(df["hora"])
+    assert all(fin <= mala or ini >= mala + CHUNK_MINIMO for ini, fin in leidas)
+
+
+def test_exigir_completo_falla_con_ventanas_omitidas_salvo_que_se_permita(capsys):
+    omitidas = [(INICIO + timedelta(hours=2), INICIO + timedelta(hours=3))]
+
+    exigir_completo("c", [])  # nada omitido: no hace nada
+    with pytest.raises(VentanasOmitidas) as error:
+        exigir_completo("c", omitidas)
+    assert error.value.ventanas == omitidas and "2026-01-10 02:00" in str(error.value)
+
+    exigir_completo("c", omitidas, permitir_incompleto=True)
+    assert "INCOMPLETO" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("max_overflow", [0, 4])
+def test_conexiones_chunks_descuenta_las_consultas_en_curso(max_overflow):
+    engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=5, max_overflow=max_overflow)
+
+    # Sin orquestador (ejecutar() suelto): todo el pool, también con max_overflow=0
+    assert conexiones_chunks(engine) == 5 + max_overflow
+    with consulta_en_curso(engine), consulta_en_curso(engine):
+        assert conexiones_chunks(engine) == 3 + max_overflow
+    assert conexiones_chunks(engine) == 5 + max_overflow
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Histórico de KPIs en deltas (src.almacen.historial), sobre carpetas temporales."""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from src.almacen import historial
+
+N_DISPOSITIVOS = 2000
+
+
+def _ejecucion(rng: np.random.Generator, recibidos: np.ndarray, validas: np.ndarray, bateria: np.ndarray, reinicios: np.ndarray) -> pd.DataFrame:
+    """Resultado de consulta_01 (columnas que se historizan + las que no) para una flota."""
+    esperados = np.full(N_DISPOSITIVOS, 96)
+    sin_gps = recibidos - validas
+    ahora = pd.Timestamp("2026-01-10 12:00", tz="UTC")
+    return pd.DataFrame({
+        "device_id": [f"dev-{i:05d}" for i in range(N_DISPOSITIVOS)],
+        "mensajes_esperados": esperados,
+        "mensajes_recibidos": recibidos,
+        "mensajes_sin_gps": sin_gps,
+        "pct_recibidos_vs_esperados": np.round(recibidos / esperados * 100, 2),
+        "pct_sin_gps_vs_esperados": np.round(sin_gps / esperados * 100, 2),
+        "pct_sin_gps_recibidos": np.round(np.divide(sin_gps, recibidos, out=np.zeros(N_DISPOSITIVOS), where=recibidos > 0), 3),
+        "Posición válida vs esperadas (%)": np.round(validas / esperados * 100, 2),
+        "Dispositivo OK (≥50% válidas vs esperadas)": validas / esperados * 100 >= 50,
+        "porcentaje_bateria": bateria,
+        "numero_reinicios": reinicios,
+        "ultimo_mensaje_recibido": ahora - pd.to_timedelta(rng.integers(0, 3600, N_DISPOSITIVOS), unit="s"),
+        "clasificacion_conexion": "Conectado hoy",
+    })
+
+
+def _dos_ejecuciones_seguidas():
+    """
+    Flota realista y la misma una hora después: 70% sanos (~96/96 mensajes), 20%
+    degradados, 10% sin señal; la ventana de 24h se mueve uno o dos mensajes,
+    la batería baja décimas y algún dispositivo se reinicia.
+    """
+    rng = np.random.default_rng(7)
+    tipo = rng.choice(["sano", "degradado", "muerto"], size=N_DISPOSITIVOS, p=[0.7, 0.2, 0.1])
+    recibidos = np.select(
+        [tipo == "sano", tipo == "degradado"],
+        [rng.integers(93, 97, N_DISPOSITIVOS), rng.integers(25, 85, N_DISPOSITIVOS)],
+        0,
+    )
+    validas = np.floor(recibidos * rng.uniform(0.85, 1.0, N_DISPOSITIVOS)).astype(int)
+    bateria = np.round(rng.uniform(20, 100, N_DISPOSITIVOS), 1)
+    reinicios = rng.integers(0, 20, N_DISPOSITIVOS)
+    antes = _ejecucion(rng, recibidos, validas, bateria, reinicios)
+
+    vivos = tipo != "muerto"
+    deriva = np.where(vivos, rng.integers(-2, 3, N_DISPOSITIVOS), 0)
+    recibidos2 = np.clip(recibidos + deriva, 0, 96)
+    validas2 = np.clip(validas + deriva, 0, recibidos2)
+    bateria2 = np.round(bateria - np.where(vivos, rng.uniform(0, 0.2, N_DISPOSITIVOS), 0), 1)
+    reinicios2 = reinicios + (rng.random(N_DISPOSITIVOS) < 0.005)
+    despues = _ejecucion(rng, recibidos2, validas2, bateria2, reinicios2)
+    return antes, despues
+
+
+def test_delta_de_dos_ejecuciones_seguidas_es_pequeno(tmp_path):
+    antes, despues = _dos_ejecuciones_seguidas()
+    fecha = datetime(2026, 1, 10, 12, 0)
+    raiz = str(tmp_path)
+
+    base = historial.registrar_en_historial(antes, "consulta_01", fecha, raiz)
+    delta = historial.registrar_en_historial(despues, "consulta_01", fecha + timedelta(hours=1), raiz)
+
+    assert base["tipo"] == "base" and base["filas"] == N_DISPOSITIVOS
+    assert delta["tipo"] == "delta"
+    # Sin PASOS_KPI cambiaría casi toda la flota viva; así solo quien cambia de estado
+    assert delta["filas"] < 0.05 * N_DISPOSITIVOS, delta
+    assert "clasificacion_conexion" not in historial.reconstruir("consulta_01", raiz=raiz).columns
+
+
+def test_sin_redondeo_casi_todos_los_dispositivos_cambian(tmp_path, monkeypatch):
+    # Referencia de lo que se evita: los porcentajes crudos cambian en cada ejecución
+    monkeypatch.setitem(historial.PASOS_KPI, "consulta_01", {})
+    antes, despues = _dos_ejecuciones_seguidas()
+    raiz = str(tmp_path)
+    historial.registrar_en_historial(antes, "consulta_01", datetime(2026, 1, 10, 12), raiz)
+    delta = historial.registrar_en_historial(despues, "consulta_01", datetime(2026, 1, 10, 13), raiz)
+    assert delta["filas"] > 0.5 * N_DISPOSITIVOS
+
+
+def _serie_de_ejecuciones(n: int = 6):
+    """Ejecuciones horarias con altas, bajas y cambios de estado entre una y otra."""
+    rng = np.random.default_rng(11)
+    flota = [f"dev-{i:05d}" for i in range(300)]
+    for k in range(n):
+        vivos = [d for i, d in enumerate(flota) if (i + k) % 17 != 0]  # bajas y altas que rotan
+        nuevos = [f"alta-{k}-{i}" for i in range(k * 3)]
+        ids = vivos + nuevos
+        recibidos = rng.integers(0, 97, len(ids))
+        yield datetime(2026, 1, 10, 12) + timedelta(hours=k), pd.DataFrame({
+            "device_id": ids,
+            "mensajes_esperados": 96,
+            "pct_recibidos_vs_esperados": recibidos / 96 * 100,
+            "porcentaje_bateria": rng.uniform(0, 100, len(ids)).round(1),
+            "numero_reinicios": rng.integers(0, 3, len(ids)),
+            "Dispositivo OK (≥50% válidas vs esperadas)": recibidos >= 48,
+        })
+
+
+def test_reconstruir_devuelve_el_estado_de_cada_ejecucion(tmp_path, monkeypatch):
+    # Rebase frecuente: la reconstrucción cruza varias bases y sus deltas
+    monkeypatch.setattr(historial, "FACTOR_REBASE", 0.6)
+    raiz = str(tmp_path)
+    estados = {}
+    for fecha, df in _serie_de_ejecuciones():
+        historial.registrar_en_historial(df, "consulta_01", fecha, raiz)
+        estados[fecha] = pd.read_parquet(tmp_path / "consulta_01" / historial.FICHERO_ESTADO).set_index("device_id")
+
+    tipos = [e["tipo"] for e in reversed(historial.catalogo.entradas(raiz, "consulta_01"))]
+    assert tipos.count("base") > 1 and "delta" in tipos
+
+    for fecha, esperado in estados.items():
+        pd.testing.assert_frame_equal(historial.reconstruir("consulta_01", fecha, raiz=raiz), esperado)
+        # Entre dos ejecuciones, el estado de la anterior
+        pd.testing.assert_frame_equal(historial.reconstruir("consulta_01", fecha + timedelta(minutes=30), raiz=raiz), esperado)
+    assert historial.reconstruir("consulta_01", datetime(2026, 1, 1), raiz=raiz).empty
+
+    columnas = ["porcentaje_bateria"]
+    ultima = max(estados)
+    pd.testing.assert_frame_equal(
+        historial.reconstruir("consulta_01", ultima, columnas=columnas, raiz=raiz), estados[ultima][columnas]
+    )
+
+    # evolucion() de un dispositivo que se da de baja y vuelve
+    serie = historial.evolucion("consulta_01", "dev-00016", "porcentaje_bateria", raiz=raiz)
+    esperada = [e["porcentaje_bateria"].get("dev-00016", np.nan) for _, e in sorted(estados.items())]
+    np.testing.assert_allclose(serie.to_numpy(dtype=float), esperada)
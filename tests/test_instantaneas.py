@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Instantáneas Parquet: ida y vuelta tipada, lectura de los dashboards y reconciliación del catálogo."""
+
+import os
+from datetime import datetime
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from src.almacen import catalogo
+from src.almacen.instantaneas import (
+    fecha_instantanea,
+    guardar_instantanea,
+    hash_esquema,
+    leer_instantanea,
+    listar_instantaneas,
+    reconstruir_manifiesto,
+    ultima_instantanea,
+)
+
+
+def _flota() -> pd.DataFrame:
+    # Textos repetidos: al guardar pasan a category (diccionario)
+    filas = []
+    for cliente, ranchos in {"Cliente A": ["Rancho 1", "Rancho 2"], "Cliente B": ["Rancho 3"]}.items():
+        for rancho in ranchos:
+            for i in range(4):
+                filas.append({"customer_name": cliente, "ranch_name": rancho, "device_id": f"{rancho}-{i}", "ok": i % 2 == 0})
+    return pd.DataFrame(filas)
+
+
+def test_kpi_por_rancho_filtrado_solo_incluye_ranchos_del_filtro(tmp_path):
+    ruta = guardar_instantanea(_flota(), "consulta_01", carpeta=str(tmp_path), exportar_csv=False)
+
+    # Carga de los dashboards
+    df = leer_instantanea(ruta, categorias=False)
+    df = df[df["customer_name"] == "Cliente B"]
+
+    dispositivos = df.groupby("ranch_name", observed=True)["device_id"].nunique()
+    assert dispositivos.to_dict() == {"Rancho 3": 4}
+
+    estado = df.groupby("ranch_name", dropna=False, observed=True)["ok"].mean()
+    assert list(estado.index) == ["Rancho 3"]
+
+
+def test_observed_evita_categorias_vacias_aunque_se_lea_como_category(tmp_path):
+    ruta = guardar_instantanea(_flota(), "consulta_01", carpeta=str(tmp_path), exportar_csv=False)
+
+    df = leer_instantanea(ruta)
+    assert isinstance(df["ranch_name"].dtype, pd.CategoricalDtype)
+    df = df[df["customer_name"] == "Cliente A"]
+
+    dispositivos = df.groupby("ranch_name", observed=True)["device_id"].nunique()
+    assert dispositivos.to_dict() == {"Rancho 1": 4, "Rancho 2": 4}
+
+
+def test_instantanea_sin_linea_en_el_manifiesto_se_encuentra(tmp_path):
+    carpeta = str(tmp_path)
+    primera = guardar_instantanea(_flota(), "consulta_01", carpeta=carpeta, exportar_csv=False)
+    assert ultima_instantanea("consulta_01", carpeta) == primera
+
+    # Llega por git (o a mano) una más reciente sin línea en el manifiesto
+    _flota().to_parquet(os.path.join(carpeta, "consulta_01_2099-01-01_08-00_v01.parquet"), index=False)
+
+    ultima = ultima_instantanea("consulta_01", carpeta)
+    assert os.path.basename(ultima) == "consulta_01_2099-01-01_08-00_v01.parquet"
+    assert fecha_instantanea(ultima) == datetime(2099, 1, 1, 8, 0)
+    assert len(listar_instantaneas("consulta_01", carpeta)) == 2
+
+
+def test_ida_y_vuelta_conserva_el_esquema_tipado(tmp_path):
+    carpeta = str(tmp_path)
+    df = _flota()
+    df["ultimo_mensaje"] = pd.date_range("2026-10-01", periods=len(df), freq="h", tz="UTC")
+    df["mensajes"] = pd.array(range(len(df)), dtype="Int32")
+    df.loc[0, "mensajes"] = pd.NA
+    df["pct"] = pd.Series(range(len(df)), dtype="float32") / 2
+    df["geom"] = [bytes([1, i]) for i in range(len(df))]
+
+    ruta = guardar_instantanea(df, "consulta_01", carpeta=carpeta, exportar_csv=False, replica="r1", duracion_s=1.23456)
+    leido = leer_instantanea(ruta)
+
+    assert str(leido["ultimo_mensaje"].dtype) == "datetime64[ns, UTC]"
+    assert leido["mensajes"].dtype == "Int32" and leido["mensajes"].isna().sum() == 1
+    assert leido["pct"].dtype == "float32"
+    assert isinstance(leido["customer_name"].dtype, pd.CategoricalDtype)
+    assert leido["device_id"].dtype == object  # todos distintos: sin diccionario
+    assert leido["geom"].tolist() == df["geom"].tolist()
+    pd.testing.assert_frame_equal(leer_instantanea(ruta, categorias=False)[list(df.columns)], df, check_dtype=False)
+
+    # Solo las columnas pedidas (las que no existen se ignoran)
+    assert list(leer_instantanea(ruta, columnas=["pct", "no_existe"]).columns) == ["pct"]
+
+    entrada = catalogo.entrada(carpeta, os.path.basename(ruta))
+    assert entrada["filas"] == len(df) and entrada["replica"] == "r1" and entrada["duracion_s"] == 1.235
+
+
+def test_reconstruir_manifiesto_anota_las_antiguas_una_sola_vez(tmp_path):
+    carpeta = str(tmp_path)
+    # Carpeta anterior al catálogo: un Parquet con su CSV exportado, un CSV suelto y un fichero ajeno
+    _flota().to_parquet(os.path.join(carpeta, "consulta_01_2025-10-13_13-21_v01.parquet"), index=False)
+    _flota().to_csv(os.path.join(carpeta, "consulta_01_2025-10-13_13-21_v01.csv"), index=False)
+    _flota().to_csv(os.path.join(carpeta, "consulta_02_2025-10-14_09-47_v02.csv"), index=False)
+    _flota().to_csv(os.path.join(carpeta, "otra_cosa.csv"), index=False)
+
+    assert reconstruir_manifiesto(carpeta) == 2
+    assert reconstruir_manifiesto(carpeta) == 0
+
+    entrada = catalogo.entrada(carpeta, "consulta_01_2025-10-13_13-21_v01.parquet")
+    esquema = pq.read_schema(os.path.join(carpeta, entrada["fichero"]))
+    assert entrada["filas"] == len(_flota())
+    assert entrada["hash_esquema"] == hash_esquema(esquema.names, [str(t) for t in esquema.types])
+    assert catalogo.entrada(carpeta, "consulta_01_2025-10-13_13-21_v01.csv") is None
+    assert catalogo.entrada(carpeta, "consulta_02_2025-10-14_09-47_v02.csv")["filas"] is None
+
+    assert [os.path.basename(r) for r in listar_instantaneas("consulta_02", carpeta)] == ["consulta_02_2025-10-14_09-47_v02.csv"]
+    assert fecha_instantanea(listar_instantaneas("consulta_01", carpeta)[0]) == datetime(2025, 10, 13, 13, 21)
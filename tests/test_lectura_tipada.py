@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Lectura tipada por lotes sobre SQLite (backend "pandas", sin réplica)."""
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+
+from src.db import lectura_tipada
+from src.db.lectura_tipada import ESQUEMA_DT01, leer_tipado
+
+FILAS = [
+    ("Rancho 1", "Cliente A", "M1", 10.5, 96, None),
+    ("Rancho 2", "Cliente A", "M1", 50.0, 96, None),
+    ("Rancho 1", "Cliente B", "M2", None, None, 3.25),
+    ("Rancho 3", "Cliente B", None, 75.0, 48, 1.5),
+    ("Rancho 3", "Cliente B", "M2", 100.0, 48, None),
+]
+
+
+@pytest.fixture()
+def con():
+    engine = create_engine("sqlite://")
+    with engine.connect() as con:
+        con.exec_driver_sql(
+            'CREATE TABLE t (ranch_name TEXT, customer_name TEXT, "Model" TEXT, '
+            "pct_recibidos_vs_esperados REAL, mensajes_esperados INTEGER, extra REAL)"
+        )
+        con.exec_driver_sql("INSERT INTO t VALUES " + ", ".join(["(?, ?, ?, ?, ?, ?)"] * len(FILAS)), tuple(v for f in FILAS for v in f))
+        yield con
+
+
+@pytest.mark.parametrize("tamano_lote", [2, 1000])
+def test_por_lotes_igual_que_de_una_vez(con, monkeypatch, tamano_lote):
+    monkeypatch.setattr(lectura_tipada, "TAMANO_LOTE_TIPADO", tamano_lote)
+
+    df = leer_tipado(con, text("SELECT * FROM t"), {}, ESQUEMA_DT01, backend="pandas")
+
+    assert len(df) == len(FILAS)
+    assert df["pct_recibidos_vs_esperados"].dtype == "float32"
+    assert df["mensajes_esperados"].dtype == "Int32"
+    assert isinstance(df["Model"].dtype, pd.CategoricalDtype)
+    # Columna fuera del esquema con un lote todo NULL: sigue siendo numérica
+    assert df["extra"].dtype == "float64"
+    assert df["extra"].tolist()[2:4] == [3.25, 1.5]
+
+
+def test_ranch_y_customer_no_son_category_y_se_agrupan_sin_grupos_vacios(con):
+    df = leer_tipado(con, text("SELECT * FROM t"), {}, ESQUEMA_DT01, backend="pandas")
+    assert df["ranch_name"].dtype == object and df["customer_name"].dtype == object
+
+    df = df[df["customer_name"] == "Cliente B"]
+    assert df.groupby("ranch_name")["mensajes_esperados"].count().index.tolist() == ["Rancho 1", "Rancho 3"]
+
+
+def test_sin_filas_devuelve_las_columnas(con):
+    df = leer_tipado(con, text("SELECT * FROM t WHERE 1 = 0"), {}, ESQUEMA_DT01, backend="pandas")
+    assert df.empty and "ranch_name" in df.columns
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Modo offline (motor_duckdb): el SQL de las consultas sobre una instantánea Parquet mínima."""
+
+import json
+import re
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+import shapely
+
+pytest.importorskip("duckdb")
+
+from src.offline import motor_duckdb  # noqa: E402
+
+HASTA = pd.Timestamp("2026-01-10 12:00", tz="UTC")
+DIAS = 3
+
+# d1 sano, d6 sin mensajes ni posición (y su gateway sin coordenadas); d2-d4 no pasan los filtros (deshabilitado,
+# en stock, animal dado de baja). d5 tiene IgnoreStatisticsUntil futuro: solo
+# consulta_01 lo excluye
+INCLUIDOS = {"consulta_01": {"d1", "d6"}, "consulta_02": {"d1", "d5", "d6"}, "consulta_06": {"d1", "d5", "d6"}, "consulta_07": {"d1", "d5", "d6"}}
+
+
+def _wkb(lon: float, lat: float) -> str:
+    """Geometría como la devuelve Postgres al extraer (EWKB en hex, SRID 4326)."""
+    return shapely.to_wkb(shapely.set_srid(shapely.Point(lon, lat), 4326), hex=True, include_srid=True)
+
+
+MADRID, SEVILLA = _wkb(-3.7, 40.4), _wkb(-5.9, 37.4)
+
+
+def _uplinks() -> pd.DataFrame:
+    # d1: 3 posiciones válidas y 1 sin GPS en las últimas 24h + 1 mensaje de hace 2 días
+    filas = [
+        ("d1", HASTA - timedelta(hours=1), True, True, False, None, MADRID),
+        ("d1", HASTA - timedelta(hours=5), True, True, True, None, MADRID),
+        ("d1", HASTA - timedelta(hours=9), True, True, False, None, MADRID),
+        ("d1", HASTA - timedelta(hours=20), False, False, False, None, None),
+        ("d1", HASTA - timedelta(days=2), True, False, False, "distance", MADRID),
+    ]
+    filas += [(d, HASTA - timedelta(hours=2), True, True, False, None, SEVILLA) for d in ("d2", "d3", "d4", "d5")]
+    return pd.DataFrame(filas, columns=["DeviceId", "Time", "HasLocation", "IsValid", "IsLowAccuracy", "InvalidReason", "Location"])
+
+
+@pytest.fixture(scope="module")
+def instantanea(tmp_path_factory):
+    """Carpeta con las mismas tablas (y columnas) que escribe extraer_instantanea()."""
+    ruta = tmp_path_factory.mktemp("offline")
+    ids = ["d1", "d2", "d3", "d4", "d5", "d6"]
+    tablas = {
+        "Customers": pd.DataFrame({"Id": ["c1"], "Name": ["Cliente 1"], "Status": ["active"]}),
+        "Ranches": pd.DataFrame({
+            "Id": ["r1", "r2"], "Name": ["Ganadería Norte", "Ganadería Sur"], "CustomerId": "c1",
+            "Country": "ES", "Region": ["Madrid", "Sevilla"],
+        }),
+        "Devices": pd.DataFrame({
+            "Id": ids,
+            "SerialNumber": [f"SN-{d}" for d in ids],
+            "Model": "collar",
+            "RanchId": ["r1"] * 5 + ["r2"],
+            "UplinksPerDay": 4,
+            "Disabled": [False, True, False, False, False, False],
+            "StatusType": ["shipped", "shipped", "stock", "shipped", "shipped", "shipped"],
+            "IgnoreStatisticsUntil": [None, None, None, None, date(2026, 1, 12), None],
+            "LastSeenOn": HASTA - timedelta(hours=1),
+            "ResetsCount": 2,
+            "AverageGpsTtf": 30.0,
+            "BatteryEstimation": 80.0,
+            "ChangedBatteryOn": HASTA - timedelta(days=100),
+            "SumUplinksCount": 1000,
+        }),
+        "Animals": pd.DataFrame({
+            "DeviceId": ids,
+            "Name": [f"Vaca {d}" for d in ids],
+            "Specie": "cow",
+            "IsDeregistered": [False, False, False, True, False, False],
+        }),
+        # g2 sin coordenadas (POINT EMPTY): wkb_x/wkb_y devuelven NULL
+        "LoraGateways": pd.DataFrame({
+            "Id": ["g1", "g2"], "Name": ["Gateway 1", "Gateway 2"], "SerialNumber": ["GW-1", "GW-2"],
+            "LastSeenAt": HASTA - timedelta(minutes=10), "CreatedAt": HASTA - timedelta(days=400),
+            "Location": [MADRID, shapely.to_wkb(shapely.Point(), hex=True)],
+        }),
+        "RanchesLoraGateways": pd.DataFrame({"RanchId": ["r1", "r2"], "GatewayId": ["g1", "g2"]}),
+        "DeviceLocations": _uplinks(),
+        # d6 no tiene fila: geometría NULL tras el LEFT JOIN
+        "ultimo_estado": pd.DataFrame({
+            "device_id": ["d1", "d2", "d3", "d4", "d5"],
+            "ultimo_mensaje_recibido": [HASTA - timedelta(hours=1)] + [HASTA - timedelta(hours=2)] * 4,
+            "ultima_posicion_gps_valida": [HASTA - timedelta(hours=1)] + [HASTA - timedelta(hours=2)] * 4,
+            "ultima_posicion_geom": [MADRID] + [SEVILLA] * 4,
+        }),
+    }
+    for nombre, df in tablas.items():
+        df.to_parquet(ruta / f"{nombre}.parquet", index=False)
+    with open(ruta / motor_duckdb.FICHERO_INSTANTANEA, "w", encoding="utf-8") as f:
+        json.dump({"desde": (HASTA - timedelta(days=DIAS)).isoformat(), "hasta": HASTA.isoformat(), "dias": DIAS, "filas": {}}, f)
+    return str(ruta)
+
+
+# Mensajes de d1 según la ventana de cada consulta: 24h móviles (01, 06), el día
+# natural de ayer en Madrid (02: solo el de hace 20h) o 24h/3d (07)
+ESPERADOS_D1 = {
+    "consulta_01": {"mensajes_recibidos": 4, "mensajes_sin_gps": 1, "pct_recibidos_vs_esperados": 100.0},
+    "consulta_02": {"mensajes_recibidos": 1, "mensajes_sin_gps": 1, "pct_recibidos_vs_esperados": 25.0},
+    "consulta_06": {"mensajes_recibidos": 4, "mensajes_sin_gps": 1, "pct_recibidos_vs_esperados": 100.0},
+    "consulta_07": {"recibidos_n_24h": 4, "recibidos_n_3d": 5},
+}
+
+
+@pytest.mark.parametrize("nombre", list(ESPERADOS_D1))
+def test_consulta_offline_filtra_y_cuenta_como_en_postgres(instantanea, nombre):
+    opciones = {"ventanas": {"24h": timedelta(hours=24), "3d": timedelta(days=3)}} if nombre == "consulta_07" else {}
+    df = motor_duckdb.ejecutar_consulta_local(nombre, ruta=instantanea, **opciones).set_index("device_id")
+
+    assert set(df.index) == INCLUIDOS[nombre]
+    assert df.loc["d1", "mensajes_esperados"] == 4
+    for columna, valor in ESPERADOS_D1[nombre].items():
+        assert df.loc["d1", columna] == valor, columna
+        assert df.loc["d6", columna] == 0, columna
+
+
+def test_consulta_01_coordenadas_desde_el_wkb(instantanea):
+    # ST_X/ST_Y del gateway → wkb_x/wkb_y; el gateway de d6 no tiene coordenadas (NULL, no error)
+    df = motor_duckdb.ejecutar_consulta_local("consulta_01", ruta=instantanea).set_index("device_id")
+    assert df.loc["d1", "ranch_name"] == "Ganadería Norte"
+    assert df.loc["d1", ["gateway_lon", "gateway_lat"]].tolist() == pytest.approx([-3.7, 40.4])
+    assert df.loc["d6", ["gateway_lon", "gateway_lat"]].isna().all()
+
+
+def test_adaptar_sql_sin_sintaxis_de_postgres():
+    from scripts.consultas.consulta_01 import query as sql_01
+    from scripts.consultas.consulta_02 import query as sql_02
+    from scripts.consultas.consulta_06 import query as sql_06
+    from scripts.consultas.consulta_07 import construir_query
+
+    for sql in (sql_01, sql_02, sql_06, construir_query(None)):
+        adaptado = motor_duckdb.adaptar_sql(str(sql), HASTA.isoformat())
+        assert not re.search(r"\bNOW\(\)", adaptado, re.IGNORECASE)
+        assert not re.search(r"(?<![:\w]):\w+", adaptado)  # :param → $param (los ::cast se quedan)
+        assert "make_interval" not in adaptado and "ST_X(" not in adaptado
+        assert f"CAST('{HASTA.isoformat()}' AS TIMESTAMPTZ)" in adaptado or "NOW" not in str(sql).upper()
+
+
+def test_ventana_sin_datos_suficientes_avisa(instantanea, capsys):
+    motor_duckdb.ejecutar_consulta_local("consulta_07", ruta=instantanea, ventanas={"30d": timedelta(days=30)})
+    assert "supera los 3 días" in capsys.readouterr().out
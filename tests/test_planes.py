@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Planes: lectura del NOTICE de auto_explain y detección de regresiones (sin réplica)."""
+
+import json
+
+from src.db import planes
+
+
+def _plan(tipo="Index Scan", filas=100, ejecucion_ms=500.0, spill=False):
+    hoja = {"Node Type": tipo, "Relation Name": "DeviceLocations", "Plan Rows": filas, "Actual Rows": filas, "Actual Loops": 1}
+    sort = {"Node Type": "Sort", "Plan Rows": filas, "Sort Space Type": "Disk" if spill else "Memory", "Plans": [hoja]}
+    return [{"Plan": sort, "Execution Time": ejecucion_ms}]
+
+
+def _resumen(**kwargs):
+    return planes.resumir_plan(_plan(**kwargs))
+
+
+def test_sin_cambios_no_hay_regresiones():
+    assert planes.detectar_regresiones(_resumen(), _resumen()) == []
+    assert planes.detectar_regresiones(_resumen(), None) == []
+
+
+def test_detecta_seq_scan_salto_de_filas_spill_y_tiempo():
+    previo = _resumen()
+    actual = _resumen(tipo="Seq Scan", filas=100_000, ejecucion_ms=5000.0, spill=True)
+
+    avisos = planes.detectar_regresiones(actual, previo)
+
+    assert "Seq Scan sobre DeviceLocations" in avisos
+    assert any(a.startswith("Filas estimadas en Sort:-") for a in avisos)
+    assert "Sort a disco en Sort:-" in avisos
+    assert "Ejecución 500 ms → 5000 ms" in avisos
+
+
+def test_umbrales_minimos_de_filas_y_tiempo():
+    # x10 filas pero por debajo de MIN_FILAS_SALTO; x4 tiempo pero por debajo de MIN_TIEMPO_MS
+    avisos = planes.detectar_regresiones(_resumen(filas=500, ejecucion_ms=200.0), _resumen(filas=50, ejecucion_ms=50.0))
+    assert avisos == []
+
+
+def test_plan_desde_aviso_de_auto_explain():
+    cuerpo = {"Query Text": "SELECT 1", "Plan": _plan()[0]["Plan"]}
+    aviso = f"NOTICE:  duration: 1234.567 ms  plan:\n{json.dumps(cuerpo, indent=2)}\n"
+
+    explain = planes.plan_desde_aviso(aviso)
+
+    assert explain[0]["Execution Time"] == 1234.567
+    assert planes.resumir_plan(explain)["nodos"][1]["relacion"] == "DeviceLocations"
+    assert planes.plan_desde_aviso("NOTICE:  relation already exists\n") is None
+
+
+def test_registrar_plan_compara_con_el_ultimo_guardado(tmp_path):
+    raiz = str(tmp_path)
+    assert planes.registrar_plan(_plan(), "consulta_x", raiz=raiz)["regresiones"] == []
+
+    registro = planes.registrar_plan(_plan(tipo="Seq Scan"), "consulta_x", raiz=raiz)
+
+    assert registro["regresiones"] == ["Seq Scan sobre DeviceLocations"]
+    assert planes.ultimo_plan("consulta_x", raiz)["resumen"]["nodos"][1]["tipo"] == "Seq Scan"
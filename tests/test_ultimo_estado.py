@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Último estado: fusión del delta, marca de agua y reconciliación completa (sin réplica)."""
+
+from contextlib import nullcontext
+
+import pandas as pd
+import shapely
+
+from src.cache import ultimo_estado as ue
+
+
+def _estado(filas) -> pd.DataFrame:
+    # lon/lat no se pasan: _normalizar los saca del WKB
+    return ue._normalizar(pd.DataFrame(filas, columns=ue.COLUMNAS[:4]))
+
+
+T = pd.Timestamp
+
+
+def test_fusionar_se_queda_con_lo_mas_reciente_y_su_geometria():
+    previo = _estado([
+        ("d1", T("2026-10-01 10:00", tz="UTC"), T("2026-10-01 09:00", tz="UTC"), "GEOM_VIEJA"),
+        ("d2", T("2026-10-01 10:00", tz="UTC"), None, None),
+    ])
+    # d1: mensaje nuevo sin GPS → conserva la posición anterior; d3 es nuevo
+    delta = _estado([
+        ("d1", T("2026-10-02 10:00", tz="UTC"), None, None),
+        ("d3", T("2026-10-02 11:00", tz="UTC"), T("2026-10-02 11:00", tz="UTC"), "GEOM_D3"),
+    ])
+
+    estado = ue._fusionar(previo, delta).set_index("device_id")
+
+    assert list(estado.index) == ["d1", "d2", "d3"]
+    assert estado.loc["d1", "ultimo_mensaje_recibido"] == T("2026-10-02 10:00", tz="UTC")
+    assert estado.loc["d1", "ultima_posicion_gps_valida"] == T("2026-10-01 09:00", tz="UTC")
+    assert estado.loc["d1", "ultima_posicion_geom"] == "GEOM_VIEJA"
+    assert pd.isna(estado.loc["d2", "ultima_posicion_gps_valida"])
+    assert estado.loc["d3", "ultima_posicion_geom"] == "GEOM_D3"
+
+
+def test_marca_de_agua_no_pasa_de_ahora_con_un_time_futuro():
+    ahora = T("2026-10-17 12:00", tz="UTC")
+    previo = _estado([
+        ("d1", T("2026-10-17 11:00", tz="UTC"), None, None),
+        ("d2", T("2030-01-01 00:00", tz="UTC"), None, None),  # reloj del dispositivo adelantado
+    ])
+
+    assert ue.marca_de_agua(previo, ahora, solape_horas=6) == T("2026-10-17 06:00", tz="UTC")
+    assert ue.marca_de_agua(_estado([]), ahora) is None
+
+
+def test_toca_reconciliar_segun_la_ultima_reconciliacion(tmp_path):
+    ruta = str(tmp_path / "ultimo_estado.parquet")
+    ahora = T("2026-10-17 12:00", tz="UTC")
+
+    assert ue.toca_reconciliar(ruta, ahora, horas=24)
+    ue._guardar_reconciliacion(ruta, ahora - pd.Timedelta(hours=2))
+    assert not ue.toca_reconciliar(ruta, ahora, horas=24)
+    assert ue.toca_reconciliar(ruta, ahora + pd.Timedelta(hours=23), horas=24)
+    assert not ue.toca_reconciliar(ruta, ahora + pd.Timedelta(days=30), horas=0)
+
+
+def test_actualizar_incremental_y_reconciliacion_completa(tmp_path, monkeypatch):
+    ruta = str(tmp_path / "ultimo_estado.parquet")
+    consultas = []
+    respuestas = []
+
+    def _leer(sql, con, params):
+        consultas.append(params["desde"])
+        return respuestas.pop(0)
+
+    class _Engine:
+        def connect(self):
+            return nullcontext(None)
+
+    monkeypatch.setattr(ue.pd, "read_sql_query", _leer)
+    monkeypatch.setattr(ue, "RECONCILIAR_HORAS", 24)
+
+    # 1) Sin estado: histórico completo (incluye un uplink con fecha futura)
+    respuestas.append(_estado([
+        ("d1", T("2026-10-16 10:00", tz="UTC"), None, None),
+        ("d2", T("2030-01-01 00:00", tz="UTC"), None, None),
+    ]))
+    ue._actualizar(_Engine(), ruta)
+    assert consultas[-1] == "-infinity"
+
+    # 2) Incremental: la marca queda acotada a ahora, no al 2030
+    respuestas.append(_estado([]))
+    ue._actualizar(_Engine(), ruta)
+    assert pd.Timestamp(consultas[-1]) <= pd.Timestamp.now(tz="UTC")
+
+    # 3) Vencida la reconciliación: recorrido completo que sustituye al estado previo
+    ue._guardar_reconciliacion(ruta, pd.Timestamp.now(tz="UTC") - pd.Timedelta(days=2))
+    respuestas.append(_estado([("d1", T("2026-10-16 10:00", tz="UTC"), None, None)]))
+    estado = ue._actualizar(_Engine(), ruta)
+    assert consultas[-1] == "-infinity"
+    assert estado["device_id"].tolist() == ["d1"]
+
+
+def test_restringir_a_dispositivos_solo_envia_la_base():
+    estado = _estado([
+        ("d1", T("2026-10-16 10:00", tz="UTC"), None, None),
+        ("d2", T("2026-10-16 11:00", tz="UTC"), T("2026-10-16 11:00", tz="UTC"), "GEOM_D2"),
+        ("d3", T("2026-10-16 12:00", tz="UTC"), None, None),
+    ])
+    params = {**ue.parametros_sql(estado), "ranch_names": ["R"]}
+
+    reducidos = ue.restringir_a_dispositivos(params, ["d2", "d9"])
+
+    assert reducidos["ue_device_id"] == ["d2"]
+    assert reducidos["ue_ultima_geom"] == ["GEOM_D2"]
+    assert len(reducidos["ue_ultimo_mensaje"]) == len(reducidos["ue_ultima_gps"]) == 1
+    assert reducidos["ranch_names"] == ["R"]
+    assert ue.restringir_a_dispositivos(params, [])["ue_device_id"] == []
+
+
+def test_lon_lat_en_la_cache_y_sin_wkb_en_la_variante_con_coordenadas():
+    wkb = shapely.to_wkb(shapely.Point(-3.7, 40.4), hex=True)
+    estado = _estado([("d1", T("2026-10-16 10:00", tz="UTC"), T("2026-10-16 10:00", tz="UTC"), wkb)])
+    assert estado[["ultima_posicion_lon", "ultima_posicion_lat"]].iloc[0].tolist() == [-3.7, 40.4]
+
+    params = ue.parametros_sql(estado)
+    assert params["ue_ultima_lon"] == [-3.7] and params["ue_ultima_lat"] == [40.4]
+
+    sql = f"WITH {ue.SQL_GPS_STATS_FULL}\nSELECT\n  gf.ultima_posicion_geom,\n  1\nFROM gps_stats_full gf"
+    xy = ue.con_coordenadas_en_servidor(sql)
+    assert ":ue_ultima_geom" not in xy and "ST_X" not in xy
+    assert ":ue_ultima_lon" in xy and "gf.ultima_posicion_lon" in xy
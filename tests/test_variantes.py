@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""variantes.resultados_equivalentes: mismas filas sin importar orden ni ruido de redondeo."""
+
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from src.db.variantes import resultados_equivalentes
+
+
+def _referencia() -> pd.DataFrame:
+    return pd.DataFrame({
+        "device_id": ["a", "b", "c", "d"],
+        "mensajes": [96, 40, 0, 12],
+        "pct": [100.0, 41.666667, np.nan, 12.5],
+        "ranch_name": ["Norte", None, "Sur", "Sur"],
+    })
+
+
+def test_mismas_filas_en_otro_orden_y_columnas_reordenadas():
+    ref = _referencia()
+    cand = ref.iloc[[3, 1, 0, 2]][["pct", "ranch_name", "device_id", "mensajes"]]
+    assert resultados_equivalentes(ref, cand) == (True, "")
+
+
+def test_ruido_por_debajo_de_seis_decimales_y_decimal():
+    ref = _referencia()
+    cand = ref.copy()
+    cand["pct"] = cand["pct"] + 1e-9
+    assert resultados_equivalentes(ref, cand)[0]
+
+    cand = ref.copy()
+    cand["pct"] = [Decimal("100.0"), Decimal("41.666667"), None, Decimal("12.5")]
+    assert resultados_equivalentes(ref, cand)[0]
+
+
+def test_columnas_distintas():
+    ref = _referencia()
+    equivalentes, motivo = resultados_equivalentes(ref, ref.rename(columns={"pct": "porcentaje"}))
+    assert not equivalentes
+    assert "faltan ['pct']" in motivo and "sobran ['porcentaje']" in motivo
+
+
+def test_numero_de_filas_distinto():
+    ref = _referencia()
+    assert resultados_equivalentes(ref, ref.iloc[:3]) == (False, "filas: 4 vs 3")
+
+
+def test_un_valor_distinto():
+    ref = _referencia()
+    cand = ref.copy()
+    cand.loc[1, "mensajes"] = 41
+    equivalentes, motivo = resultados_equivalentes(ref, cand)
+    assert not equivalentes
+    assert motivo == "1 filas distintas (columnas: mensajes)"
+
+
+def test_null_no_equivale_a_cero():
+    ref = _referencia()
+    cand = ref.copy()
+    cand["pct"] = cand["pct"].fillna(0)
+    assert not resultados_equivalentes(ref, cand)[0]